@@ -21,6 +21,7 @@ BuildRequires:  systemd-units
 
 Requires:       %{python_interp}
 Requires:       %{python_interp}-psutil
+Recommends:     %{python_interp}-requests
 
 Requires(post):    systemd-units
 Requires(preun):   systemd-units
@@ -54,7 +55,7 @@ systemctl enable %{srcname}.service > /dev/null 2>&1 || :
 %systemd_postun_with_restart %{srcname}.service
 
 %files
-%exclude %{python3_sitelib}/__pycache__
+%{python3_sitelib}/__pycache__/%{srcname}.*.pyc
 %{_bindir}/%{srcname}-daemon
 %{python3_sitelib}/*.egg-info
 %{python3_sitelib}/%{srcname}.py
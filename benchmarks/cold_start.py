@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Measure how long the daemon and the CLI subcommands take to start, and how fast `status` answers through the control socket.
+
+A daemon is started with thresholds of 0, so it never kills anything. Each command is run --runs times as a fresh
+process and timed from spawn to exit. Results are printed as JSON.
+"""
+
+import os
+import sys
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import subprocess
+import configparser
+
+import harness
+
+DAEMON = os.path.join(harness.REPO_ROOT, 'oomkiller.py')
+
+def write_daemon_config(path, workdir):
+    """Write a daemon config from the repo's oomkiller.conf that never kills and answers on a control socket in `workdir`."""
+    config = configparser.ConfigParser()
+    config.read(os.path.join(harness.REPO_ROOT, 'oomkiller.conf'))
+    config['General'].update({
+        'min_available_memory_percentage': '0', 'min_available_swap_percentage': '0', 'enable_notifications': 'false',
+        'trigger_mode': 'interval', 'log_path': os.path.join(workdir, 'daemon.log'),
+        'history_path': os.path.join(workdir, 'history.db'), 'control_socket': os.path.join(workdir, 'control.sock'),
+    })
+    with open(path, 'w') as f:
+        config.write(f)
+
+def socket_ready(path):
+    """Whether something accepts connections on the Unix socket at `path`."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+def time_command(argv, runs):
+    """Run a command `runs` times and return the wall-clock durations in seconds; fail if any run exits non-zero."""
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(argv, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20, help="Runs per command (default: 20)")
+    parser.add_argument('--output', help="Write the JSON result to this file instead of stdout")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='oomkiller-cold-start-')
+    config_path = os.path.join(workdir, 'oomkiller.conf')
+    write_daemon_config(config_path, workdir)
+    socket_path = os.path.join(workdir, 'control.sock')
+    daemon = None
+    try:
+        starts = []
+        for _ in range(min(args.runs, 5)):
+            start = time.perf_counter()
+            daemon = subprocess.Popen([sys.executable, DAEMON, '--config', config_path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            while not socket_ready(socket_path):
+                if daemon.poll() is not None or time.perf_counter() - start > 30:
+                    raise SystemExit("Daemon did not open its control socket, see daemon.log.")
+                time.sleep(0.005)
+            starts.append(time.perf_counter() - start)
+            daemon.terminate()
+            daemon.wait(10)
+
+        daemon = subprocess.Popen([sys.executable, DAEMON, '--config', config_path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        while not socket_ready(socket_path):
+            time.sleep(0.005)
+        base = [sys.executable, DAEMON, '--config', config_path]
+        harness.emit({
+            'runs': args.runs,
+            'daemon_ready': harness.summarize_ms(starts),
+            'python_startup': harness.summarize_ms(time_command([sys.executable, '-c', 'pass'], args.runs)),
+            'help': harness.summarize_ms(time_command(base + ['--help'], args.runs)),
+            'status': harness.summarize_ms(time_command(base + ['status'], args.runs)),
+            'history': harness.summarize_ms(time_command(base + ['history', '--limit', '1'], args.runs)),
+        }, args.output)
+    finally:
+        if daemon is not None and daemon.poll() is None:
+            daemon.terminate()
+            daemon.wait(10)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Measure that the daemon's critical path keeps a flat RSS and a bounded reaction time while a memory hog runs.
+
+Phase 1 holds a hog and runs the detect -> scan -> select path repeatedly, recording the daemon's own RSS.
+Phase 2 lets a hog grow across the threshold and times detection, kill and recovery.
+Only the benchmark's own hog is ever signalled.
+"""
+
+import sys
+import time
+import argparse
+
+import psutil
+
+import harness
+
+def steady_pressure(ok, hog_mb, iterations):
+    """Run the critical path `iterations` times while a hog holds `hog_mb`, recording latency and daemon RSS."""
+    hog = harness.spawn_hog(hog_mb)
+    latencies = []
+    rss = []
+    try:
+        avoid_names = set(ok.validated_config['avoid_processes'])
+        for _ in range(iterations):
+            start = time.perf_counter()
+            _, _, available_memory_percentage, available_swap_percentage = ok.check_memory_swap_usage()
+            hogs = ok.get_memory_hogs(set(), avoid_names, [harness.HOG_NAME])
+            ok.select_victims(hogs, ok.estimate_memory_deficit(available_memory_percentage, available_swap_percentage))
+            latencies.append(time.perf_counter() - start)
+            rss.append(ok.read_proc_rss('self'))
+    finally:
+        harness.stop_hog(hog)
+    # 前几次迭代会填充进程表，增长从预热之后算起 / The first iterations fill the process table, so growth is measured after warm-up
+    warm = rss[min(len(rss) - 1, 5):]
+    return {
+        'iterations': iterations,
+        'latency': harness.summarize_ms(latencies),
+        'rss_start_kb': rss[0] // 1024,
+        'rss_max_kb': max(rss) // 1024,
+        'rss_end_kb': rss[-1] // 1024,
+        'rss_growth_after_warmup_kb': (warm[-1] - warm[0]) // 1024,
+    }
+
+def reaction(ok, hog_mb, hog_rate_mb, poll_interval):
+    """Let a hog grow across a threshold set at half its size and time detect -> select -> exit -> recovered."""
+    vm = psutil.virtual_memory()
+    ok.validated_config['min_available_memory_percentage'] = (vm.available - hog_mb * 1024 * 1024 / 2) / vm.total * 100
+    hog = harness.spawn_hog(hog_mb, hog_rate_mb, wait_ready=False)
+    try:
+        deadline = time.monotonic() + hog_mb / hog_rate_mb * 2 + 5
+        while True:
+            memory_ok, swap_ok, available_memory_percentage, available_swap_percentage = ok.check_memory_swap_usage()
+            if not memory_ok or not swap_ok:
+                break
+            if time.monotonic() > deadline:
+                return {'error': 'threshold never crossed'}
+            time.sleep(poll_interval)
+        detected = time.perf_counter()
+        hogs = ok.get_memory_hogs(set(), set(ok.validated_config['avoid_processes']), [harness.HOG_NAME])
+        victims = harness.hog_victims(ok.select_victims(hogs, ok.estimate_memory_deficit(available_memory_percentage, available_swap_percentage)), {hog.pid})
+        selected = time.perf_counter()
+        if not victims:
+            return {'error': 'hog was not selected as victim'}
+        failed = harness.run(ok.kill_processes(victims))
+        exited = time.perf_counter()
+        while not all(ok.check_memory_swap_usage()[:2]) and time.perf_counter() - exited < 10:
+            time.sleep(poll_interval)
+        recovered = time.perf_counter()
+    finally:
+        harness.stop_hog(hog)
+    return {
+        'killed': not failed,
+        'poll_interval_ms': poll_interval * 1000,
+        'detect_to_select_ms': round((selected - detected) * 1000, 3),
+        'detect_to_exit_ms': round((exited - detected) * 1000, 3),
+        'detect_to_recovered_ms': round((recovered - detected) * 1000, 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--config', help="Daemon configuration to benchmark (default: the repo's oomkiller.conf)")
+    parser.add_argument('--hog-mb', type=int, default=512, help="Memory hog size in MB (default: 512)")
+    parser.add_argument('--hog-rate-mb', type=float, default=256, help="Hog allocation rate in MB/s for the reaction phase (default: 256)")
+    parser.add_argument('--iterations', type=int, default=200, help="Critical path iterations under steady pressure (default: 200)")
+    parser.add_argument('--poll-interval', type=float, default=0.05, help="Polling interval in seconds for the reaction phase (default: 0.05)")
+    parser.add_argument('--emergency', action='store_true', help="Enable emergency mode (mlockall, priority, oom_score_adj) first")
+    parser.add_argument('--output', help="Write the JSON result to this file instead of stdout")
+    args = parser.parse_args()
+
+    ok = harness.setup(args.config, kill_wait_seconds=1, max_batch_kills=1)
+    if args.emergency:
+        ok.enable_emergency_mode()
+    harness.emit({
+        'emergency': args.emergency,
+        'steady_pressure': steady_pressure(ok, args.hog_mb, args.iterations),
+        'reaction': reaction(ok, args.hog_mb, args.hog_rate_mb, args.poll_interval),
+    }, args.output)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Run one fleet collector with several daemons and simulated agents on localhost and measure ingest and query latency.
+
+Real daemons (--daemons) run with thresholds of 0, so they never kill anything and only stream memory samples. Simulated
+agents (--agents) replay kill events over one persistent connection each, as fast as the collector accepts them, while
+stalled clients (--stalled-readers) send queries and never read the replies. Everything uses a shared fleet token; a
+query without it must be rejected. Results are printed as JSON.
+"""
+
+import os
+import sys
+import time
+import random
+import json
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import threading
+import subprocess
+import configparser
+
+import harness
+
+ok = harness.oomkiller
+DAEMON = os.path.join(harness.REPO_ROOT, 'oomkiller.py')
+
+def wait_for(predicate, timeout, interval=0.05):
+    """Poll predicate() until it returns a true value or `timeout` seconds pass; return its last value."""
+    deadline = time.monotonic() + timeout
+    while True:
+        value = predicate()
+        if value or time.monotonic() >= deadline:
+            return value
+        time.sleep(interval)
+
+def count_rows(db_path, sql):
+    """Run a COUNT query against the collector database, 0 while it does not exist yet."""
+    try:
+        db = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+        try:
+            return db.execute(sql).fetchone()[0]
+        finally:
+            db.close()
+    except sqlite3.Error:
+        return 0
+
+def write_daemon_config(path, workdir, address, node, token):
+    """Write a daemon config from the repo's oomkiller.conf that never kills and streams samples to the collector."""
+    config = configparser.ConfigParser()
+    config.read(os.path.join(harness.REPO_ROOT, 'oomkiller.conf'))
+    config['General'].update({
+        'min_available_memory_percentage': '0', 'min_available_swap_percentage': '0', 'query_interval_seconds': '1',
+        'min_query_interval_seconds': '1', 'enable_notifications': 'false', 'history_path': '', 'trigger_mode': 'interval',
+        'log_path': os.path.join(workdir, f'{node}.log'),
+    })
+    config['Fleet'] = {'fleet_collector': address, 'fleet_node_name': node, 'fleet_token': token, 'fleet_batch_seconds': '0.2', 'fleet_sample_seconds': '0.5'}
+    with open(path, 'w') as f:
+        config.write(f)
+
+def simulated_agent(address, token, node, events, batch, seed):
+    """Send `events` kill events for `node` in batches of `batch` over one connection."""
+    rng = random.Random(seed)
+    sock = ok.open_fleet_socket(address)
+    try:
+        sock.sendall(ok.encode_fleet_events([{'type': 'hello', 'node': node, 'version': 1, 'token': token}]))
+        for start in range(0, events, batch):
+            now = time.time()
+            sock.sendall(ok.encode_fleet_events([
+                {'type': 'kill', 'time': now, 'incident': now, 'kind': 'process', 'pid': rng.randrange(1000, 4000000),
+                 'user': f'user{rng.randrange(50)}', 'name': f'job{rng.randrange(20)}', 'cmdline_hash': f'{rng.randrange(1 << 32):08x}',
+                 'rss': rng.randrange(1 << 30), 'signal': 'SIGTERM', 'outcome': 'terminated', 'exit_seconds': rng.random(),
+                 'reclaimed': rng.randrange(1 << 30)}
+                for _ in range(min(batch, events - start))]))
+    finally:
+        sock.close()
+
+def stalled_reader(address, token, stop):
+    """Send queries and never read the replies until `stop` is set, like a client stuck on a slow link."""
+    sock = ok.open_fleet_socket(address)
+    sock.settimeout(0.5)
+    try:
+        while not stop.is_set():
+            try:
+                sock.sendall(ok.encode_fleet_events([{'type': 'query', 'query': 'top-commands', 'hours': 24, 'limit': 1000, 'token': token}] * 50))
+            except OSError:
+                time.sleep(0.1) # 收集端暂停读取或已断开 / The collector stopped reading or dropped us
+    finally:
+        sock.close()
+
+def timed_query(address, query_name, token=None):
+    """Run one fleet query and return (seconds, reply)."""
+    start = time.perf_counter()
+    query = {'type': 'query', 'query': query_name, 'hours': 24, 'limit': 20}
+    if token is not None:
+        query['token'] = token
+    sock = ok.open_fleet_socket(address)
+    try:
+        sock.sendall(ok.encode_fleet_events([query]))
+        response = b''
+        while not response.endswith(b'\n'):
+            data = sock.recv(65536)
+            if not data:
+                break
+            response += data
+    finally:
+        sock.close()
+    return time.perf_counter() - start, json.loads(response.decode())
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--address', help="Collector address, host:port or unix:/path (default: a Unix socket in a temporary directory)")
+    parser.add_argument('--daemons', type=int, default=3, help="Real daemons streaming samples (default: 3)")
+    parser.add_argument('--agents', type=int, default=200, help="Simulated agents replaying kill events (default: 200)")
+    parser.add_argument('--events', type=int, default=500, help="Kill events per simulated agent (default: 500)")
+    parser.add_argument('--batch', type=int, default=100, help="Events per batch (default: 100)")
+    parser.add_argument('--stalled-readers', type=int, default=2, help="Clients that send queries and never read the replies (default: 2)")
+    parser.add_argument('--timeout', type=float, default=60, help="Seconds to wait for the collector to store everything (default: 60)")
+    parser.add_argument('--output', help="Write the JSON result to this file instead of stdout")
+    args = parser.parse_args()
+
+    harness.setup()
+    workdir = tempfile.mkdtemp(prefix='oomkiller-fleet-')
+    address = args.address or f"unix:{os.path.join(workdir, 'collector.sock')}"
+    db_path = os.path.join(workdir, 'fleet.db')
+    token = f'{random.getrandbits(128):032x}'
+    token_path = os.path.join(workdir, 'fleet.token')
+    with open(token_path, 'w') as f:
+        f.write(token + '\n')
+    children = []
+    stop = threading.Event()
+    stalled = [threading.Thread(target=stalled_reader, args=(address, token, stop), daemon=True) for _ in range(args.stalled_readers)]
+    try:
+        collector = subprocess.Popen([sys.executable, DAEMON, 'collector', '--listen', address, '--db', db_path, '--token-file', token_path],
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        children.append(collector)
+        if not wait_for(lambda: count_rows(db_path, "SELECT COUNT(*) FROM sqlite_master WHERE name = 'kills'"), 10):
+            raise SystemExit("Fleet collector did not start.")
+
+        for i in range(args.daemons):
+            config_path = os.path.join(workdir, f'daemon-{i}.conf')
+            write_daemon_config(config_path, workdir, address, f'daemon-{i}', token)
+            children.append(subprocess.Popen([sys.executable, DAEMON, '--config', config_path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+
+        for thread in stalled:
+            thread.start()
+        expected = args.agents * args.events
+        start = time.monotonic()
+        agents = [threading.Thread(target=simulated_agent, args=(address, token, f'agent-{i}', args.events, args.batch, i)) for i in range(args.agents)]
+        for agent in agents:
+            agent.start()
+        for agent in agents:
+            agent.join()
+        sent = time.monotonic()
+        stored = wait_for(lambda: count_rows(db_path, "SELECT COUNT(*) FROM kills") >= expected, args.timeout)
+        done = time.monotonic()
+
+        # 守护进程每 0.5 秒发送一次样本 / Daemons send a sample every 0.5 seconds
+        wait_for(lambda: count_rows(db_path, "SELECT COUNT(*) FROM nodes WHERE node LIKE 'daemon-%'") >= args.daemons, 15)
+        queries = {}
+        for query_name in sorted(ok.FLEET_QUERIES):
+            durations, reply = [], {}
+            for _ in range(20):
+                seconds, reply = timed_query(address, query_name, token)
+                durations.append(seconds)
+            queries[query_name] = dict(harness.summarize_ms(durations), rows=len(reply.get('rows', [])))
+        stop.set()
+        _, rejected = timed_query(address, 'nodes')
+
+        harness.emit({
+            'address': address,
+            'agents': args.agents,
+            'events_per_agent': args.events,
+            'batch': args.batch,
+            'events_stored': count_rows(db_path, "SELECT COUNT(*) FROM kills"),
+            'all_events_stored': bool(stored),
+            'send_seconds': round(sent - start, 3),
+            'ingest_seconds': round(done - start, 3),
+            'ingest_events_per_second': round(expected / (done - start)) if stored else None,
+            'daemons': args.daemons,
+            'daemon_nodes_reporting': count_rows(db_path, "SELECT COUNT(*) FROM nodes WHERE node LIKE 'daemon-%'"),
+            'stalled_readers': args.stalled_readers,
+            'queries': queries,
+            'query_without_token_rejected': 'error' in rejected,
+        }, args.output)
+    finally:
+        stop.set()
+        for child in reversed(children):
+            child.terminate()
+            try:
+                child.wait(10)
+            except subprocess.TimeoutExpired:
+                child.kill()
+                child.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Shared helpers for the oomkiller benchmarks: config loading, memory hog children and result output."""
+
+import os
+import sys
+import json
+import asyncio
+import logging
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+import oomkiller # noqa: E402
+
+HOG_NAME = 'oomkiller-hog'
+
+def setup(config_path=None, **overrides):
+    """Load the daemon config (the repo's oomkiller.conf by default) and apply overrides. Logs warnings to stderr only."""
+    oomkiller.logger = logging.getLogger('oomkiller')
+    if not oomkiller.logger.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        oomkiller.logger.addHandler(handler)
+    oomkiller.logger.setLevel(logging.WARNING)
+    oomkiller.import_daemon_modules()
+    oomkiller.load_config(config_path or os.path.join(REPO_ROOT, 'oomkiller.conf'))
+    # 基准测试从不发送通知 / Benchmarks never send notifications
+    oomkiller.validated_config['enable_notifications'] = False
+    oomkiller.validated_config.update(overrides)
+    # 杀进程路径运行在事件循环上，基准测试不注册信号处理 / The kill path runs on the event loop; benchmarks register no signal handlers
+    if oomkiller.event_loop is None:
+        oomkiller.event_loop = asyncio.new_event_loop()
+    return oomkiller
+
+def run(coro):
+    """Run one of the daemon's coroutines (such as kill_processes()) to completion on its event loop."""
+    return oomkiller.event_loop.run_until_complete(coro)
+
+def spawn_hog(limit_mb, rate_mb=0, ignore_sigterm=False, wait_ready=True):
+    """Start benchmarks/memhog.py; with wait_ready, return only once it holds all of its memory."""
+    cmd = [sys.executable, os.path.join(BENCH_DIR, 'memhog.py'), '--limit-mb', str(limit_mb), '--rate-mb', str(rate_mb)]
+    if ignore_sigterm:
+        cmd.append('--ignore-sigterm')
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    if wait_ready:
+        proc.stdout.readline()
+    return proc
+
+def stop_hog(proc):
+    """Kill and reap a memory hog if it is still running."""
+    if proc.poll() is None:
+        proc.kill()
+    proc.wait()
+    proc.stdout.close()
+
+def hog_victims(hogs, hog_pids):
+    """Keep only the selected candidates that are our own hogs, so a benchmark never signals anything else on the host."""
+    return [hog for hog in hogs if hog['pid'] in hog_pids]
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (0 for an empty list)."""
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def summarize_ms(seconds):
+    """Summarize a list of durations in seconds as milliseconds."""
+    return {
+        'count': len(seconds),
+        'p50_ms': round(percentile(seconds, 50) * 1000, 3),
+        'p99_ms': round(percentile(seconds, 99) * 1000, 3),
+        'max_ms': round(max(seconds, default=0) * 1000, 3),
+    }
+
+def emit(result, output=None):
+    """Write a result as JSON to `output` (a path) or stdout."""
+    data = json.dumps(result, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w') as f:
+            f.write(data + '\n')
+    else:
+        print(data)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark the detect -> select -> kill loop: scan and selection cost over synthetic process populations, plus a real kill cycle.
+
+Scanning is measured against synthetic procfs trees (100 to 20k processes by default) so populations of any size can be
+compared without spawning them. The kill cycle uses real memory hog children and reports time-to-first-signal and
+time-to-memory-recovered. Only the benchmark's own children are ever signalled. Results are printed as JSON.
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import psutil
+
+import harness
+
+# 合成进程的 PID 起始值，避免与真实进程混淆 / Synthetic PIDs start high so they are never confused with real processes
+SYNTHETIC_PID_BASE = 1000000
+STAT_FIELDS_AFTER_COMM = 50
+
+def write_file(path, data):
+    with open(path, 'w') as f:
+        f.write(data)
+
+def build_population(root, count, seed):
+    """Write a synthetic procfs tree under `root` with `count` processes and a log-normal RSS distribution."""
+    rng = random.Random(seed)
+    os.makedirs(root)
+    # psutil 需要 btime 计算进程创建时间 / psutil needs btime to compute process creation times
+    write_file(os.path.join(root, 'stat'), 'cpu  0 0 0 0 0 0 0 0 0 0\nbtime 1700000000\n')
+    for i in range(count):
+        pid = SYNTHETIC_PID_BASE + i
+        name = f"worker{i % 64}"
+        uid = 1000 + i % 50
+        rss = min(int(rng.lognormvariate(8, 2)) + 1, 4 * 1024 * 1024) # pages
+        shared = int(rss * rng.random() * 0.8)
+        swap = int(rss * rng.random() * 0.2)
+        fields = ['S', '1', str(pid), str(pid), '0', '-1', '4194560'] + ['0'] * 8 + ['20', '0', '1', '0', str(1000 + i), str(rss * 2 * 4096), str(rss)]
+        fields += ['0'] * (STAT_FIELDS_AFTER_COMM - len(fields))
+        proc_dir = os.path.join(root, str(pid))
+        os.mkdir(proc_dir)
+        write_file(os.path.join(proc_dir, 'stat'), f"{pid} ({name}) {' '.join(fields)}\n")
+        write_file(os.path.join(proc_dir, 'statm'), f"{rss * 2} {rss} {shared} 1 0 {rss - shared} 0\n")
+        write_file(os.path.join(proc_dir, 'status'), f"Name:\t{name}\nState:\tS (sleeping)\nTgid:\t{pid}\nPid:\t{pid}\nPPid:\t1\n"
+                                                     f"Uid:\t{uid}\t{uid}\t{uid}\t{uid}\nGid:\t{uid}\t{uid}\t{uid}\t{uid}\n"
+                                                     f"VmRSS:\t{rss * 4} kB\nVmSwap:\t{swap * 4} kB\nThreads:\t1\n"
+                                                     f"voluntary_ctxt_switches:\t0\nnonvoluntary_ctxt_switches:\t0\n")
+        write_file(os.path.join(proc_dir, 'cmdline'), f"/usr/bin/{name}\0--task\0{i}\0")
+        write_file(os.path.join(proc_dir, 'oom_score_adj'), '0\n')
+        write_file(os.path.join(proc_dir, 'smaps_rollup'), f"00400000-7ffc00000000 ---p 00000000 00:00 0 [rollup]\n"
+                                                           f"Rss: {rss * 4} kB\nPss: {(rss - shared // 2) * 4} kB\n"
+                                                           f"Shared_Clean: {shared * 4} kB\nShared_Dirty: 0 kB\n"
+                                                           f"Private_Clean: 0 kB\nPrivate_Dirty: {(rss - shared) * 4} kB\n"
+                                                           f"Swap: {swap * 4} kB\nSwapPss: {swap * 4} kB\n")
+
+def legacy_psutil_scan(avoid_names, prioritize_names):
+    """The original psutil.process_iter() based get_memory_hogs() ranking, kept as the baseline."""
+    processes = []
+    for proc in psutil.process_iter(['pid', 'name', 'memory_info', 'cmdline', 'status', 'username']):
+        try:
+            info = proc.info
+            if info['name'] in avoid_names or not info['cmdline'] or info['status'] in (psutil.STATUS_ZOMBIE, psutil.STATUS_DEAD):
+                continue
+            if info['memory_info'] and info['memory_info'].rss > 0:
+                processes.append({'pid': info['pid'], 'name': info['name'], 'rss': info['memory_info'].rss,
+                                  'cmdline': ' '.join(info['cmdline']), 'prioritized': info['name'] in prioritize_names,
+                                  'username': info['username']})
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    processes.sort(key=lambda x: (not x['prioritized'], -x['rss']))
+    return processes
+
+def timed(func, repeat):
+    """Call func() `repeat` times and return the list of durations in seconds."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def bench_population(ok, root, count, repeat, legacy):
+    """Measure scanner and scoring strategies against one synthetic population."""
+    avoid_names = set(ok.validated_config['avoid_processes'])
+    result = {'processes': count}
+    ok.PROC_ROOT = root
+    try:
+        if legacy:
+            psutil.PROCFS_PATH = root
+            try:
+                result['psutil_legacy'] = harness.summarize_ms(timed(lambda: legacy_psutil_scan(avoid_names, set()), repeat))
+            finally:
+                psutil.PROCFS_PATH = '/proc'
+
+        # 冷扫描: 进程表为空 / Cold scan: empty process table
+        cold = []
+        for _ in range(repeat):
+            ok.process_table.clear()
+            cold.extend(timed(ok.refresh_process_table, 1))
+        result['proc_cold_scan'] = harness.summarize_ms(cold)
+        # 增量扫描: 只刷新 RSS / Warm scan: RSS refresh only
+        warm = timed(ok.refresh_process_table, repeat)
+        result['proc_warm_scan'] = harness.summarize_ms(warm)
+
+        selection = {}
+        for formula in ok.SCORE_FORMULAS:
+            ok.validated_config['score_formula'] = formula
+            total = timed(lambda: ok.get_memory_hogs(set(), avoid_names, []), repeat)
+            selection[formula] = harness.summarize_ms(total)
+            # 减去扫描时间得到选择 (排序+评分) 的开销 / Subtract the scan to get the selection (ranking + scoring) cost
+            selection[formula]['selection_p50_ms'] = round(max(harness.percentile(total, 50) - harness.percentile(warm, 50), 0) * 1000, 3)
+        result['scan_and_select'] = selection
+    finally:
+        ok.PROC_ROOT = '/proc'
+        ok.process_table.clear()
+        ok.validated_config['score_formula'] = 'rss'
+    return result
+
+def kill_cycle(ok, hog_count, hog_mb, sleepers, repeat, poll_interval, recovery_timeout):
+    """Run detect -> select -> kill against `hog_count` real hogs among `sleepers` idle processes and time each step."""
+    idle = [subprocess.Popen(['sleep', '3600']) for _ in range(sleepers)]
+    runs = []
+    try:
+        for _ in range(repeat):
+            hogs = [harness.spawn_hog(hog_mb) for _ in range(hog_count)]
+            try:
+                vm = psutil.virtual_memory()
+                # 阈值设置为必须杀死全部 hog 才能恢复，以覆盖批量杀死 / Threshold that needs every hog killed, so batch kills are exercised
+                ok.validated_config['min_available_memory_percentage'] = min((vm.available + (hog_count - 0.5) * hog_mb * 1024 * 1024) / vm.total * 100, 100.0)
+                ok.validated_config['max_batch_kills'] = hog_count
+
+                start = time.monotonic()
+                memory_ok, swap_ok, available_memory_percentage, available_swap_percentage = ok.check_memory_swap_usage()
+                detected = time.monotonic()
+                candidates = ok.get_memory_hogs(set(), set(ok.validated_config['avoid_processes']), [harness.HOG_NAME],
+                                                limit=max(ok.DEFAULT_HOG_CANDIDATES, hog_count))
+                deficit = ok.estimate_memory_deficit(available_memory_percentage, available_swap_percentage)
+                victims = harness.hog_victims(ok.select_victims(candidates, deficit), {hog.pid for hog in hogs})
+                selected = time.monotonic()
+                if memory_ok and swap_ok or not victims:
+                    runs.append({'error': 'threshold not crossed' if memory_ok and swap_ok else 'hogs were not selected'})
+                    continue
+                failed = harness.run(ok.kill_processes(victims))
+                exited = time.monotonic()
+                recovered = None
+                while time.monotonic() - exited < recovery_timeout:
+                    if all(ok.check_memory_swap_usage()[:2]):
+                        recovered = time.monotonic()
+                        break
+                    time.sleep(poll_interval)
+                runs.append({
+                    'victims': len(victims),
+                    'failed': len(failed),
+                    'freed_mb_estimate': sum(victim['rss'] for victim in victims) // 1024 // 1024,
+                    'detect_ms': round((detected - start) * 1000, 3),
+                    'selection_ms': round((selected - detected) * 1000, 3),
+                    'time_to_first_signal_ms': round((min(victim.get('signal_time', exited) for victim in victims) - start) * 1000, 3),
+                    'time_to_all_exited_ms': round((exited - start) * 1000, 3),
+                    # 超时未恢复时为 null / null when memory did not recover within the timeout
+                    'time_to_memory_recovered_ms': round((recovered - start) * 1000, 3) if recovered else None,
+                })
+            finally:
+                for hog in hogs:
+                    harness.stop_hog(hog)
+    finally:
+        for proc in idle:
+            proc.kill()
+            proc.wait()
+    return {'hogs': hog_count, 'hog_mb': hog_mb, 'sleepers': sleepers, 'runs': runs}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--config', help="Daemon configuration to benchmark (default: the repo's oomkiller.conf)")
+    parser.add_argument('--populations', default='100,1000,5000,20000', help="Comma-separated synthetic population sizes (default: 100,1000,5000,20000)")
+    parser.add_argument('--repeat', type=int, default=5, help="Repetitions per measurement (default: 5)")
+    parser.add_argument('--seed', type=int, default=1, help="Random seed for the synthetic populations (default: 1)")
+    parser.add_argument('--tmpdir', default='/dev/shm' if os.path.isdir('/dev/shm') else None, help="Where to build synthetic procfs trees (default: /dev/shm)")
+    parser.add_argument('--skip-legacy', action='store_true', help="Do not benchmark the psutil.process_iter() baseline")
+    parser.add_argument('--hogs', type=int, default=3, help="Memory hog children in the kill cycle, 0 to skip it (default: 3)")
+    parser.add_argument('--hog-mb', type=int, default=256, help="Memory per hog in MB (default: 256)")
+    parser.add_argument('--sleepers', type=int, default=100, help="Idle real processes present during the kill cycle (default: 100)")
+    parser.add_argument('--poll-interval', type=float, default=0.01, help="Recovery polling interval in seconds (default: 0.01)")
+    parser.add_argument('--recovery-timeout', type=float, default=10, help="Seconds to wait for memory to recover after the kills (default: 10)")
+    parser.add_argument('--output', help="Write the JSON result to this file instead of stdout")
+    args = parser.parse_args()
+
+    ok = harness.setup(args.config, kill_wait_seconds=1, score_oom_score_adj=False, victim_mode='process')
+    result = {
+        'host': {'cpus': os.cpu_count(), 'total_memory_mb': ok.TOTAL_MEMORY // 1024 // 1024, 'kernel': os.uname().release},
+        'check_memory_swap_usage': harness.summarize_ms(timed(ok.check_memory_swap_usage, 200)),
+        'populations': [],
+    }
+
+    workdir = tempfile.mkdtemp(prefix='oomkiller-bench-', dir=args.tmpdir)
+    try:
+        for count in (int(n) for n in args.populations.split(',') if n.strip()):
+            root = os.path.join(workdir, str(count))
+            build_population(root, count, args.seed)
+            result['populations'].append(bench_population(ok, root, count, args.repeat, not args.skip_legacy))
+            shutil.rmtree(root)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.hogs > 0:
+        result['kill_cycle'] = kill_cycle(ok, args.hogs, args.hog_mb, args.sleepers, args.repeat, args.poll_interval, args.recovery_timeout)
+    harness.emit(result, args.output)
+
+if __name__ == "__main__":
+    sys.exit(main())
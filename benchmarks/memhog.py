@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""stress-ng --vm style memory hog for the benchmarks: allocates and touches memory at a fixed rate, then holds it."""
+
+import sys
+import time
+import ctypes
+import signal
+import argparse
+
+HOG_NAME = b'oomkiller-hog'
+CHUNK_MB = 16
+PAGE_SIZE = 4096
+PR_SET_NAME = 15
+
+def main():
+    parser = argparse.ArgumentParser(description="Allocate memory at a fixed rate and hold it until killed.")
+    parser.add_argument('--limit-mb', type=int, default=512, help="Total memory to allocate in MB (default: 512)")
+    parser.add_argument('--rate-mb', type=float, default=256, help="Allocation rate in MB per second, 0 for as fast as possible (default: 256)")
+    parser.add_argument('--ignore-sigterm', action='store_true', help="Ignore SIGTERM so the killer has to escalate to SIGKILL")
+    args = parser.parse_args()
+
+    # 修改 comm 以便基准测试只选中该进程 / Rename comm so the benchmarks can target this process only
+    ctypes.CDLL(None).prctl(PR_SET_NAME, HOG_NAME, 0, 0, 0)
+    if args.ignore_sigterm:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    chunks = []
+    chunk_size = CHUNK_MB * 1024 * 1024
+    start = time.monotonic()
+    for i in range(args.limit_mb // CHUNK_MB):
+        chunk = bytearray(chunk_size)
+        # 写入每一页，确保内存真正常驻 / Touch every page so the memory is actually resident
+        chunk[::PAGE_SIZE] = b'\x01' * (chunk_size // PAGE_SIZE)
+        chunks.append(chunk)
+        if args.rate_mb > 0:
+            delay = start + (i + 1) * CHUNK_MB / args.rate_mb - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+    print('ready', flush=True)
+    while True:
+        signal.pause()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Check the notification worker and the Feishu client against a local mock of the Feishu Open Platform API.
+
+The mock serves the tenant_access_token and message endpoints on localhost and can fail the next message requests or
+reject the current token. Checked: notifications to the same user within notification_batch_seconds are merged into one
+message, the token is cached across messages, failed deliveries are retried with exponential backoff, and a rejected
+token is refreshed once. Results are printed as JSON; the exit code is 1 if any check failed.
+"""
+
+import sys
+import json
+import time
+import argparse
+import threading
+import http.server
+
+import harness
+
+TOKEN_PATH = '/open-apis/auth/v3/tenant_access_token/internal'
+MESSAGE_PATH = '/open-apis/im/v1/messages'
+
+class MockFeishu:
+    """State of the mock API: issued tokens, received messages and the failures to inject."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tokens = []
+        self.messages = []
+        self.fail_next = 0
+        self.rejected = set()
+
+    def reset(self):
+        with self.lock:
+            self.messages.clear()
+            self.fail_next = 0
+
+class MockFeishuHandler(http.server.BaseHTTPRequestHandler):
+    """Answer token and message requests the way the Feishu API does, with the failures set on the server's MockFeishu."""
+
+    def do_POST(self):
+        mock = self.server.mock
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        with mock.lock:
+            if self.path == TOKEN_PATH:
+                token = f"token-{len(mock.tokens) + 1}"
+                mock.tokens.append(token)
+                return self.reply(200, {'code': 0, 'tenant_access_token': token, 'expire': 7200})
+            if self.path.split('?')[0] != MESSAGE_PATH:
+                return self.reply(404, {'code': 404, 'msg': 'not found'})
+            token = self.headers.get('Authorization', '').split(' ')[-1]
+            mock.messages.append({'time': time.monotonic(), 'token': token, 'receive_id': body.get('receive_id'),
+                                  'text': json.loads(body.get('content', '{}')).get('text', ''), 'status': None})
+            if token in mock.rejected:
+                mock.messages[-1]['status'] = 'rejected'
+                return self.reply(400, {'code': 99991663, 'msg': 'Invalid access token for authorization.'})
+            if mock.fail_next > 0:
+                mock.fail_next -= 1
+                mock.messages[-1]['status'] = 'failed'
+                return self.reply(500, {'code': 1, 'msg': 'internal error'})
+            mock.messages[-1]['status'] = 'delivered'
+            return self.reply(200, {'code': 0, 'msg': 'success'})
+
+    def reply(self, status, data):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+def check_batching(ok, mock, batch_seconds):
+    """Queue notifications for two users within one batch window and expect one merged message per user."""
+    mock.reset()
+    tokens_before = len(mock.tokens)
+    for i in range(3):
+        ok.send_notification_to_user('alice', 'job', 1000 + i, 'job', f"alice message {i}")
+    for i in range(2):
+        ok.send_notification_to_user('bob', 'job', 2000 + i, 'job', f"bob message {i}")
+    ok.stop_notification_worker(timeout=batch_seconds + 10)
+    delivered = {message['receive_id']: message for message in mock.messages if message['status'] == 'delivered'}
+    return {
+        'messages_sent': len(mock.messages),
+        'merged_per_user': len(mock.messages) == 2 and set(delivered) == {'alice', 'bob'}
+                           and all(f"alice message {i}" in delivered['alice']['text'] for i in range(3))
+                           and all(f"bob message {i}" in delivered['bob']['text'] for i in range(2)),
+        # 第一次运行时需要获取令牌，之后复用 / The first run has to fetch a token, later messages reuse it
+        'token_requests': len(mock.tokens) - tokens_before,
+        'token_cached': len(mock.tokens) <= 1 and len({message['token'] for message in mock.messages}) == 1,
+    }
+
+def check_retry(ok, mock, failures):
+    """Fail the next `failures` message requests and expect a delivery after exponential backoff (1s, 2s, ...)."""
+    mock.reset()
+    mock.fail_next = failures
+    start = time.monotonic()
+    delivered = ok.deliver_with_retry('carol', "retry message")
+    elapsed = time.monotonic() - start
+    times = [message['time'] for message in mock.messages]
+    gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+    expected = [2 ** attempt for attempt in range(failures)]
+    return {
+        'delivered': delivered,
+        'attempts': len(mock.messages),
+        'gaps_seconds': [round(gap, 2) for gap in gaps],
+        'backoff_ok': len(gaps) == failures and all(expected_gap <= gap < expected_gap + 1 for gap, expected_gap in zip(gaps, expected)),
+        'elapsed_seconds': round(elapsed, 2),
+    }
+
+def check_retry_exhausted(ok, mock):
+    """Fail more requests than notification_max_retries allows and expect delivery to give up."""
+    mock.reset()
+    retries = ok.validated_config['notify']['notification_max_retries']
+    mock.fail_next = retries + 1
+    delivered = ok.deliver_with_retry('dave', "lost message")
+    return {'delivered': delivered, 'attempts': len(mock.messages), 'gave_up': not delivered and len(mock.messages) == retries + 1}
+
+def check_token_refresh(ok, mock):
+    """Reject the cached token and expect one new token request and a delivery with the new token."""
+    mock.reset()
+    with mock.lock:
+        old_token = mock.tokens[-1]
+        mock.rejected.add(old_token)
+    tokens_before = len(mock.tokens)
+    delivered = ok.deliver_with_retry('erin', "refresh message")
+    statuses = [(message['token'], message['status']) for message in mock.messages]
+    return {
+        'delivered': delivered,
+        'token_requests': len(mock.tokens) - tokens_before,
+        'requests': statuses,
+        'refreshed': delivered and len(mock.tokens) == tokens_before + 1
+                     and statuses == [(old_token, 'rejected'), (mock.tokens[-1], 'delivered')],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-seconds', type=float, default=0.5, help="notification_batch_seconds for the batching check (default: 0.5)")
+    parser.add_argument('--failures', type=int, default=2, help="Failed message requests before the retry check succeeds (default: 2)")
+    parser.add_argument('--output', help="Write the JSON result to this file instead of stdout")
+    args = parser.parse_args()
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), MockFeishuHandler)
+    server.mock = MockFeishu()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    ok = harness.setup()
+    ok.validated_config['enable_notifications'] = True
+    ok.validated_config['notify'] = {
+        'notification_channel': 'feishu', 'notification_queue_size': 100, 'notification_batch_seconds': args.batch_seconds,
+        'notification_max_retries': max(args.failures, 1), 'feishu_appid': 'app', 'feishu_appsecret': 'secret', 'feishu_botname': '',
+        'feishu_api_base': f"http://127.0.0.1:{server.server_address[1]}", 'feishu_receive_id_type': 'user_id', 'feishu_email_domain': '',
+    }
+    try:
+        result = {
+            'batching': check_batching(ok, server.mock, args.batch_seconds),
+            'retry': check_retry(ok, server.mock, args.failures),
+            'retry_exhausted': check_retry_exhausted(ok, server.mock),
+            'token_refresh': check_token_refresh(ok, server.mock),
+        }
+    finally:
+        server.shutdown()
+        server.server_close()
+    passed = (result['batching']['merged_per_user'] and result['batching']['token_cached'] and result['retry']['delivered']
+              and result['retry']['backoff_ok'] and result['retry_exhausted']['gave_up'] and result['token_refresh']['refreshed'])
+    result['passed'] = bool(passed)
+    harness.emit(result, args.output)
+    return 0 if passed else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
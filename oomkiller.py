@@ -4,37 +4,399 @@
 import os
 import time
 import sys
-import psutil
+import pwd
+import grp
+import heapq
+import fnmatch
+import functools
+import itertools
+import re
+import bisect
+import collections
+import errno
+import atexit
+import gc
+import json
+import queue
+import threading
 import signal
+import shutil
+import socket
+import select
 import logging
 import configparser
 import argparse # Import argparse
-from logging.handlers import RotatingFileHandler
+import hmac
+from logging.handlers import RotatingFileHandler, MemoryHandler, QueueHandler, QueueListener
 
 # --- Constants ---
 DEFAULT_CONFIG_PATH = "/etc/oomkiller/oomkiller.conf"
 DEFAULT_LOG_PATH = "/var/log/oomkiller.log"
 DEFAULT_KILL_WAIT_SECONDS = 5
+PSI_MEMORY_PATH = "/proc/pressure/memory"
+# 进程扫描使用的 procfs 根目录，基准测试可替换为合成目录 / procfs root used by the process scanner, benchmarks point it at a synthetic tree
+PROC_ROOT = "/proc"
+ZRAM_SYSFS_ROOT = "/sys/block"
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+TOTAL_MEMORY = os.sysconf('SC_PHYS_PAGES') * PAGE_SIZE
+NOTIFICATION_HTTP_TIMEOUT = 10
+# mlockall() 标志位 / mlockall() flags
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+MCL_ONFAULT = 4
+# 飞书 tenant_access_token 无效或过期的错误码 / Feishu error codes for an invalid or expired tenant_access_token
+FEISHU_INVALID_TOKEN_CODES = (99991661, 99991663, 99991664)
+# 每次扫描最多返回的候选进程数 / Maximum number of candidates returned per scan
+DEFAULT_HOG_CANDIDATES = 10
+# 等待写入杀死历史的最大记录批数 / Maximum number of kill history writes waiting for the journal worker
+HISTORY_QUEUE_SIZE = 1000
+# 杀死历史记录表结构 / Kill history journal schema
+HISTORY_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS incidents (started REAL PRIMARY KEY, ended REAL, available_before INTEGER, available_after INTEGER, kills INTEGER)",
+    "CREATE TABLE IF NOT EXISTS kills (time REAL, incident REAL, kind TEXT, pid INTEGER, user TEXT, name TEXT, cmdline_hash TEXT, "
+    "rss INTEGER, signal TEXT, outcome TEXT, exit_seconds REAL, reclaimed INTEGER)",
+    "CREATE INDEX IF NOT EXISTS kills_by_time ON kills (time)",
+    "CREATE INDEX IF NOT EXISTS kills_by_offender ON kills (name, user, time)",
+)
+# 杀死记录和事件记录的字段，供历史记录和集群事件共用 / Kill and incident record fields, shared by the journal and fleet events
+KILL_FIELDS = ('time', 'incident', 'kind', 'pid', 'user', 'name', 'cmdline_hash', 'rss', 'signal', 'outcome', 'exit_seconds', 'reclaimed')
+INCIDENT_FIELDS = ('started', 'ended', 'available_before', 'available_after', 'kills')
+# 集群模式: 默认地址、套接字超时和单行事件的最大长度 / Fleet mode: default address, socket timeout and maximum size of one event line
+DEFAULT_FLEET_ADDRESS = "127.0.0.1:9798"
+FLEET_SOCKET_TIMEOUT = 10
+FLEET_MAX_LINE = 1024 * 1024
+FLEET_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS nodes (node TEXT PRIMARY KEY, last_seen REAL, available_memory REAL, available_swap REAL, psi_some_avg10 REAL)",
+    "CREATE TABLE IF NOT EXISTS kills (node TEXT, time REAL, incident REAL, kind TEXT, pid INTEGER, user TEXT, name TEXT, cmdline_hash TEXT, "
+    "rss INTEGER, signal TEXT, outcome TEXT, exit_seconds REAL, reclaimed INTEGER)",
+    "CREATE TABLE IF NOT EXISTS incidents (node TEXT, started REAL, ended REAL, available_before INTEGER, available_after INTEGER, kills INTEGER, "
+    "PRIMARY KEY (node, started))",
+    "CREATE INDEX IF NOT EXISTS kills_by_time ON kills (time)",
+)
+# 集群查询，参数为 (起始时间, 行数) / Fleet queries, parameters are (cutoff time, row limit)
+FLEET_QUERIES = {
+    'top-users': "SELECT user, COUNT(*) AS kills, COUNT(DISTINCT node) AS nodes, SUM(reclaimed) / 1048576 AS reclaimed_mb FROM kills "
+                 "WHERE time >= ? AND outcome IN ('terminated', 'killed') GROUP BY user ORDER BY kills DESC LIMIT ?",
+    'top-commands': "SELECT name, cmdline_hash, COUNT(*) AS kills, COUNT(DISTINCT node) AS nodes, COUNT(DISTINCT user) AS users, "
+                    "SUM(reclaimed) / 1048576 AS reclaimed_mb FROM kills WHERE time >= ? AND outcome IN ('terminated', 'killed') "
+                    "GROUP BY name, cmdline_hash ORDER BY kills DESC LIMIT ?",
+    'kills-per-node-hour': "SELECT node, strftime('%Y-%m-%d %H:00', time, 'unixepoch', 'localtime') AS hour, COUNT(*) AS kills, "
+                           "SUM(reclaimed) / 1048576 AS reclaimed_mb FROM kills WHERE time >= ? GROUP BY node, hour "
+                           "ORDER BY hour DESC, kills DESC LIMIT ?",
+    'nodes': "SELECT node, datetime(last_seen, 'unixepoch', 'localtime') AS last_seen, round(available_memory, 1) AS available_memory_pct, "
+             "round(available_swap, 1) AS available_swap_pct, psi_some_avg10 FROM nodes WHERE last_seen >= ? ORDER BY node LIMIT ?",
+}
+# 控制套接字: 默认路径、单个请求的超时和请求行的最大长度 / Control socket: default path, timeout per request and maximum size of a request line
+DEFAULT_CONTROL_SOCKET = "/run/oomkiller/control.sock"
+CONTROL_TIMEOUT = 5
+CONTROL_MAX_REQUEST = 4096
+# 退出时等待日志队列腾出空间的最长时间 (秒) / Seconds to wait at exit for room in a full log queue
+LOG_STOP_TIMEOUT = 5
+# 队列满时警告和事件记录最多等待的时间 (秒)，更低级别的记录直接丢弃 / Seconds warnings and event records wait for room in a full log queue, lower levels are dropped right away
+LOG_PUT_TIMEOUT = 0.2
+# 杀死过程的审计记录，从不限速 / Event actions of the kill audit trail, never rate-limited
+LOG_AUDIT_ACTIONS = ('kill', 'sigterm', 'sigkill', 'terminated', 'killed', 'exited', 'kill_failed', 'avoid')
+# 扫描 /proc 时复用的读缓冲区大小 (stat/statm 远小于此值) / Size of the buffer reused for /proc reads (stat/statm are far smaller)
+PROC_READ_BUFFER_SIZE = 4096
+# 内存趋势环形缓冲区的样本数 / Number of samples kept in the memory trend ring buffer
+MEMORY_SAMPLE_BUFFER = 256
+# 追踪快照中带 smaps_rollup 的最大进程数及其字段 / Largest processes traced with their smaps_rollup, and the fields kept
+TRACE_SMAPS_CANDIDATES = 20
+TRACE_SMAPS_FIELDS = ('Pss', 'SwapPss', 'Private_Clean', 'Private_Dirty')
+# 冻结后重新检查内存的间隔 / Interval for re-checking memory while victims are frozen
+FREEZE_POLL_SECONDS = 0.1
+# 颠簸判断所需 vmstat 样本的最短跨度 / Shortest span of vmstat samples a thrashing verdict is based on
+THRASH_MIN_SECONDS = 1.0
+# 内存大小单位 / Memory size units accepted in quotas
+MEMORY_SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+# 公平分配时不计入的系统用户 UID 上限 / Highest system UID, system users get no implicit fair share
+SYSTEM_UID_MAX = 999
+# avoid/prioritize 规则的前缀，没有前缀的规则按进程名精确匹配 / Rule prefixes for avoid/prioritize lists, rules without one match the process name exactly
+MATCH_RULE_KINDS = ('glob', 're', 'user', 'cmdline')
+# 指标定义: 名称 -> (类型, 说明, 直方图桶) / Metric definitions: name -> (type, help, histogram buckets)
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+METRICS = {
+    'oomkiller_scan_duration_seconds': ('histogram', 'Time spent refreshing the process table from /proc.', DURATION_BUCKETS),
+    'oomkiller_selection_duration_seconds': ('histogram', 'Time spent scanning, ranking and scoring victim candidates.', DURATION_BUCKETS),
+    'oomkiller_processes_scanned': ('gauge', 'Processes found by the last /proc scan.', None),
+    'oomkiller_candidates_evaluated_total': ('counter', 'Victim candidates verified (and scored) during selection.', None),
+    'oomkiller_incidents_total': ('counter', 'Times available memory or swap dropped below its threshold.', None),
+    'oomkiller_kills_total': ('counter', 'Victims handled, by last signal sent and outcome.', None),
+    'oomkiller_kill_reclaimed_bytes': ('histogram', 'Estimated memory reclaimed per killed victim (score formula estimate).',
+                                       tuple(2 ** n * 1024 * 1024 for n in range(4, 16, 2))),
+    'oomkiller_kill_exit_seconds': ('histogram', 'Time from the first signal until a victim exited.', (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)),
+    'oomkiller_freezes_total': ('counter', 'Victims (processes or cgroups) frozen before deciding, by outcome (thawed or killed).', None),
+    'oomkiller_users_over_quota': ('gauge', 'Users whose aggregated RSS exceeded their memory quota at the last selection.', None),
+    'oomkiller_available_memory_percent': ('gauge', 'Available memory percentage at the last check.', None),
+    'oomkiller_available_swap_percent': ('gauge', 'Free swap percentage at the last check (effective headroom under detailed accounting).', None),
+    'oomkiller_swapin_pages_per_second': ('gauge', 'Pages swapped in per second over the thrashing window (detailed accounting).', None),
+    'oomkiller_major_faults_per_second': ('gauge', 'Major page faults per second over the thrashing window (detailed accounting).', None),
+    'oomkiller_thrashing': ('gauge', '1 while the system is judged to be thrashing (detailed accounting).', None),
+    'oomkiller_zram_memory_used_bytes': ('gauge', 'RAM used by zram swap devices, compressed data plus overhead (detailed accounting).', None),
+    'oomkiller_notification_queue_depth': ('gauge', 'Notifications waiting in the delivery queue.', None),
+    'oomkiller_notifications_total': ('counter', 'Notification deliveries by result.', None),
+    'oomkiller_fleet_events_total': ('counter', 'Fleet events by result (sent or dropped).', None),
+    'oomkiller_log_records_suppressed_total': ('counter', 'Log records suppressed by the rate limit for repeated messages.', None),
+    'oomkiller_log_records_dropped_total': ('counter', 'Log records dropped because the log queue was full.', None),
+}
 
 # --- Globals ---
 # 使用 validated_config 存储验证后的配置
 validated_config = {}
 logger = None
+# 日志队列的后台写入线程 / Background writer thread of the log queue
+log_listener = None
+# 只有守护进程 (和 replay) 需要的模块，由 import_daemon_modules() 导入 / Modules only the daemon (and replay) need, imported by import_daemon_modules()
+psutil = None
+asyncio = None
+# PSI 触发器的 poll 对象和文件描述符 / Poll object and fds of the registered PSI triggers
+psi_poller = None
+psi_fds = []
+# 是否处于连续的 PSI 停顿事件中，只在开始和结束时以 INFO 记录 / Whether PSI stall events keep arriving, only their start and end are logged at INFO
+psi_stalling = False
+# uid -> 用户名缓存 / uid -> username cache
+uid_name_cache = {}
+# 跨扫描保留的进程表，按 PID 索引并以 start_time 区分 PID 复用 / Process table kept across scans, keyed by PID with start_time guarding against PID reuse
+process_table = {}
+# 按 UID 汇总的 RSS (随进程表增量更新) 和每个 UID 的配额缓存 / Aggregated RSS per UID (updated incrementally with the process table) and per-UID quota cache
+user_memory = {}
+uid_quota_cache = {}
+# 被冻结的进程 (PID -> psutil.Process) 和 cgroup 路径，退出和出错时全部解冻 / Frozen processes (PID -> psutil.Process) and cgroup paths, all thawed on exit and errors
+frozen_processes = {}
+frozen_cgroups = set()
+# 当前追踪文件、其日期、上次快照中的进程 (PID -> (start_time, RSS)) 和上次快照时间 / Current trace file, its day, processes in the last snapshot (PID -> (start_time, RSS)) and when it was taken
+trace_file = None
+trace_day = None
+trace_procs = {}
+trace_last_snapshot = 0
+# 回放时当前追踪样本中的已用交换空间，None 表示读取本机 / Swap in use according to the trace sample being replayed, None reads this host
+replay_swap_used = None
+# 后台通知队列和线程 / Background notification queue and worker thread
+notification_queue = None
+notification_thread = None
+http_session = None
+feishu_token = {'value': None, 'expires_at': 0}
+# 预分配的 /proc 读缓冲区，仅在主线程使用 / Preallocated /proc read buffer, only used from the main thread
+proc_read_buffer = bytearray(PROC_READ_BUFFER_SIZE)
+# 最近的内存样本 / Recent memory samples for trend prediction
+memory_samples = collections.deque(maxlen=MEMORY_SAMPLE_BUFFER)
+# 颠簸窗口内的 vmstat 样本 (时间, pswpin, pgmajfault) 和当前的颠簸判断 / vmstat samples (time, pswpin, pgmajfault) in the thrashing window and the current verdict
+vmstat_samples = collections.deque()
+thrashing = False
+# 指标值: (名称, 标签) -> 值；直方图: 名称 -> [各桶计数, 总和] / Metric values: (name, labels) -> value; histograms: name -> [bucket counts, sum]
+metric_values = {}
+metric_histograms = {}
+# 通知、集群、日志线程也会更新指标 / The notification, fleet and logging threads update metrics too
+metrics_lock = threading.Lock()
+# 指标导出的 HTTP 服务和 textfile 线程 / Metrics HTTP server and textfile writer thread
+metrics_server = None
+metrics_textfile_thread = None
+metrics_textfile_path = None
+metrics_stop = threading.Event()
+# 编译后的匹配器编号，用于缓存每个进程的匹配结果 / Ids of compiled matchers, used to memoize match results per process
+matcher_ids = itertools.count()
+# SIGHUP 请求重新加载配置 / SIGHUP requests a config reload
+reload_requested = False
+# 事件循环、主监控任务、唤醒事件 (PSI 或 SIGHUP)、事件进行中标志和待处理的 PSI 事件 / Event loop, monitor task, wake-up event (PSI or SIGHUP), incident-in-progress flag and pending PSI event
+event_loop = None
+monitor_task = None
+wakeup_event = None
+incident_event = None
+psi_pending = False
+# 杀死历史数据库 (仅由写入线程使用)、写入队列和线程、当前事件和重复违规者 (进程名 -> 用户集合)
+# Kill history database (only used by the journal worker), its queue and thread, the current incident and repeat offenders (name -> usernames)
+history_db = None
+history_queue = None
+history_thread = None
+current_incident = None
+repeat_offenders = {}
+# 集群事件队列、发送线程和上次发送样本的时间 / Fleet event queue, sender thread and when the last sample event was queued
+fleet_queue = None
+fleet_thread = None
+fleet_last_sample = 0
+# 控制套接字、守护进程启动时间 (monotonic) 和最近一次内存检查的结果 / Control socket, when the daemon started (monotonic) and the result of the last memory check
+control_socket = None
+daemon_started = None
+last_check = {}
+# 最近一次排序的候选 ('processes' / 'cgroups' -> {time, limit, ranked})，供 status 使用 / Latest ranked candidates ('processes' / 'cgroups' -> {time, limit, ranked}), served by status
+last_ranking = {}
 
 # --- Helper Functions ---
-def setup_logging(log_path):
+def import_daemon_modules():
+    """Import psutil and asyncio, which only the daemon and replay need; the other subcommands start without paying for them."""
+    global psutil, asyncio
+    import psutil
+    import asyncio
+
+class JsonFormatter(logging.Formatter):
+    """Format a record as one JSON line: time, level and message, plus the structured fields passed as extra=event_fields(...)."""
+
+    def format(self, record):
+        entry = {'time': round(record.created, 3), 'level': record.levelname, 'message': record.getMessage()}
+        entry.update(getattr(record, 'event', None) or {})
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class LogQueueHandler(QueueHandler):
+    """Hand records to the logging thread; while the queue is full records are dropped and counted.
+
+    Informational records are dropped right away. Warnings and records with event fields (the kill audit trail) first wait
+    up to LOG_PUT_TIMEOUT seconds for the logging thread to make room.
+    """
+    dropped = 0
+
+    def prepare(self, record):
+        # 在此渲染消息和异常，但保持分开，以便文本和 JSON 格式各自输出 / Render message and traceback here, but keep them apart for the text and JSON formatters
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            if record.levelno >= logging.WARNING or getattr(record, 'event', None):
+                self.queue.put(record, timeout=LOG_PUT_TIMEOUT)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            metric_inc('oomkiller_log_records_dropped_total')
+            return
+        self.report_dropped()
+
+    def report_dropped(self, timeout=None):
+        """Queue a notice with the number of records dropped so far, waiting up to `timeout` seconds for room (default: not at all)."""
+        if not self.dropped:
+            return
+        notice = logging.LogRecord(logger.name, logging.WARNING, __file__, 0,
+                                   f"Dropped {self.dropped} log record(s) while the log queue was full.", None, None)
+        notice.event = {'action': 'log_dropped', 'count': self.dropped}
+        try:
+            if timeout is None:
+                self.queue.put_nowait(notice)
+            else:
+                self.queue.put(notice, timeout=timeout)
+        except queue.Full:
+            return
+        self.dropped = 0
+
+class LogQueueListener(QueueListener):
+    """Write queued records from a background thread; stopping waits for room in a full queue instead of failing."""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel, timeout=LOG_STOP_TIMEOUT)
+
+class RateLimitFilter(logging.Filter):
+    """Let at most `burst` identical messages through per `window` seconds, then log how many were suppressed.
+
+    Records of the kill audit trail (LOG_AUDIT_ACTIONS) always pass, so every victim keeps its own log lines.
+    """
+
+    def __init__(self, window, burst):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        # (级别, 消息) -> [窗口开始时间, 次数, 第一条记录] / (level, message) -> [window start, count, first record]
+        self.seen = {}
+        self.lock = threading.Lock()
+        self.last_sweep = time.monotonic()
+
+    def filter(self, record):
+        if getattr(record, 'rate_limit_summary', False):
+            return True
+        if (getattr(record, 'event', None) or {}).get('action') in LOG_AUDIT_ACTIONS:
+            return True
+        now = time.monotonic()
+        key = (record.levelno, record.getMessage())
+        with self.lock:
+            summaries = self.sweep(now) if now - self.last_sweep >= self.window else []
+            entry = self.seen.get(key)
+            if entry is None:
+                entry = self.seen[key] = [now, 0, record]
+            entry[1] += 1
+            allowed = entry[1] <= self.burst
+        # 在锁外输出汇总，汇总记录会再次经过本过滤器 / Emit summaries outside the lock, they pass through this filter again
+        for summary in summaries:
+            logger.handle(summary)
+        if not allowed:
+            metric_inc('oomkiller_log_records_suppressed_total')
+        return allowed
+
+    def sweep(self, now, everything=False):
+        """Forget windows that ended (or all of them) and return summary records for those that suppressed messages. Needs the lock."""
+        self.last_sweep = now
+        summaries = []
+        for key, (started, count, record) in list(self.seen.items()):
+            if not everything and now - started < self.window:
+                continue
+            del self.seen[key]
+            if count > self.burst:
+                summary = logging.LogRecord(record.name, record.levelno, record.pathname, record.lineno,
+                                            f"Suppressed {count - self.burst} repeat(s) within {self.window:g}s of: {record.getMessage()}", None, None)
+                summary.rate_limit_summary = True
+                event = getattr(record, 'event', None) or {}
+                summary.event = dict(event, action='log_suppressed', suppressed_action=event.get('action'), count=count - self.burst)
+                summaries.append(summary)
+        return summaries
+
+    def flush(self):
+        """Log the summaries of all open windows, e.g. before logging stops."""
+        with self.lock:
+            summaries = self.sweep(time.monotonic(), everything=True)
+        for summary in summaries:
+            logger.handle(summary)
+
+def event_fields(action, victim=None, **fields):
+    """Structured fields for a log record, passed as extra=: the action, the victim's pid, user, name, rss and score, and extras such as latency.
+
+    Text logs ignore them; with log_format = json they become stable keys of the JSON line.
+    """
+    event = {'action': action}
+    if victim is not None:
+        event.update(pid=victim['pid'], user=victim['username'], name=victim['name'], rss=victim['rss'], score=victim.get('score', victim['rss']))
+    event.update(fields)
+    return {'event': event}
+
+def buffer_startup_logging():
+    """Hold log records in memory until setup_logging() knows the configured log_path, so handlers are only set up once."""
     global logger
     logger = logging.getLogger('oomkiller')
     logger.setLevel(logging.INFO)
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s', 
-                                  datefmt='%Y-%m-%d %H:%M:%S')
+    # 没有 target 时 MemoryHandler 保留所有日志，直到 setup_logging() 接管 / Without a target, MemoryHandler keeps every record until setup_logging() takes them over
+    logger.addHandler(MemoryHandler(capacity=0))
+
+def setup_logging(log_path):
+    """Set up the file, stdout and stderr handlers and emit the records buffered at startup.
+
+    log_format, log_queue_size and the rate limit come from validated_config, so they apply once the config is loaded.
+    With a log queue the handlers run on a listener thread and the caller only enqueues.
+    """
+    global logger, log_listener
+    logger = logging.getLogger('oomkiller')
+    logger.setLevel(logging.INFO)
+    startup_handlers = [handler for handler in logger.handlers if isinstance(handler, MemoryHandler)]
+    for handler in startup_handlers:
+        logger.removeHandler(handler)
+    for log_filter in logger.filters[:]:
+        logger.removeFilter(log_filter)
+    if validated_config.get('log_format', 'text') == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s', 
+                                      datefmt='%Y-%m-%d %H:%M:%S')
+    handlers = []
     # File handler for rotating logs
     try:
         # 5M per file, keep 3 backups
         file_handler = RotatingFileHandler(log_path, maxBytes=5*1024*1024, backupCount=3)
         file_handler.setFormatter(formatter)
         file_handler.setLevel(logging.INFO)
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
     except Exception as e:
         print(f"Failed to setup logging to {log_path}: {e}", file=sys.stderr)
         
@@ -43,16 +405,89 @@ def setup_logging(log_path):
     stream_handler.setFormatter(formatter)
     stream_handler.addFilter(lambda record: record.levelno <= logging.WARNING)
     stream_handler.setLevel(logging.INFO)
-    logger.addHandler(stream_handler)
+    handlers.append(stream_handler)
     
     stream_err_handler = logging.StreamHandler(sys.stderr)
     stream_err_handler.setFormatter(formatter)
     stream_err_handler.setLevel(logging.ERROR)
-    logger.addHandler(stream_err_handler)
+    handlers.append(stream_err_handler)
+
+    # 磁盘和 journald 写入在后台线程进行，不阻塞决策路径 / Disk and journald writes happen on a background thread, off the decision path
+    if validated_config.get('log_queue_size', 0) > 0:
+        log_listener = LogQueueListener(queue.Queue(validated_config['log_queue_size']), *handlers, respect_handler_level=True)
+        log_listener.start()
+        logger.addHandler(LogQueueHandler(log_listener.queue))
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
+    if validated_config.get('log_rate_limit_seconds', 0) > 0:
+        logger.addFilter(RateLimitFilter(validated_config['log_rate_limit_seconds'], validated_config['log_rate_limit_burst']))
     
     logger.info("OOM Killer logging initialized")
-    
-def load_config(config_path):
+    # 输出配置加载期间缓存的日志 / Emit the records buffered while the config was loaded
+    for handler in startup_handlers:
+        for record in handler.buffer:
+            logger.handle(record)
+        handler.close()
+
+def setup_cli_logging():
+    """Log warnings and errors to stderr only, for subcommands whose stdout is their output and which must not write to the daemon's log file.
+
+    Records buffered while the config was loaded are emitted too, as far as they pass the level.
+    """
+    global logger
+    logger = logging.getLogger('oomkiller')
+    logger.setLevel(logging.INFO)
+    startup_handlers = [handler for handler in logger.handlers if isinstance(handler, MemoryHandler)]
+    for handler in startup_handlers:
+        logger.removeHandler(handler)
+    stream_err_handler = logging.StreamHandler(sys.stderr)
+    stream_err_handler.setFormatter(logging.Formatter('%(levelname)s - %(message)s'))
+    stream_err_handler.setLevel(logging.WARNING)
+    logger.addHandler(stream_err_handler)
+    for handler in startup_handlers:
+        for record in handler.buffer:
+            logger.handle(record)
+        handler.close()
+
+def stop_logging():
+    """Log pending rate limit summaries, write out everything still queued and close all handlers."""
+    global log_listener
+    if logger is None:
+        return
+    for log_filter in logger.filters:
+        if isinstance(log_filter, RateLimitFilter):
+            log_filter.flush()
+    if log_listener is not None:
+        # 在停止前报告尚未报告的丢弃数量 / Report records dropped since the last notice before stopping
+        for handler in logger.handlers:
+            if isinstance(handler, LogQueueHandler):
+                handler.acquire()
+                try:
+                    handler.report_dropped(LOG_STOP_TIMEOUT)
+                finally:
+                    handler.release()
+        try:
+            log_listener.stop()
+        except queue.Full:
+            print("Log queue still full, some log records were not written.", file=sys.stderr)
+        for handler in log_listener.handlers:
+            handler.close()
+        log_listener = None
+    for handler in logger.handlers[:]:
+        handler.close()
+        logger.removeHandler(handler)
+
+def reset_logging(log_path):
+    """Close the current handlers and set up logging again, e.g. when the log settings change on reload."""
+    stop_logging()
+    setup_logging(log_path)
+
+def load_config(config_path, reload=False):
+    """Read and validate the config file into a new dict and swap it in as validated_config in one step.
+
+    At startup any error exits; on reload errors are logged, the running configuration is kept and False is returned.
+    """
     global validated_config
     config = configparser.ConfigParser()
 
@@ -64,6 +499,8 @@ def load_config(config_path):
         # 记录错误日志（如果 logger 已基本设置）
         if logger:
             logger.error(f"Configuration file not found at {config_path}")
+        if reload:
+            return False
         sys.exit(1) # 直接退出
 
     try:
@@ -78,55 +515,217 @@ def load_config(config_path):
         print(f"Error parsing config file {config_path}: {e}", file=sys.stderr)
         if logger:
              logger.error(f"Error parsing config file {config_path}: {e}")
+        if reload:
+            return False
         sys.exit(1)
     except Exception as e:
         print(f"Error loading config from {config_path}: {e}", file=sys.stderr)
         if logger:
             logger.error(f"Error loading config from {config_path}: {e}")
+        if reload:
+            return False
         sys.exit(1)
 
     # --- Validate and Store Config ---
-    validated_config = {} # Reset validated config
+    new_config = {} # 先完整校验再替换 / Validate everything before swapping it in
     try:
         # [General] Validation - 必须存在 General Section
         if not config.has_section('General'):
             raise configparser.NoSectionError('General')
 
-        validated_config['query_interval_seconds'] = config.getint('General', 'query_interval_seconds')
-        validated_config['kill_wait_seconds'] = config.getint('General', 'kill_wait_seconds')
-        validated_config['min_available_memory_percentage'] = config.getfloat('General', 'min_available_memory_percentage')
-        validated_config['min_available_swap_percentage'] = config.getfloat('General', 'min_available_swap_percentage')
+        new_config['query_interval_seconds'] = config.getint('General', 'query_interval_seconds')
+        new_config['kill_wait_seconds'] = config.getint('General', 'kill_wait_seconds')
+        new_config['min_available_memory_percentage'] = config.getfloat('General', 'min_available_memory_percentage')
+        new_config['min_available_swap_percentage'] = config.getfloat('General', 'min_available_swap_percentage')
         avoid_processes_str = config.get('General', 'avoid_processes')
-        validated_config['avoid_processes'] = [p.strip() for p in avoid_processes_str.split(',') if p.strip()]
+        new_config['avoid_processes'] = [p.strip() for p in avoid_processes_str.split(',') if p.strip()]
         prioritize_kill_processes_str = config.get('General', 'prioritize_kill_processes')
-        validated_config['prioritize_kill_processes'] = [p.strip() for p in prioritize_kill_processes_str.split(',') if p.strip()]
-        validated_config['log_path'] = os.path.abspath(config.get('General', 'log_path'))
+        new_config['prioritize_kill_processes'] = [p.strip() for p in prioritize_kill_processes_str.split(',') if p.strip()]
+        new_config['log_path'] = os.path.abspath(config.get('General', 'log_path'))
+        # 日志格式、异步队列和重复消息限速 / Log format, asynchronous queue and rate limit for repeated messages
+        new_config['log_format'] = config.get('General', 'log_format', fallback='text').strip().lower()
+        if new_config['log_format'] not in ('text', 'json'):
+            raise ValueError(f"log_format must be 'text' or 'json', got '{new_config['log_format']}'.")
+        new_config['log_queue_size'] = config.getint('General', 'log_queue_size', fallback=10000)
+        if new_config['log_queue_size'] < 0:
+            raise ValueError("log_queue_size must not be negative.")
+        new_config['log_rate_limit_seconds'] = config.getfloat('General', 'log_rate_limit_seconds', fallback=10.0)
+        new_config['log_rate_limit_burst'] = config.getint('General', 'log_rate_limit_burst', fallback=5)
+        if new_config['log_rate_limit_seconds'] < 0:
+            raise ValueError("log_rate_limit_seconds must not be negative.")
+        if new_config['log_rate_limit_burst'] < 1:
+            raise ValueError("log_rate_limit_burst must be at least 1.")
         # enable_notifications 仍然是必须的
-        validated_config['enable_notifications'] = config.getboolean('General', 'enable_notifications')
-
-        common_processes = set(validated_config['avoid_processes']) & set(validated_config['prioritize_kill_processes'])
+        new_config['enable_notifications'] = config.getboolean('General', 'enable_notifications')
+
+        # 压力检测方式，旧配置文件中可能不存在，因此使用默认值 / Trigger mode, optional for older config files
+        new_config['trigger_mode'] = config.get('General', 'trigger_mode', fallback='psi').strip().lower()
+        if new_config['trigger_mode'] not in ('psi', 'interval'):
+            raise ValueError(f"trigger_mode must be 'psi' or 'interval', got '{new_config['trigger_mode']}'.")
+        new_config['psi_some_stall_ms'] = config.getint('General', 'psi_some_stall_ms', fallback=150)
+        new_config['psi_full_stall_ms'] = config.getint('General', 'psi_full_stall_ms', fallback=100)
+        new_config['psi_window_ms'] = config.getint('General', 'psi_window_ms', fallback=1000)
+        # 内核要求窗口在 500ms 到 10s 之间 / The kernel only accepts windows between 500ms and 10s
+        if not 500 <= new_config['psi_window_ms'] <= 10000:
+            raise ValueError("psi_window_ms must be between 500 and 10000.")
+        for kind in ('some', 'full'):
+            if not 0 <= new_config[f'psi_{kind}_stall_ms'] <= new_config['psi_window_ms']:
+                raise ValueError(f"psi_{kind}_stall_ms must be between 0 and psi_window_ms.")
+
+        # 选择进程还是整个 cgroup 作为目标 / Whether victims are single processes or whole cgroups
+        new_config['victim_mode'] = config.get('General', 'victim_mode', fallback='process').strip().lower()
+        if new_config['victim_mode'] not in ('process', 'cgroup'):
+            raise ValueError(f"victim_mode must be 'process' or 'cgroup', got '{new_config['victim_mode']}'.")
+        new_config['cgroup_root'] = os.path.abspath(config.get('General', 'cgroup_root', fallback='/sys/fs/cgroup'))
+
+        # 进程评分方式 / How process candidates are scored
+        new_config['score_formula'] = config.get('General', 'score_formula', fallback='rss').strip().lower()
+        if new_config['score_formula'] not in SCORE_FORMULAS:
+            raise ValueError(f"score_formula must be one of {', '.join(SCORE_FORMULAS)}, got '{new_config['score_formula']}'.")
+        new_config['score_oom_score_adj'] = config.getboolean('General', 'score_oom_score_adj', fallback=False)
+        new_config['score_candidates'] = config.getint('General', 'score_candidates', fallback=20)
+        if new_config['score_candidates'] < 1:
+            raise ValueError("score_candidates must be at least 1.")
+
+        # 每用户内存软配额和公平分配 / Per-user soft memory quotas and fair share
+        new_config['user_quotas'] = parse_user_quotas(config.get('General', 'user_quotas', fallback=''))
+        new_config['fair_share'] = config.getboolean('General', 'fair_share', fallback=False)
+
+        # 内存压力统计方式: basic 比较 swap 空闲比例，detailed 计算有效 swap 余量并检测颠簸 / Pressure accounting: basic compares free swap, detailed computes effective swap headroom and detects thrashing
+        new_config['memory_accounting'] = config.get('General', 'memory_accounting', fallback='basic').strip().lower()
+        if new_config['memory_accounting'] not in ('basic', 'detailed'):
+            raise ValueError(f"memory_accounting must be 'basic' or 'detailed', got '{new_config['memory_accounting']}'.")
+        new_config['thrash_swapin_pages_per_second'] = config.getfloat('General', 'thrash_swapin_pages_per_second', fallback=2500.0)
+        new_config['thrash_majfault_per_second'] = config.getfloat('General', 'thrash_majfault_per_second', fallback=5000.0)
+        new_config['thrash_file_cache_percentage'] = config.getfloat('General', 'thrash_file_cache_percentage', fallback=5.0)
+        new_config['thrash_window_seconds'] = config.getfloat('General', 'thrash_window_seconds', fallback=10.0)
+        if new_config['thrash_swapin_pages_per_second'] <= 0 or new_config['thrash_majfault_per_second'] <= 0:
+            raise ValueError("thrash_swapin_pages_per_second and thrash_majfault_per_second must be positive.")
+        if new_config['thrash_window_seconds'] < THRASH_MIN_SECONDS:
+            raise ValueError(f"thrash_window_seconds must be at least {THRASH_MIN_SECONDS:g}.")
+
+        # 供 status 子命令查询的本地控制套接字，留空则禁用 / Local control socket queried by the status subcommand, empty disables it
+        new_config['control_socket'] = config.get('General', 'control_socket', fallback=DEFAULT_CONTROL_SOCKET).strip()
+        if new_config['control_socket']:
+            new_config['control_socket'] = os.path.abspath(new_config['control_socket'])
+
+        # 一次最多同时杀死的进程数 / Maximum number of processes signalled at once
+        new_config['max_batch_kills'] = config.getint('General', 'max_batch_kills', fallback=3)
+        if new_config['max_batch_kills'] < 1:
+            raise ValueError("max_batch_kills must be at least 1.")
+
+        # 影子模式: 完整运行检测和选择，只记录而不杀死 / Shadow mode: run detection and selection in full, but only log and trace
+        new_config['shadow_mode'] = config.getboolean('General', 'shadow_mode', fallback=False)
+        # 内存压力追踪，供 replay 子命令离线回放 / Pressure traces for offline replay with the replay subcommand
+        new_config['trace_dir'] = config.get('General', 'trace_dir', fallback='').strip()
+        new_config['trace_retention_days'] = config.getint('General', 'trace_retention_days', fallback=7)
+        new_config['trace_margin_percentage'] = config.getfloat('General', 'trace_margin_percentage', fallback=20.0)
+        if new_config['trace_retention_days'] < 1:
+            raise ValueError("trace_retention_days must be at least 1.")
+
+        # 先冻结候选进程再决定是否杀死 / Freeze candidates first, then decide whether to kill them
+        new_config['freeze_victims'] = config.getboolean('General', 'freeze_victims', fallback=False)
+        new_config['freeze_seconds'] = config.getfloat('General', 'freeze_seconds', fallback=1.0)
+        if new_config['freeze_seconds'] < 0:
+            raise ValueError("freeze_seconds must not be negative.")
+
+        # 内存趋势预测与自适应检测间隔 / Memory trend prediction and adaptive polling
+        new_config['trend_window_seconds'] = config.getfloat('General', 'trend_window_seconds', fallback=30.0)
+        new_config['min_query_interval_seconds'] = config.getfloat('General', 'min_query_interval_seconds', fallback=1.0)
+        new_config['proactive_kill'] = config.getboolean('General', 'proactive_kill', fallback=False)
+        new_config['proactive_kill_seconds'] = config.getfloat('General', 'proactive_kill_seconds', fallback=10.0)
+        if new_config['min_query_interval_seconds'] <= 0 or new_config['min_query_interval_seconds'] > new_config['query_interval_seconds']:
+            raise ValueError("min_query_interval_seconds must be positive and not greater than query_interval_seconds.")
+
+        # 杀死历史记录和重复违规者优先 / Kill history journal and repeat offender prioritization
+        new_config['history_path'] = config.get('General', 'history_path', fallback='/var/lib/oomkiller/history.db').strip()
+        if new_config['history_path']:
+            new_config['history_path'] = os.path.abspath(new_config['history_path'])
+        new_config['history_retention_days'] = config.getint('General', 'history_retention_days', fallback=90)
+        new_config['prioritize_repeat_offenders'] = config.getboolean('General', 'prioritize_repeat_offenders', fallback=False)
+        new_config['repeat_offender_kills'] = config.getint('General', 'repeat_offender_kills', fallback=2)
+        new_config['repeat_offender_window_hours'] = config.getfloat('General', 'repeat_offender_window_hours', fallback=24.0)
+        if new_config['history_retention_days'] < 1:
+            raise ValueError("history_retention_days must be at least 1.")
+        if new_config['repeat_offender_kills'] < 1 or new_config['repeat_offender_window_hours'] <= 0:
+            raise ValueError("repeat_offender_kills must be at least 1 and repeat_offender_window_hours must be positive.")
+
+        # [Fleet] 可选，向集中收集端发送事件 / Optional [Fleet] section, streams events to a central collector
+        new_config['fleet'] = {}
+        new_config['fleet']['fleet_collector'] = config.get('Fleet', 'fleet_collector', fallback='').strip()
+        new_config['fleet']['fleet_node_name'] = config.get('Fleet', 'fleet_node_name', fallback='').strip() or os.uname().nodename
+        new_config['fleet']['fleet_token'] = config.get('Fleet', 'fleet_token', fallback='').strip()
+        new_config['fleet']['fleet_batch_seconds'] = config.getfloat('Fleet', 'fleet_batch_seconds', fallback=5.0)
+        new_config['fleet']['fleet_queue_size'] = config.getint('Fleet', 'fleet_queue_size', fallback=1000)
+        new_config['fleet']['fleet_sample_seconds'] = config.getfloat('Fleet', 'fleet_sample_seconds', fallback=60.0)
+        if new_config['fleet']['fleet_collector']:
+            fleet_address = new_config['fleet']['fleet_collector']
+            if not fleet_address.startswith('unix:') and not fleet_address.rpartition(':')[2].isdigit():
+                raise ValueError(f"fleet_collector must be host:port or unix:/path, got '{fleet_address}'.")
+        if new_config['fleet']['fleet_batch_seconds'] <= 0 or new_config['fleet']['fleet_sample_seconds'] <= 0 or new_config['fleet']['fleet_queue_size'] < 1:
+            raise ValueError("fleet_batch_seconds and fleet_sample_seconds must be positive and fleet_queue_size at least 1.")
+
+        # 紧急模式: 锁定内存、提高优先级并避免被内核 OOM Killer 杀死 / Emergency mode: lock memory, raise priority, shield from the kernel OOM killer
+        new_config['emergency_mode'] = config.getboolean('General', 'emergency_mode', fallback=False)
+        new_config['emergency_nice'] = config.getint('General', 'emergency_nice', fallback=-15)
+        if not -20 <= new_config['emergency_nice'] <= 19:
+            raise ValueError("emergency_nice must be between -20 and 19.")
+
+        common_processes = set(new_config['avoid_processes']) & set(new_config['prioritize_kill_processes'])
         if common_processes:
             logger.warning(f"Processes found in both avoid_processes and prioritize_kill_processes: {','.join(common_processes)}. These processes will be avoided.")
-            validated_config['prioritize_kill_processes'] = [p for p in validated_config['prioritize_kill_processes'] if p not in common_processes]
+            new_config['prioritize_kill_processes'] = [p for p in new_config['prioritize_kill_processes'] if p not in common_processes]
+        # 预编译匹配规则，无效的规则在此报错 / Compile the matching rules up front so invalid rules are reported here
+        compile_matcher(frozenset(new_config['avoid_processes']))
+        compile_matcher(frozenset(new_config['prioritize_kill_processes']))
+
+        # [Metrics] 可选，旧配置文件中可能不存在 / Optional [Metrics] section, missing in older config files
+        new_config['metrics'] = {}
+        new_config['metrics']['enable_metrics'] = config.getboolean('Metrics', 'enable_metrics', fallback=False)
+        listen_address = config.get('Metrics', 'metrics_listen_address', fallback='127.0.0.1:9797').strip()
+        new_config['metrics']['metrics_textfile'] = config.get('Metrics', 'metrics_textfile', fallback='').strip()
+        new_config['metrics']['metrics_textfile_interval_seconds'] = config.getfloat('Metrics', 'metrics_textfile_interval_seconds', fallback=15.0)
+        new_config['metrics']['metrics_listen_address'] = None
+        if listen_address:
+            host, _, port = listen_address.rpartition(':')
+            if not port.isdigit() or not 0 < int(port) < 65536:
+                raise ValueError(f"metrics_listen_address must be host:port, got '{listen_address}'.")
+            new_config['metrics']['metrics_listen_address'] = (host.strip('[]'), int(port))
+        if new_config['metrics']['metrics_textfile']:
+            new_config['metrics']['metrics_textfile'] = os.path.abspath(new_config['metrics']['metrics_textfile'])
+        if new_config['metrics']['metrics_textfile_interval_seconds'] <= 0:
+            raise ValueError("metrics_textfile_interval_seconds must be positive.")
+        if new_config['metrics']['enable_metrics'] and not listen_address and not new_config['metrics']['metrics_textfile']:
+            raise ValueError("enable_metrics requires metrics_listen_address or metrics_textfile.")
 
         # [Notify] Validation (only if notifications enabled)
-        validated_config['notify'] = {} # Store notify settings in a sub-dict
-        if validated_config['enable_notifications']:
+        new_config['notify'] = {} # Store notify settings in a sub-dict
+        if new_config['enable_notifications']:
             # 如果启用了通知，则 Notify Section 必须存在
             if not config.has_section('Notify'):
                  raise configparser.NoSectionError('Notify (required when enable_notifications is true)')
                  
-            validated_config['notify']['notification_channel'] = config.get('Notify', 'notification_channel').strip()
+            new_config['notify']['notification_channel'] = config.get('Notify', 'notification_channel').strip()
+            new_config['notify']['notification_queue_size'] = config.getint('Notify', 'notification_queue_size', fallback=100)
+            new_config['notify']['notification_batch_seconds'] = config.getfloat('Notify', 'notification_batch_seconds', fallback=2.0)
+            new_config['notify']['notification_max_retries'] = config.getint('Notify', 'notification_max_retries', fallback=3)
+            if new_config['notify']['notification_queue_size'] < 1:
+                raise ValueError("notification_queue_size must be at least 1.")
             # 根据 channel 类型决定需要哪些键
-            channel = validated_config['notify']['notification_channel'].lower()
+            channel = new_config['notify']['notification_channel'].lower()
             if not channel:
                 raise ValueError("notification_channel cannot be empty when notifications are enabled.")
 
             if channel == 'feishu':
-                validated_config['notify']['feishu_appid'] = config.get('Notify', 'feishu_appid').strip()
-                validated_config['notify']['feishu_appsecret'] = config.get('Notify', 'feishu_appsecret').strip()
-                validated_config['notify']['feishu_botname'] = config.get('Notify', 'feishu_botname', fallback='').strip() # Botname 可选
-                if not validated_config['notify']['feishu_appid'] or not validated_config['notify']['feishu_appsecret']:
+                new_config['notify']['feishu_appid'] = config.get('Notify', 'feishu_appid').strip()
+                new_config['notify']['feishu_appsecret'] = config.get('Notify', 'feishu_appsecret').strip()
+                new_config['notify']['feishu_botname'] = config.get('Notify', 'feishu_botname', fallback='').strip() # Botname 可选
+                new_config['notify']['feishu_api_base'] = config.get('Notify', 'feishu_api_base', fallback='https://open.feishu.cn').strip().rstrip('/')
+                new_config['notify']['feishu_receive_id_type'] = config.get('Notify', 'feishu_receive_id_type', fallback='user_id').strip()
+                new_config['notify']['feishu_email_domain'] = config.get('Notify', 'feishu_email_domain', fallback='').strip()
+                if new_config['notify']['feishu_receive_id_type'] not in ('open_id', 'union_id', 'user_id', 'email'):
+                    raise ValueError("feishu_receive_id_type must be one of open_id, union_id, user_id, email.")
+                if not new_config['notify']['feishu_appid'] or not new_config['notify']['feishu_appsecret']:
                      raise ValueError("feishu_appid and feishu_appsecret are required for feishu channel.")
             # Add elif for other channels like 'email' here...
             else:
@@ -139,14 +738,22 @@ def load_config(config_path):
         print(err_msg, file=sys.stderr)
         if logger:
              logger.error(err_msg)
+        if reload:
+            return False
         sys.exit(1)
     except Exception as e:
         err_msg = f"Error validating config from '{config_path}': {e}"
         print(err_msg, file=sys.stderr)
         if logger:
             logger.error(err_msg)
+        if reload:
+            return False
         sys.exit(1)
     
+
+    validated_config = new_config
+    return True
+
 def check_memory_swap_usage():
     """Check memory and swap usage against configured thresholds"""
     try:
@@ -156,136 +763,2374 @@ def check_memory_swap_usage():
         
         # Convert to available percentage
         available_memory_percentage = (memory_info.available / memory_info.total) * 100 if memory_info.total > 0 else 100.0
-        available_swap_percentage = (swap_info.free / swap_info.total) * 100 if swap_info.total > 0 else 100.0
-        
         memory_ok = available_memory_percentage >= validated_config.get('min_available_memory_percentage')
-        swap_ok = available_swap_percentage >= validated_config.get('min_available_swap_percentage')
+        if validated_config.get('memory_accounting') == 'detailed':
+            # 有效 swap 余量，且不能处于颠簸状态 / Effective swap headroom, and the system must not be thrashing
+            available_swap_percentage, thrashing_now = detailed_swap_pressure()
+            swap_ok = available_swap_percentage >= validated_config.get('min_available_swap_percentage') and not thrashing_now
+        else:
+            available_swap_percentage = (swap_info.free / swap_info.total) * 100 if swap_info.total > 0 else 100.0
+            swap_ok = available_swap_percentage >= validated_config.get('min_available_swap_percentage')
         
         logger.debug(f"Memory: {memory_info.percent}% used, {available_memory_percentage}% available")
         logger.debug(f"Swap: {swap_info.percent}% used, {available_swap_percentage}% available")
+
+        record_memory_sample(memory_info, swap_info)
+        last_check.update(time=time.time(), available_memory_percentage=available_memory_percentage, available_swap_percentage=available_swap_percentage,
+                          memory_ok=memory_ok, swap_ok=swap_ok)
+        metric_set('oomkiller_available_memory_percent', available_memory_percentage)
+        metric_set('oomkiller_available_swap_percent', available_swap_percentage)
+        fleet_sample(available_memory_percentage, available_swap_percentage)
+        if validated_config.get('trace_dir'):
+            trace_sample(memory_info, swap_info, available_memory_percentage, available_swap_percentage)
         
         return memory_ok, swap_ok, available_memory_percentage, available_swap_percentage
     except Exception as e:
         logger.error(f"Error checking memory and swap usage: {e}")
         return False, False, 0.0, 0.0
     
-def get_memory_hogs(avoid_pids, avoid_names, prioritize_names):
-    """Find processes sorted by memory usage, excluding avoid_pids/avoid_names, prioritizing prioritize_names, and include username."""
+# --- Swap and Thrashing Accounting ---
+def read_meminfo():
+    """Parse /proc/meminfo into a dict of byte counts (fields without a unit, like HugePages_Total, are plain counts)."""
+    values = {}
+    with open(f'{PROC_ROOT}/meminfo', 'rb') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2:
+                values[parts[0].rstrip(b':').decode()] = int(parts[1]) * (1024 if len(parts) > 2 else 1)
+    return values
+
+def read_vmstat():
+    """Return the cumulative (pswpin, pgmajfault) counters from /proc/vmstat."""
+    counters = {}
+    with open(f'{PROC_ROOT}/vmstat', 'rb') as f:
+        for line in f:
+            name, _, value = line.partition(b' ')
+            if name in (b'pswpin', b'pgmajfault'):
+                counters[name] = int(value)
+    return counters.get(b'pswpin', 0), counters.get(b'pgmajfault', 0)
+
+def read_swap_devices():
+    """Return (device, size_bytes, used_bytes) for each active swap area in /proc/swaps."""
+    try:
+        with open(f'{PROC_ROOT}/swaps', 'rb') as f:
+            lines = f.read().splitlines()[1:] # 第一行为表头 / The first line is the header
+    except OSError:
+        return []
+    devices = []
+    for line in lines:
+        parts = line.split()
+        if len(parts) >= 4:
+            devices.append((parts[0].decode('utf-8', 'replace'), int(parts[2]) * 1024, int(parts[3]) * 1024))
+    return devices
+
+def read_zram_stats(device):
+    """Return (orig_data_size, mem_used_total, mem_limit) in bytes from a zram device's mm_stat, or None if it is not a zram device."""
+    name = os.path.basename(device)
+    if not name.startswith('zram'):
+        return None
+    try:
+        with open(f'{ZRAM_SYSFS_ROOT}/{name}/mm_stat', 'rb') as f:
+            fields = f.read().split()
+        return int(fields[0]), int(fields[2]), int(fields[3])
+    except (OSError, IndexError, ValueError):
+        return None
+
+def swap_headroom(meminfo):
+    """Return (free_bytes, total_bytes, zram_ram_bytes) of the swap that can still take pages.
+
+    Swap cache slots count as free, the kernel drops them when swap runs short. A zram device cannot store more than the
+    RAM it may still use (up to its mem_limit, otherwise MemAvailable) times its current compression ratio, so its free
+    space is capped by that rather than by its nominal size.
+    """
+    free = total = zram_ram = 0
+    for device, size, used in read_swap_devices():
+        device_free = size - used
+        zram = read_zram_stats(device)
+        if zram is not None:
+            orig_data_size, mem_used_total, mem_limit = zram
+            zram_ram += mem_used_total
+            # 尚未存入数据时按 1:1 压缩比保守估计 / Assume no compression until the device holds data
+            ratio = orig_data_size / mem_used_total if mem_used_total > 0 else 1.0
+            ram_left = mem_limit - mem_used_total if mem_limit > 0 else meminfo.get('MemAvailable', 0)
+            device_free = min(device_free, int(max(ram_left, 0) * ratio))
+        free += device_free
+        total += size
+    return min(free + meminfo.get('SwapCached', 0), total), total, zram_ram
+
+def thrash_rates():
+    """Sample /proc/vmstat and return (swap-in pages/s, major faults/s) over the last thrash_window_seconds.
+
+    Returns None while the samples span less than THRASH_MIN_SECONDS, e.g. right after reset_thrash_window().
+    """
+    now = time.monotonic()
+    pswpin, pgmajfault = read_vmstat()
+    vmstat_samples.append((now, pswpin, pgmajfault))
+    # 保留覆盖整个窗口所需的最旧样本 / Keep the oldest sample still needed to cover the window
+    while len(vmstat_samples) > 2 and now - vmstat_samples[1][0] >= validated_config['thrash_window_seconds']:
+        vmstat_samples.popleft()
+    started, first_pswpin, first_pgmajfault = vmstat_samples[0]
+    span = now - started
+    if span < THRASH_MIN_SECONDS:
+        return None
+    return (pswpin - first_pswpin) / span, (pgmajfault - first_pgmajfault) / span
+
+def reset_thrash_window(still_thrashing):
+    """Measure thrashing afresh from now on, e.g. after a kill or while victims are frozen; the verdict is kept until new samples span THRASH_MIN_SECONDS."""
+    global thrashing
+    vmstat_samples.clear()
+    thrashing = still_thrashing
+
+def check_thrashing(meminfo):
+    """Decide whether the system is thrashing rather than merely using swap.
+
+    Sustained swap-in at thrash_swapin_pages_per_second or more is thrashing. Major faults at thrash_majfault_per_second
+    or more only count while the file cache (Active(file) + Inactive(file)) is below thrash_file_cache_percentage of RAM;
+    with plenty of cache they are cold file reads, not a working set being evicted and read back.
+    """
+    global thrashing
+    rates = thrash_rates()
+    if rates is None:
+        return thrashing
+    swapin_rate, majfault_rate = rates
+    file_cache = meminfo.get('Active(file)', 0) + meminfo.get('Inactive(file)', 0)
+    cache_squeezed = file_cache < validated_config['thrash_file_cache_percentage'] / 100 * meminfo['MemTotal']
+    was_thrashing = thrashing
+    thrashing = swapin_rate >= validated_config['thrash_swapin_pages_per_second'] or (
+        cache_squeezed and majfault_rate >= validated_config['thrash_majfault_per_second'])
+    metric_set('oomkiller_swapin_pages_per_second', swapin_rate)
+    metric_set('oomkiller_major_faults_per_second', majfault_rate)
+    metric_set('oomkiller_thrashing', int(thrashing))
+    details = f"swap-in {swapin_rate:.0f} pages/s, major faults {majfault_rate:.0f}/s, file cache {file_cache // 1024 // 1024}MB"
+    if thrashing and not was_thrashing:
+        logger.warning(f"System is thrashing: {details}")
+    elif was_thrashing and not thrashing:
+        logger.info(f"System stopped thrashing: {details}")
+    else:
+        logger.debug(f"Thrashing check: {details}")
+    return thrashing
+
+def detailed_swap_pressure():
+    """Detailed accounting: return (available_swap_percentage, thrashing) from /proc/meminfo, /proc/swaps, zram mm_stat and /proc/vmstat."""
+    meminfo = read_meminfo()
+    swap_free, swap_total, zram_ram = swap_headroom(meminfo)
+    available_swap_percentage = swap_free / swap_total * 100 if swap_total > 0 else 100.0
+    metric_set('oomkiller_zram_memory_used_bytes', zram_ram)
+    logger.debug(f"Swap headroom: {swap_free // 1024 // 1024}MB of {swap_total // 1024 // 1024}MB "
+                 f"(swap cache {meminfo.get('SwapCached', 0) // 1024 // 1024}MB, zram RAM {zram_ram // 1024 // 1024}MB)")
+    return available_swap_percentage, check_thrashing(meminfo)
+
+def swap_ranking_enabled():
+    """Whether candidates are ranked by RSS plus swapped-out memory: detailed accounting while any swap is in use.
+
+    During replay, swap usage comes from the trace sample rather than the host running the replay.
+    """
+    if validated_config.get('memory_accounting') != 'detailed':
+        return False
+    swap_used = replay_swap_used if replay_swap_used is not None else psutil.swap_memory().used
+    return swap_used > 0
+
+# --- Memory Trend Prediction ---
+def record_memory_sample(memory_info, swap_info):
+    """Append a (time, available, swap_free, swap_total, psi_some_avg10, psi_full_avg10) sample to the ring buffer."""
+    pressure = read_memory_pressure() or {}
+    memory_samples.append((time.monotonic(), memory_info.available, swap_info.free, swap_info.total,
+                           pressure.get('some', {}).get('avg10', 0.0), pressure.get('full', {}).get('avg10', 0.0)))
+
+def linear_slope(xs, ys):
+    """Least-squares slope of ys over xs."""
+    n = len(xs)
+    mean_x = sum(xs) / n
+    mean_y = sum(ys) / n
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    if var_x == 0:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var_x
+
+def estimate_time_to_exhaustion():
+    """Predict the seconds until available memory (or swap) crosses its threshold from the samples in the trend window.
+
+    Returns (seconds, memory_slope_bytes_per_second); seconds is None when there are too few samples or nothing is shrinking.
+    """
+    now = time.monotonic()
+    window = [sample for sample in memory_samples if now - sample[0] <= validated_config['trend_window_seconds']]
+    if len(window) < 3:
+        return None, 0.0
+    times = [sample[0] for sample in window]
+    memory_slope = linear_slope(times, [sample[1] for sample in window])
+    estimates = []
+    if memory_slope < 0:
+        memory_floor = validated_config['min_available_memory_percentage'] / 100 * TOTAL_MEMORY
+        estimates.append((window[-1][1] - memory_floor) / -memory_slope)
+    swap_total = window[-1][3]
+    if swap_total > 0 and validated_config['min_available_swap_percentage'] > 0:
+        swap_slope = linear_slope(times, [sample[2] for sample in window])
+        if swap_slope < 0:
+            swap_floor = validated_config['min_available_swap_percentage'] / 100 * swap_total
+            estimates.append((window[-1][2] - swap_floor) / -swap_slope)
+    if not estimates:
+        return None, memory_slope
+    return max(min(estimates), 0.0), memory_slope
+
+def next_query_interval(time_to_exhaustion):
+    """Poll faster as exhaustion gets closer: a quarter of the predicted time, between min_query_interval_seconds and query_interval_seconds."""
+    if time_to_exhaustion is None:
+        return validated_config['query_interval_seconds']
+    return min(max(time_to_exhaustion / 4, validated_config['min_query_interval_seconds']), validated_config['query_interval_seconds'])
+
+def get_fastest_growing_process(avoid_names):
+    """Return the killable process whose RSS grew fastest since the last process table refresh, or None."""
+    avoid = compile_matcher(frozenset(avoid_names))
+    own_pid = os.getpid()
+    growers = sorted(((proc['growth'], pid) for pid, proc in process_table.items()
+                      if proc['growth'] > 0 and pid != own_pid and not match_process(avoid, proc)),
+                     reverse=True)
+    for growth, pid in growers[:DEFAULT_HOG_CANDIDATES]:
+        proc = process_table[pid]
+        cmdline = verify_process(pid, proc)
+        if cmdline is None:
+            continue
+        return {
+            'pid': pid,
+            'name': process_name(proc),
+            'rss': proc['rss'],
+            'growth': growth,
+            'cmdline': ' '.join(cmdline),
+            'prioritized': False,
+            'repeat_offender': False,
+            'quota_excess': 0,
+            'username': username_for_uid(proc['uid'])
+        }
+    return None
+
+async def proactive_kill(time_to_exhaustion, memory_slope):
+    """Track per-process growth while memory is shrinking and kill the fastest-growing process once exhaustion is within proactive_kill_seconds."""
+    horizon = validated_config['proactive_kill_seconds']
+    # 较远时只刷新进程表以积累增长速度 / Further out, only refresh the table so growth rates are available in time
+    if time_to_exhaustion > horizon * 4:
+        return
+    refresh_process_table()
+    if time_to_exhaustion > horizon:
+        return
+    victim = get_fastest_growing_process(validated_config['avoid_processes'])
+    # 只有当单个进程能解释大部分下降时才出手 / Only act when a single process explains most of the decline
+    if victim is None or victim['growth'] < -memory_slope / 2:
+        logger.info(f"Memory predicted to cross threshold in {time_to_exhaustion:.1f}s, but no single process accounts for the growth.")
+        return
+    logger.warning(f"Memory predicted to cross threshold in {time_to_exhaustion:.1f}s (available memory changing {memory_slope / 1024 / 1024:+.1f}MB/s). "
+                   f"Proactively killing fastest-growing process PID={victim['pid']}, Name={victim['name']}, growing {victim['growth'] / 1024 / 1024:.1f}MB/s",
+                   extra=event_fields('proactive', victim, growth=victim['growth'], seconds_to_exhaustion=round(time_to_exhaustion, 1)))
+    if validated_config['shadow_mode']:
+        shadow_decision([victim])
+        return
+    trace_decision([victim], 'kill')
+    await kill_processes([victim])
+    # 杀死后的样本不再反映趋势 / Earlier samples no longer describe the trend after a kill
+    memory_samples.clear()
+    reset_thrash_window(False)
+
+# --- Pressure Stall Information (PSI) ---
+def read_memory_pressure():
+    """Read /proc/pressure/memory as {'some': {...}, 'full': {...}}. Returns None if PSI is unavailable."""
+    try:
+        with open(PSI_MEMORY_PATH) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    pressure = {}
+    for line in lines:
+        fields = line.split()
+        if not fields:
+            continue
+        values = {}
+        for field in fields[1:]:
+            key, _, value = field.partition('=')
+            values[key] = int(value) if key == 'total' else float(value)
+        pressure[fields[0]] = values
+    return pressure
+
+def close_psi_triggers():
+    """Unregister all PSI triggers."""
+    global psi_poller, psi_fds
+    if psi_poller is not None:
+        if event_loop is not None and not event_loop.is_closed():
+            event_loop.remove_reader(psi_poller.fileno())
+        psi_poller.close()
+    for fd in psi_fds:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+    psi_fds = []
+    psi_poller = None
+
+def setup_psi_triggers():
+    """Register 'some'/'full' triggers on /proc/pressure/memory. Returns True if at least one trigger is active."""
+    global psi_poller
+    close_psi_triggers()
+    window_us = validated_config['psi_window_ms'] * 1000
+    # 触发器只报告 EPOLLPRI，事件循环监视 epoll 自身的文件描述符 / Triggers only report EPOLLPRI, so the event loop watches the epoll fd itself
+    poller = select.epoll()
+    for kind in ('some', 'full'):
+        stall_ms = validated_config[f'psi_{kind}_stall_ms']
+        if stall_ms <= 0:
+            continue # 0 表示禁用该触发器 / 0 disables this trigger
+        # 每个触发器需要单独的文件描述符 / Each trigger needs its own file descriptor
+        try:
+            fd = os.open(PSI_MEMORY_PATH, os.O_RDWR | os.O_NONBLOCK)
+        except OSError as e:
+            logger.warning(f"Cannot open {PSI_MEMORY_PATH} for PSI triggers: {e}")
+            break
+        try:
+            os.write(fd, f"{kind} {stall_ms * 1000} {window_us}\0".encode())
+        except OSError as e:
+            os.close(fd)
+            logger.warning(f"Failed to register PSI '{kind}' trigger ({stall_ms}ms per {validated_config['psi_window_ms']}ms): {e}")
+            continue
+        poller.register(fd, select.EPOLLPRI)
+        psi_fds.append(fd)
+        logger.info(f"Registered PSI '{kind}' trigger: {stall_ms}ms stall per {validated_config['psi_window_ms']}ms window")
+    if psi_fds:
+        psi_poller = poller
+        if event_loop is not None:
+            event_loop.add_reader(poller.fileno(), psi_ready)
+        return True
+    poller.close()
+    return False
+
+def psi_ready():
+    """Event loop callback for the PSI epoll fd: flag memory pressure and wake the monitor."""
+    global psi_pending
+    for fd, event in psi_poller.poll(0):
+        if event & (select.EPOLLERR | select.EPOLLHUP):
+            # 例如 cgroup 被移除或文件描述符失效 / e.g. the monitored resource went away
+            logger.warning("PSI trigger reported an error, falling back to interval polling.")
+            close_psi_triggers()
+            break
+        psi_pending = True
+    wakeup_event.set()
+
+async def wait_for_pressure(timeout_seconds):
+    """Wait up to timeout_seconds, waking early on a PSI trigger event or a reload request. Returns True if woken by memory pressure."""
+    global psi_pending
+    try:
+        await asyncio.wait_for(wakeup_event.wait(), timeout_seconds)
+    except asyncio.TimeoutError:
+        pass
+    wakeup_event.clear()
+    pressure, psi_pending = psi_pending, False
+    return pressure
+
+# --- /proc Scanner ---
+def read_proc_file(path):
+    """Read a small /proc file into the shared proc_read_buffer without allocating a file object. Returns the byte count, or -1 on error."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return -1
+    try:
+        return os.readv(fd, [proc_read_buffer])
+    except OSError:
+        return -1
+    finally:
+        os.close(fd)
+
+def read_proc_stat(pid):
+    """Parse /proc/<pid>/stat into (comm, state, rss_bytes, start_time). Returns None if the process is gone."""
+    size = read_proc_file(f'{PROC_ROOT}/{pid}/stat')
+    if size <= 0:
+        return None
+    data = proc_read_buffer
+    # comm 中可能包含空格和括号，因此以最后一个 ')' 为界 / comm may contain spaces and parentheses, split on the last ')'
+    lpar = data.find(b'(', 0, size)
+    rpar = data.rfind(b')', 0, size)
+    # 只拆分到 rss 字段为止 / Only split as far as the rss field
+    fields = data[rpar + 2:size].split(None, 22)
+    try:
+        # fields[0] 为第 3 个字段 (state) / fields[0] is field 3 (state); starttime is field 22, rss (pages) is field 24
+        return bytes(data[lpar + 1:rpar]).decode('utf-8', 'replace'), fields[0].decode(), int(fields[21]) * PAGE_SIZE, int(fields[19])
+    except (IndexError, ValueError):
+        return None
+
+def read_proc_cmdline(pid):
+    """Return the argument list from /proc/<pid>/cmdline (empty for kernel threads and exited processes)."""
+    try:
+        with open(f'{PROC_ROOT}/{pid}/cmdline', 'rb') as f:
+            data = f.read()
+    except OSError:
+        return []
+    return [arg.decode('utf-8', 'replace') for arg in data.rstrip(b'\0').split(b'\0')] if data else []
+
+def read_proc_uid(pid):
+    """Return the real UID of a process from /proc/<pid>/status, or None if the process is gone."""
+    try:
+        with open(f'{PROC_ROOT}/{pid}/status', 'rb') as f:
+            for line in f:
+                if line.startswith(b'Uid:'):
+                    return int(line.split()[1])
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
+
+def username_for_uid(uid):
+    """Resolve a UID to a username, caching the result (unknown UIDs resolve to the UID string, as psutil does)."""
+    username = uid_name_cache.get(uid)
+    if username is None:
+        try:
+            username = pwd.getpwuid(uid).pw_name
+        except KeyError:
+            username = str(uid)
+        uid_name_cache[uid] = username
+    return username
+
+def resolve_process_name(comm, cmdline):
+    """Return the full process name; the kernel truncates comm to 15 characters, so fall back to cmdline like psutil."""
+    if len(comm) >= 15 and cmdline:
+        exe_name = os.path.basename(cmdline[0])
+        if exe_name.startswith(comm):
+            return exe_name
+    return comm
+
+def read_proc_rss(pid):
+    """Return the resident set size in bytes from /proc/<pid>/statm (pid may be 'self'), or None if the process is gone."""
+    size = read_proc_file(f'{PROC_ROOT}/{pid}/statm')
+    if size <= 0:
+        return None
+    # 第二个字段为常驻页数 / The second field is the number of resident pages
+    start = proc_read_buffer.find(b' ', 0, size) + 1
+    end = proc_read_buffer.find(b' ', start, size)
+    if start <= 0 or end < 0:
+        return None
+    return int(proc_read_buffer[start:end]) * PAGE_SIZE
+
+def read_proc_swap(pid):
+    """Return VmSwap in bytes from /proc/<pid>/status (0 for kernel threads), or None if the process is gone."""
+    size = read_proc_file(f'{PROC_ROOT}/{pid}/status')
+    if size <= 0:
+        return None
+    start = proc_read_buffer.find(b'VmSwap:', 0, size)
+    if start < 0:
+        return 0
+    end = proc_read_buffer.find(b'\n', start, size)
+    try:
+        return int(proc_read_buffer[start + 7:end if end >= 0 else size].split()[0]) * 1024
+    except (IndexError, ValueError):
+        return 0
+
+def process_cmdline(proc):
+    """Return the cached argument list of a process table entry, reading it on first use."""
+    if proc['cmdline'] is None:
+        proc['cmdline'] = read_proc_cmdline(proc['pid'])
+    return proc['cmdline']
+
+def new_process_entry(pid, stat):
+    """Build a process table entry from read_proc_stat() output; cmdline and uid are filled in lazily."""
+    comm, _, rss, start_time = stat
+    return {'pid': pid, 'start_time': start_time, 'comm': comm, 'name': None, 'rss': rss, 'swap': 0, 'cmdline': None, 'uid': None,
+            'growth': 0.0, 'sampled_at': time.monotonic(), 'matches': {}, 'accounted_uid': None}
+
+def reset_process_identity(proc, comm):
+    """Forget what an entry cached about its program and owner after an exec or setuid; it is read again on next use."""
+    forget_user_memory(proc)
+    proc.update(comm=comm, name=None, cmdline=None, uid=None, matches={}, accounted_uid=None)
+
+def process_name(proc):
+    """Return the process name, resolving it from cmdline only when the kernel may have truncated comm to 15 characters."""
+    if proc['name'] is None:
+        proc['name'] = resolve_process_name(proc['comm'], process_cmdline(proc)) if len(proc['comm']) >= 15 else proc['comm']
+    return proc['name']
+
+def refresh_process_table():
+    """Update process_table in place: refresh RSS (and RSS growth rate) of known PIDs, add new PIDs and drop exited ones.
+
+    Every PID costs one read of /proc/<pid>/stat, which has both the RSS and the start time, so an entry whose PID was
+    reused is replaced instead of passing its growth rate and user accounting on to the new process.
+    Under detailed accounting with swap in use, VmSwap is refreshed too (one more /proc read per process).
+    """
+    started = time.perf_counter()
+    track_users = user_accounting_enabled()
+    track_swap = swap_ranking_enabled()
+    seen = set()
+    now = time.monotonic()
+    for entry in os.listdir(PROC_ROOT):
+        if not entry.isdigit():
+            continue
+        pid = int(entry)
+        stat = read_proc_stat(pid)
+        if stat is None:
+            continue
+        proc = process_table.get(pid)
+        if proc is not None and stat[3] != proc['start_time']:
+            # PID 被复用 / PID reused
+            forget_user_memory(process_table.pop(pid))
+            proc = None
+        if proc is not None and stat[0] != proc['comm']:
+            # 进程执行了新程序，名称、命令行和规则匹配都已过期 / The process exec'd, its name, cmdline and rule matches are stale
+            reset_process_identity(proc, stat[0])
+        if proc is not None:
+            # 已知进程只刷新 RSS / Known processes only get their RSS refreshed
+            rss = stat[2]
+            if track_users:
+                account_user_memory(proc, rss)
+            if now > proc['sampled_at']:
+                proc['growth'] = (rss - proc['rss']) / (now - proc['sampled_at'])
+            proc['rss'] = rss
+            proc['sampled_at'] = now
+        else:
+            if stat[1] in ('Z', 'X', 'x'):
+                continue
+            proc = process_table[pid] = new_process_entry(pid, stat)
+            if track_users:
+                account_user_memory(proc, proc['rss'])
+        if track_swap:
+            proc['swap'] = read_proc_swap(pid) or 0
+        elif proc['swap']:
+            proc['swap'] = 0
+        seen.add(pid)
+    for pid in process_table.keys() - seen:
+        forget_user_memory(process_table.pop(pid))
+    metric_set('oomkiller_processes_scanned', len(seen))
+    metric_observe('oomkiller_scan_duration_seconds', time.perf_counter() - started)
+
+def verify_process(pid, proc):
+    """Make sure a process table entry still refers to the same live process and return its cmdline.
+
+    The uid is read again, since a process may have called setuid since it was scanned. Returns None if the process
+    exited, its PID was reused (the entry is replaced), it exec'd another program or changed its owner since the scan
+    (the entry is reset, so rules are matched again on the next scan) or it has no cmdline (kernel thread).
+    """
+    stat = read_proc_stat(pid)
+    if stat is None:
+        return None
+    if stat[3] != proc['start_time']:
+        forget_user_memory(proc)
+        process_table[pid] = new_process_entry(pid, stat)
+        return None
+    uid = read_proc_uid(pid)
+    if uid is None:
+        return None
+    if stat[0] != proc['comm'] or (proc['uid'] is not None and uid != proc['uid']):
+        reset_process_identity(proc, stat[0])
+        return None
+    proc['uid'] = uid
+    cmdline = process_cmdline(proc)
+    if not cmdline:
+        return None
+    return cmdline
+
+def get_memory_hogs(avoid_pids, avoid_names, prioritize_names, limit=DEFAULT_HOG_CANDIDATES):
+    """Find up to `limit` processes sorted by memory usage, excluding avoid_pids/avoid_names, prioritizing prioritize_names, and include username.
+
+    avoid_names and prioritize_names are rule lists as accepted by compile_matcher(). After prioritized processes come
+    those of users over their memory quota (furthest over first), then known repeat offenders.
+
+    Uses the persistent process_table, so repeated calls only re-read RSS for processes that were already seen.
+    Candidates are popped from a heap instead of sorting the whole table. Under detailed accounting memory usage is RSS
+    plus VmSwap, so mostly swapped-out processes still rank by everything they hold.
+    """
+    started = time.perf_counter()
     try:
-        processes = []
         avoid_pids_set = set(avoid_pids)
-        avoid_names_set = set(avoid_names)
-        prioritize_names_set = set(prioritize_names)
         avoid_pids_set.add(os.getpid())
+        avoid = compile_matcher(frozenset(avoid_names))
+        prioritize = compile_matcher(frozenset(prioritize_names))
 
-        # Add 'username' to the attributes list
-        for proc in psutil.process_iter(['pid', 'name', 'memory_info', 'cmdline', 'status', 'username']):
-            try:
-                proc_info = proc.info
-                if proc_info['pid'] in avoid_pids_set or proc_info['name'] in avoid_names_set:
-                    continue
-                if not proc_info['cmdline'] or proc_info['status'] in [psutil.STATUS_ZOMBIE, psutil.STATUS_DEAD]:
-                    continue
+        refresh_process_table()
+        excess = user_quota_excess() if user_accounting_enabled() else {}
 
-                mem_info = proc_info['memory_info']
-                rss = mem_info.rss
-                if rss > 0:
-                    is_prioritized = proc_info['name'] in prioritize_names_set
-                    processes.append({
-                        'pid': proc_info['pid'],
-                        'name': proc_info['name'],
-                        'rss': rss,
-                        'cmdline': ' '.join(proc_info['cmdline']) if proc_info['cmdline'] else '',
-                        'prioritized': is_prioritized,
-                        'username': proc_info['username'] # Store username
-                    })
-            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                continue
-            except Exception as e:
-                # Log username if available in case of error during iteration
-                user = proc_info.get('username', 'N/A') if 'proc_info' in locals() else 'N/A'
-                pid = proc_info.get('pid', 'N/A') if 'proc_info' in locals() else 'N/A'
-                logger.error(f"Error getting info for process PID={pid}, User={user}: {e}")
-                continue
+        # 内核线程和僵尸进程 RSS 为 0 / Kernel threads and zombies have no RSS
+        heap = [(not match_process(prioritize, proc), -excess.get(proc['uid'], 0), not is_repeat_offender(proc), -(proc['rss'] + proc['swap']), pid)
+                for pid, proc in process_table.items()
+                if proc['rss'] + proc['swap'] > 0 and pid not in avoid_pids_set and not match_process(avoid, proc)]
+        heapq.heapify(heap)
 
-        processes.sort(key=lambda x: (not x['prioritized'], -x['rss']))
-        return processes
+        # 评分需要读取 smaps_rollup，只对内存最高的若干候选进行 / Scoring reads smaps_rollup, so only the top candidates by memory are scored
+        scoring = validated_config.get('score_formula', 'rss') != 'rss' or validated_config.get('score_oom_score_adj', False)
+        wanted = max(limit, validated_config.get('score_candidates', limit)) if scoring else limit
+
+        processes = []
+        evaluated = 0
+        while heap and len(processes) < wanted:
+            not_prioritized, neg_excess, not_repeat_offender, neg_usage, pid = heapq.heappop(heap)
+            evaluated += 1
+            proc = process_table[pid]
+            cmdline = verify_process(pid, proc)
+            if cmdline is None:
+                continue
+            score = freeable = -neg_usage
+            if scoring:
+                score, freeable = score_process(pid, -neg_usage)
+                if score is None:
+                    continue # oom_score_adj = -1000
+            processes.append({
+                'pid': pid,
+                'name': process_name(proc),
+                'rss': proc['rss'],
+                'swap': proc['swap'],
+                'score': score,
+                'freeable': freeable,
+                'cmdline': ' '.join(cmdline),
+                'prioritized': not not_prioritized,
+                'repeat_offender': not not_repeat_offender,
+                'quota_excess': -neg_excess,
+                'username': username_for_uid(proc['uid'])
+            })
+
+        if scoring:
+            processes.sort(key=lambda x: (not x['prioritized'], -x['quota_excess'], not x['repeat_offender'], -x['score']))
+        metric_inc('oomkiller_candidates_evaluated_total', evaluated)
+        metric_observe('oomkiller_selection_duration_seconds', time.perf_counter() - started)
+        return processes[:limit]
     except Exception as e:
         logger.error(f"Error getting memory hogs: {e}")
         return []
 
-def kill_process(pid, name, cmdline, rss, username):
-    """Attempt to kill a process gracefully (SIGTERM) then forcefully (SIGKILL), and notify user."""
-    logger.warning(f"Attempting to kill process PID={pid}, User={username}, Name={name}, RSS={rss // 1024 // 1024}MB")
-    logger.debug(f"Full command: {cmdline}") # Log full command on debug level
+# --- Process Matching ---
+@functools.lru_cache(maxsize=32)
+def compile_matcher(rules):
+    """Compile a frozenset of avoid/prioritize rules into one matcher, raising ValueError on an invalid rule.
+
+    Plain names match exactly, 'glob:' and 're:' (searched) match the name, 'user:' the owner (name or UID) and 'cmdline:'
+    is a regex searched in the full command line. Patterns of each kind are merged into a single regex, so the cost per
+    process does not grow with the number of rules.
+    """
+    names, users, name_patterns, cmdline_patterns = set(), set(), [], []
+    for rule in rules:
+        kind, sep, pattern = rule.partition(':')
+        if not sep or kind not in MATCH_RULE_KINDS:
+            names.add(rule)
+        elif not pattern:
+            raise ValueError(f"Empty pattern in rule '{rule}'.")
+        elif kind == 'glob':
+            name_patterns.append(r'\A' + fnmatch.translate(pattern))
+        elif kind == 'user':
+            users.add(pattern)
+        else:
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise ValueError(f"Invalid regular expression in rule '{rule}': {e}")
+            (name_patterns if kind == 're' else cmdline_patterns).append(pattern)
+    try:
+        name_regex = re.compile('|'.join(f'(?:{p})' for p in name_patterns)) if name_patterns else None
+        cmdline_regex = re.compile('|'.join(f'(?:{p})' for p in cmdline_patterns)) if cmdline_patterns else None
+    except re.error as e:
+        raise ValueError(f"Cannot combine matching rules (inline flags must be scoped, e.g. '(?i:...)'): {e}")
+    return {'id': next(matcher_ids), 'names': frozenset(names), 'name_regex': name_regex, 'users': frozenset(users),
+            'cmdline_regex': cmdline_regex}
+
+def exact_name_rule(name):
+    """Return a rule matching exactly this process name, even if the name looks like a 'user:', 're:' etc. rule."""
+    kind, sep, _ = name.partition(':')
+    if sep and kind in MATCH_RULE_KINDS:
+        return f"re:\\A{re.escape(name)}\\Z"
+    return name
+
+def match_name(matcher, name):
+    """Check a process or unit name against the name rules of a matcher."""
+    return name in matcher['names'] or (matcher['name_regex'] is not None and matcher['name_regex'].search(name) is not None)
+
+def match_process(matcher, proc):
+    """Check a process table entry against a matcher; the result is memoized in the entry."""
+    matches = proc['matches']
+    matched = matches.get(matcher['id'])
+    if matched is None:
+        matched = match_name(matcher, process_name(proc))
+        if not matched and matcher['users']:
+            if proc['uid'] is None:
+                proc['uid'] = read_proc_uid(proc['pid'])
+            matched = proc['uid'] is not None and (username_for_uid(proc['uid']) in matcher['users'] or str(proc['uid']) in matcher['users'])
+        if not matched and matcher['cmdline_regex'] is not None:
+            matched = matcher['cmdline_regex'].search(' '.join(process_cmdline(proc))) is not None
+        # 匹配器随配置变化，只保留少量结果 / Matchers change with the configuration, so only keep a few results
+        if len(matches) >= 8:
+            matches.clear()
+        matches[matcher['id']] = matched
+    return matched
+
+# --- User Memory Quotas ---
+def parse_memory_size(text):
+    """Parse a size such as '8G', '512MB', '1048576' (bytes) or '25%' (of total RAM) into bytes."""
+    match = re.fullmatch(r'(\d+(?:\.\d*)?|\.\d+)\s*(?:([KMGT])?B?|(%))', text.strip().upper())
+    if match is None:
+        raise ValueError(f"invalid memory size '{text.strip()}', expected a number with an optional K, M, G or T suffix "
+                         f"(optionally followed by B, e.g. 8G or 512MB), plain bytes, or a percentage of RAM such as 25%.")
+    number, unit, percent = match.groups()
+    if percent:
+        size = float(number) / 100 * TOTAL_MEMORY
+    else:
+        size = float(number) * MEMORY_SIZE_UNITS.get(unit, 1)
+    if size <= 0:
+        raise ValueError(f"memory size must be positive, got '{text.strip()}'.")
+    return int(size)
+
+def parse_user_quotas(text):
+    """Parse 'alice:8G, @students:20%, *:25%' into {'users': {...}, 'groups': {...}, 'default': bytes or None, 'text': text}."""
+    quotas = {'users': {}, 'groups': {}, 'default': None, 'text': text.strip()}
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        owner, sep, size = item.rpartition(':')
+        owner = owner.strip()
+        if not sep or not owner:
+            raise ValueError(f"user_quotas entries must look like user:size, @group:size or *:size, got '{item.strip()}'.")
+        quota = parse_memory_size(size)
+        if owner == '*':
+            quotas['default'] = quota
+        elif owner.startswith('@'):
+            quotas['groups'][owner[1:]] = quota
+        else:
+            quotas['users'][owner] = quota
+    return quotas
+
+def user_accounting_enabled():
+    """Per-user RSS is only aggregated when quotas or fair share are configured."""
+    quotas = validated_config.get('user_quotas')
+    return bool(validated_config.get('fair_share') or (quotas and (quotas['users'] or quotas['groups'] or quotas['default'])))
+
+def account_user_memory(proc, rss):
+    """Move a process table entry's contribution to its owner's aggregated RSS from proc['rss'] to `rss`."""
+    uid = proc['accounted_uid']
+    if uid is None:
+        if proc['uid'] is None:
+            proc['uid'] = read_proc_uid(proc['pid'])
+            if proc['uid'] is None:
+                return
+        uid = proc['accounted_uid'] = proc['uid']
+        user_memory[uid] = user_memory.get(uid, 0) + rss
+    else:
+        user_memory[uid] = user_memory.get(uid, 0) + rss - proc['rss']
+
+def forget_user_memory(proc):
+    """Remove a process table entry that is being dropped from its owner's aggregated RSS."""
+    uid = proc['accounted_uid']
+    if uid is not None:
+        user_memory[uid] -= proc['rss']
+
+def reset_user_memory():
+    """Drop the per-user aggregation and quota cache (e.g. after the quota configuration changed); the next scan rebuilds them."""
+    user_memory.clear()
+    uid_quota_cache.clear()
+    for proc in process_table.values():
+        proc['accounted_uid'] = None
+
+def explicit_user_quota(uid):
+    """Return the quota configured for a user by name or UID, else the smallest quota of its groups, else None. Cached per UID."""
+    if uid in uid_quota_cache:
+        return uid_quota_cache[uid]
+    quotas = validated_config['user_quotas']
+    quota = quotas['users'].get(username_for_uid(uid), quotas['users'].get(str(uid)))
+    if quota is None and quotas['groups']:
+        try:
+            entry = pwd.getpwuid(uid)
+            groups = {grp.getgrgid(gid).gr_name for gid in os.getgrouplist(entry.pw_name, entry.pw_gid)}
+        except KeyError:
+            groups = set()
+        group_quotas = [group_quota for group, group_quota in quotas['groups'].items() if group in groups]
+        quota = min(group_quotas) if group_quotas else None
+    uid_quota_cache[uid] = quota
+    return quota
+
+def user_quota_excess():
+    """Return {uid: bytes over quota} for every user whose aggregated RSS exceeds its soft quota.
+
+    Users without an explicit quota fall back to the '*' quota; with fair_share and no '*' quota, regular (non-system)
+    users share the RAM equally among those currently using memory.
+    """
+    fallback = validated_config['user_quotas']['default']
+    fair_share = None
+    if fallback is None and validated_config['fair_share']:
+        active = sum(1 for uid, used in user_memory.items() if uid > SYSTEM_UID_MAX and used > 0)
+        fair_share = TOTAL_MEMORY // active if active else None
+    excess = {}
+    for uid, used in user_memory.items():
+        quota = explicit_user_quota(uid)
+        if quota is None:
+            quota = fallback if fallback is not None or uid <= SYSTEM_UID_MAX else fair_share
+        if quota is not None and used > quota:
+            excess[uid] = used - quota
+    metric_set('oomkiller_users_over_quota', len(excess))
+    return excess
+
+# --- Victim Scoring ---
+# 评分公式，输入为 smaps_rollup 字段 (字节) 加上 'rss' / Score formulas over smaps_rollup fields (bytes) plus 'rss'
+SCORE_FORMULAS = {
+    # 常驻内存 (detailed 统计时加上 VmSwap)，共享页会被重复计算 / Resident memory (plus VmSwap under detailed accounting), shared pages are counted in full
+    'rss': lambda mem: mem['rss'],
+    # 按比例分摊的共享页，加上按比例分摊的 swap / Proportional share of shared pages plus proportional swap
+    'pss': lambda mem: mem['Pss'] + mem.get('SwapPss', 0),
+    # 仅私有页，即杀死后立即释放的内存 / Private pages only, i.e. what the kill frees right away
+    'uss': lambda mem: mem['Private_Clean'] + mem['Private_Dirty'],
+    # 私有页加上私有 swap / Private pages plus the swap they occupy
+    'reclaimable': lambda mem: mem['Private_Clean'] + mem['Private_Dirty'] + mem.get('SwapPss', 0),
+}
+
+def read_smaps_rollup(pid):
+    """Parse /proc/<pid>/smaps_rollup into a dict of byte counts. Returns None if unavailable (kernel < 4.14, permissions, exited)."""
+    try:
+        with open(f'{PROC_ROOT}/{pid}/smaps_rollup', 'rb') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    values = {}
+    for line in lines[1:]: # 第一行为地址范围 / The first line is the address range
+        parts = line.split()
+        if len(parts) >= 2 and parts[0].endswith(b':'):
+            values[parts[0][:-1].decode()] = int(parts[1]) * 1024
+    return values
+
+def read_oom_score_adj(pid):
+    """Return /proc/<pid>/oom_score_adj, or 0 if it cannot be read."""
+    try:
+        with open(f'{PROC_ROOT}/{pid}/oom_score_adj', 'rb') as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return 0
+
+def score_process(pid, rss):
+    """Score a candidate with the configured formula, higher is killed first.
+
+    Returns (score, freeable_bytes); score is None for processes that must never be killed.
+    """
+    formula = validated_config.get('score_formula', 'rss')
+    mem = {'rss': rss}
+    if formula != 'rss':
+        rollup = read_smaps_rollup(pid)
+        if rollup is None or 'Pss' not in rollup:
+            formula = 'rss' # 无法读取时回退到 RSS / Fall back to RSS when smaps_rollup is unavailable
+        else:
+            mem.update(rollup)
+    freeable = score = SCORE_FORMULAS[formula](mem)
+    if validated_config.get('score_oom_score_adj', False):
+        adj = read_oom_score_adj(pid)
+        # 与内核一致: -1000 表示禁止杀死，其余按总内存的千分比调整 / Like the kernel: -1000 disables killing, otherwise adjust by adj/1000 of RAM
+        if adj <= -1000:
+            return None, freeable
+        score += adj * TOTAL_MEMORY // 1000
+    return score, freeable
+
+# --- Kill Scheduling ---
+def estimate_memory_deficit(available_memory_percentage, available_swap_percentage, swap_total=None):
+    """Estimate how many bytes must be freed to get memory and swap back above their configured thresholds (swap_total defaults to this host's)."""
+    memory_deficit = (validated_config['min_available_memory_percentage'] - available_memory_percentage) / 100 * TOTAL_MEMORY
+    swap_deficit = 0
+    if available_swap_percentage < validated_config['min_available_swap_percentage']:
+        if swap_total is None:
+            swap_total = psutil.swap_memory().total
+        swap_deficit = (validated_config['min_available_swap_percentage'] - available_swap_percentage) / 100 * swap_total
+    return int(max(memory_deficit, 0) + max(swap_deficit, 0))
+
+def select_victims(hogs, deficit):
+    """Take candidates in order until their freeable memory covers the deficit, capped at max_batch_kills (at least one)."""
+    victims = []
+    freed = 0
+    for hog in hogs[:validated_config.get('max_batch_kills', 1)]:
+        victims.append(hog)
+        freed += hog.get('freeable', hog['rss'])
+        if freed >= deficit:
+            break
+    return victims
+
+def open_pidfd(pid):
+    """Open a pidfd to wait for a process exit (Linux 5.3+, Python 3.9+). Returns None when unsupported."""
+    if not hasattr(os, 'pidfd_open'):
+        return None
+    try:
+        return os.pidfd_open(pid)
+    except OSError:
+        return None
 
+def process_exited(proc):
+    """Check whether a psutil.Process has exited (zombies count as exited, their memory is already released)."""
+    try:
+        return not proc.is_running() or proc.status() == psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return True
+
+def pidfd_exited(inflight, exited, changed, pid):
+    """Event loop callback: the pidfd of victim `pid` became readable, i.e. the process exited."""
+    victim = inflight.pop(pid, None)
+    if victim is not None:
+        event_loop.remove_reader(victim['pidfd'])
+        victim['exit_seconds'] = time.monotonic() - victim['signal_time']
+        exited.append(victim)
+    changed.set()
+
+async def wait_for_exits(inflight, deadline):
+    """Wait concurrently for the victims in `inflight` (pid -> victim) until all exited or `deadline` passed.
+
+    Exited victims are removed from `inflight` and returned. The event loop watches the victims' pidfds, the rest are checked every 50ms.
+    """
+    exited = []
+    changed = asyncio.Event()
+    watched = []
+    for pid, victim in inflight.items():
+        if victim['pidfd'] is not None:
+            event_loop.add_reader(victim['pidfd'], pidfd_exited, inflight, exited, changed, pid)
+            watched.append(victim['pidfd'])
+    try:
+        while inflight:
+            now = time.monotonic()
+            for pid in [pid for pid, victim in inflight.items() if victim['pidfd'] is None and process_exited(victim['proc'])]:
+                victim = inflight.pop(pid)
+                victim['exit_seconds'] = now - victim['signal_time']
+                exited.append(victim)
+            if not inflight or now >= deadline:
+                break
+            timeout = deadline - now
+            if any(victim['pidfd'] is None for victim in inflight.values()):
+                timeout = min(timeout, 0.05)
+            changed.clear()
+            try:
+                await asyncio.wait_for(changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        for pidfd in watched:
+            event_loop.remove_reader(pidfd)
+    return exited
+
+def notify_kill_result(victim, outcome):
+    """Send the user notification for a kill attempt; outcome is 'terminated', 'killed' or 'failed'."""
     hostname = os.uname().nodename # Get hostname for notification message
+    pid, name, cmdline, rss_mb = victim['pid'], victim['name'], victim['cmdline'], victim['rss'] // 1024 // 1024
+    if outcome == 'terminated':
+        message = (f"您在服务器 '{hostname}' 上运行的进程 (PID: {pid}, 名称: {name}) "
+                   f"因占用过多内存 (RSS: {rss_mb}MB) 已被 OOM Killer 成功终止。\n"
+                   f"命令: {cmdline}")
+    elif outcome == 'killed':
+        message = (f"您在服务器 '{hostname}' 上运行的进程 (PID: {pid}, 名称: {name}) "
+                   f"因占用过多内存 (RSS: {rss_mb}MB) 且未响应 SIGTERM，已被 OOM Killer 强制终止 (SIGKILL)。\n"
+                   f"命令: {cmdline}")
+    else:
+        message = (f"您在服务器 '{hostname}' 上运行的进程 (PID: {pid}, 名称: {name}) "
+                   f"因占用过多内存 (RSS: {rss_mb}MB) 触发了 OOM Killer，但未能自动终止。\n"
+                   f"请您手动检查并处理该进程。\n"
+                   f"命令: {cmdline}")
+    send_notification_to_user(victim['username'], name, pid, cmdline, message)
+
+async def kill_processes(victims):
+    """Send SIGTERM to all victims at once, wait for them concurrently with a shared grace deadline, then SIGKILL each straggler.
+
+    Victims are dicts as returned by get_memory_hogs(); each one is updated in place with 'outcome' ('terminated', 'killed',
+    'exited' or 'failed'), 'signal' and, once signalled, 'signal_time' and 'exit_seconds'. Returns the victims that could not be killed.
+    """
+    failed = []
+    inflight = {}
+    pidfds = []
+    for victim in victims:
+        pid, name, username = victim['pid'], victim['name'], victim['username']
+        swap_note = f", Swap={victim['swap'] // 1024 // 1024}MB" if victim.get('swap') else ''
+        logger.warning(f"Attempting to kill process PID={pid}, User={username}, Name={name}, RSS={victim['rss'] // 1024 // 1024}MB{swap_note}",
+                       extra=event_fields('kill', victim, swap=victim.get('swap', 0)))
+        logger.debug(f"Full command: {victim['cmdline']}") # Log full command on debug level
+        pidfd = None
+        try:
+            proc = psutil.Process(pid)
+            # Verify the username matches before killing, as an extra precaution
+            if proc.username() != username:
+                logger.error(f"Username mismatch for PID={pid}. Expected '{username}', found '{proc.username()}'. Aborting kill.")
+                victim['outcome'] = 'failed'
+                failed.append(victim)
+                continue
+            pidfd = open_pidfd(pid)
+            victim['signal_time'] = time.monotonic()
+            proc.terminate()  # Send SIGTERM
+            if frozen_processes.pop(pid, None) is not None:
+                proc.resume() # 被冻结的进程收到 SIGCONT 后才会处理 SIGTERM / A frozen process only handles SIGTERM once continued
+            victim.update(proc=proc, pidfd=pidfd, signal='SIGTERM')
+            inflight[pid] = victim
+        except psutil.NoSuchProcess:
+            logger.info(f"Process already exited: PID={pid}, User={username}, Name={name}", extra=event_fields('exited', victim))
+            victim['outcome'] = 'exited' # Already exited, counts as success for our purpose
+        except (psutil.AccessDenied, psutil.ZombieProcess) as e:
+            logger.error(f"Error killing process PID={pid}, User={username}, Name={name}: {e}. Check permissions.", extra=event_fields('kill_failed', victim))
+            victim['outcome'] = 'failed'
+            failed.append(victim)
+        except Exception as e:
+            logger.error(f"Unexpected error killing process PID={pid}, User={username}, Name={name}: {e}", extra=event_fields('kill_failed', victim))
+            victim['outcome'] = 'failed'
+            failed.append(victim)
+        if pidfd is not None:
+            pidfds.append(pidfd)
+
+    try:
+        wait_seconds = validated_config.get('kill_wait_seconds', DEFAULT_KILL_WAIT_SECONDS)
+        if inflight:
+            logger.info(f"Sent SIGTERM to {len(inflight)} process(es): PIDs={list(inflight)}. Waiting up to {wait_seconds} seconds...",
+                        extra=event_fields('sigterm', pids=list(inflight)))
+        for victim in await wait_for_exits(inflight, time.monotonic() + wait_seconds):
+            logger.info(f"Process terminated gracefully: PID={victim['pid']}, User={victim['username']}, Name={victim['name']} after {victim['exit_seconds']:.2f}s",
+                        extra=event_fields('terminated', victim, latency=round(victim['exit_seconds'], 3)))
+            victim['outcome'] = 'terminated'
+            notify_kill_result(victim, 'terminated')
+
+        # 宽限期结束后逐个升级为 SIGKILL / Escalate each straggler to SIGKILL once the shared grace period is over
+        for pid, victim in list(inflight.items()):
+            logger.warning(f"Process did not terminate after SIGTERM. Sending SIGKILL: PID={pid}, User={victim['username']}, Name={victim['name']}...",
+                           extra=event_fields('sigkill', victim))
+            try:
+                victim['proc'].kill()  # Send SIGKILL
+                victim['signal'] = 'SIGKILL'
+            except psutil.NoSuchProcess:
+                pass # 刚好退出，下面的等待会立即返回 / Exited just now, the wait below returns immediately
+            except Exception as e:
+                logger.error(f"Error sending SIGKILL to PID={pid}, User={victim['username']}, Name={victim['name']}: {e}")
+
+        for victim in await wait_for_exits(inflight, time.monotonic() + 5): # Give SIGKILL a moment
+            victim['outcome'] = 'killed' if victim['signal'] == 'SIGKILL' else 'terminated'
+            logger.info(f"Process killed with {victim['signal']}: PID={victim['pid']}, User={victim['username']}, Name={victim['name']}",
+                        extra=event_fields(victim['outcome'], victim, latency=round(victim['exit_seconds'], 3)))
+            notify_kill_result(victim, victim['outcome'])
+
+        for pid, victim in inflight.items():
+            logger.error(f"Failed to kill process PID={pid}, User={victim['username']}, Name={victim['name']} even with SIGKILL.",
+                         extra=event_fields('kill_failed', victim))
+            victim['outcome'] = 'failed'
+            notify_kill_result(victim, 'failed')
+            failed.append(victim)
+    finally:
+        for pidfd in pidfds:
+            os.close(pidfd)
+        for victim in victims:
+            victim.pop('proc', None)
+            victim.pop('pidfd', None)
+            record_kill_metrics(victim)
+        journal_kills(victims)
+    return failed
+
+async def kill_process(pid, name, cmdline, rss, username):
+    """Attempt to kill a process gracefully (SIGTERM) then forcefully (SIGKILL), and notify user."""
+    return not await kill_processes([{'pid': pid, 'name': name, 'cmdline': cmdline, 'rss': rss, 'username': username}])
 
+# --- Cgroup v2 ---
+def read_cgroup_file(path, name):
+    """Read a cgroup interface file, returning None if it does not exist (or the cgroup was removed)."""
+    try:
+        with open(os.path.join(path, name)) as f:
+            return f.read()
+    except OSError:
+        return None
+
+def read_cgroup_keyed(path, name):
+    """Parse a flat-keyed cgroup file such as memory.stat or memory.events into a dict of ints."""
+    data = read_cgroup_file(path, name)
+    values = {}
+    for line in (data or '').splitlines():
+        key, _, value = line.partition(' ')
+        try:
+            values[key] = int(value)
+        except ValueError:
+            continue
+    return values
+
+def read_cgroup_procs(path):
+    """Return the PIDs directly attached to a cgroup."""
+    data = read_cgroup_file(path, 'cgroup.procs')
+    return [int(pid) for pid in (data or '').split()]
+
+def own_cgroup_path():
+    """Return the cgroup v2 directory the daemon itself runs in, so it never selects its own group."""
+    try:
+        with open('/proc/self/cgroup') as f:
+            for line in f:
+                if line.startswith('0::'):
+                    return os.path.join(validated_config['cgroup_root'], line[3:].strip().lstrip('/'))
+    except OSError:
+        pass
+    return None
+
+def cgroup_matches(rel_path, members, matcher):
+    """Check whether a cgroup matches by unit name (such as 'sshd.service' or 'sshd') or through any of its member processes."""
+    unit = os.path.basename(rel_path)
+    return (match_name(matcher, unit) or match_name(matcher, unit.rsplit('.', 1)[0])
+            or any(match_process(matcher, proc) for proc in members))
+
+def get_cgroup_hogs(avoid_cgroups, avoid_names, prioritize_names):
+    """Find cgroups that hold processes, sorted by reclaimable memory (anon + swap), honoring avoid/prioritize names at group level."""
+    root = validated_config['cgroup_root']
+    if not os.path.exists(os.path.join(root, 'cgroup.controllers')):
+        logger.debug(f"{root} is not a cgroup v2 hierarchy, cgroup victim selection unavailable.")
+        return []
     try:
-        proc = psutil.Process(pid)
-        # Verify the username matches before killing, as an extra precaution
-        if proc.username() != username:
-             logger.error(f"Username mismatch for PID={pid}. Expected '{username}', found '{proc.username()}'. Aborting kill.")
-             return False
+        avoid = compile_matcher(frozenset(avoid_names))
+        prioritize = compile_matcher(frozenset(prioritize_names))
+        skip_paths = set(avoid_cgroups)
+        skip_paths.add(own_cgroup_path())
+        refresh_process_table()
+
+        groups = []
+        for path, _, files in os.walk(root):
+            # 根 cgroup 和没有内存控制器的组不参与 / Skip the root cgroup and groups without the memory controller
+            if path == root or path in skip_paths or 'memory.current' not in files:
+                continue
+            pids = read_cgroup_procs(path)
+            if not pids:
+                continue
+            rel_path = os.path.relpath(path, root)
+            members = [process_table[pid] for pid in pids if pid in process_table]
+            if cgroup_matches(rel_path, members, avoid):
+                continue
+            stat = read_cgroup_keyed(path, 'memory.stat')
+            current = int(read_cgroup_file(path, 'memory.current') or 0)
+            swap = int(read_cgroup_file(path, 'memory.swap.current') or 0)
+            # 文件缓存杀掉进程后也不会释放，只统计匿名内存 / Page cache survives the kill, so rank by anonymous memory
+            reclaimable = stat.get('anon', current) + swap
+            if reclaimable <= 0:
+                continue
+            # 以占用最大的进程作为组的代表 / The largest member represents the group (for username and notifications)
+            leader = max(pids, key=lambda pid: process_table[pid]['rss'] if pid in process_table else 0)
+            uid = read_proc_uid(leader)
+            groups.append({
+                'path': path,
+                'name': rel_path,
+                'memory': current,
+                'reclaimable': reclaimable,
+                'pids': pids,
+                'leader': leader,
+                'events': read_cgroup_keyed(path, 'memory.events'),
+                'prioritized': cgroup_matches(rel_path, members, prioritize),
+                'username': username_for_uid(uid) if uid is not None else 'N/A'
+            })
+
+        groups.sort(key=lambda x: (not x['prioritized'], -x['reclaimable']))
+        return groups
+    except Exception as e:
+        logger.error(f"Error getting cgroup memory hogs: {e}")
+        return []
+
+async def wait_cgroup_empty(path, timeout):
+    """Wait until a cgroup has no processes left (or was removed). Returns True if it emptied in time."""
+    deadline = time.monotonic() + timeout
+    while True:
+        events = read_cgroup_keyed(path, 'cgroup.events')
+        if not events or events.get('populated') == 0:
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(0.1)
 
-        proc.terminate()  # Send SIGTERM
+def signal_cgroup(path, sig):
+    """Send a signal to every process in a cgroup, ignoring processes that already exited."""
+    for pid in read_cgroup_procs(path):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            continue
+
+def record_cgroup_kill(group, signal_name, outcome):
+    """Count a cgroup kill in the metrics and append it to the kill history journal."""
+    metric_inc('oomkiller_kills_total', signal=signal_name, outcome=outcome)
+    if outcome != 'failed':
+        metric_observe('oomkiller_kill_reclaimed_bytes', group['reclaimable'])
+    journal_kills([{'pid': group['leader'], 'username': group['username'], 'name': group['name'], 'cmdline': group['name'],
+                    'rss': group['memory'], 'freeable': group['reclaimable'], 'signal': signal_name, 'outcome': outcome}], kind='cgroup')
+
+async def kill_cgroup(group):
+    """Terminate a whole cgroup: SIGTERM to every member, then cgroup.kill after kill_wait_seconds, and notify the user."""
+    path, name, username = group['path'], group['name'], group['username']
+    memory_mb = group['memory'] // 1024 // 1024
+    # 日志事件字段中以主进程代表整个组 / The leader stands for the whole group in the log event fields
+    leader = {'pid': group['leader'], 'username': username, 'name': name, 'rss': group['memory'], 'score': group['reclaimable']}
+    logger.warning(f"Attempting to kill cgroup {name}, User={username}, Processes={len(group['pids'])}, Memory={memory_mb}MB, "
+                   f"Reclaimable={group['reclaimable'] // 1024 // 1024}MB, Events={group['events']}",
+                   extra=event_fields('kill', leader, kind='cgroup', processes=len(group['pids'])))
+
+    hostname = os.uname().nodename
+    try:
+        signal_time = time.monotonic()
+        signal_cgroup(path, signal.SIGTERM)
+        if path in frozen_cgroups:
+            set_cgroup_frozen(path, False) # 解冻后成员才会处理 SIGTERM / Members only handle SIGTERM once thawed
         wait_seconds = validated_config.get('kill_wait_seconds', DEFAULT_KILL_WAIT_SECONDS)
-        logger.info(f"Sent SIGTERM to PID={pid}, User={username}, Name={name}. Waiting {wait_seconds} seconds...")
+        logger.info(f"Sent SIGTERM to cgroup {name}. Waiting {wait_seconds} seconds...")
+        if await wait_cgroup_empty(path, wait_seconds):
+            logger.info(f"Cgroup terminated gracefully: {name}, User={username}",
+                        extra=event_fields('terminated', leader, kind='cgroup', latency=round(time.monotonic() - signal_time, 3)))
+            record_cgroup_kill(group, 'SIGTERM', 'terminated')
+            message = (f"您在服务器 '{hostname}' 上运行的任务组 ({name}) "
+                       f"因占用过多内存 ({memory_mb}MB) 已被 OOM Killer 成功终止。")
+            send_notification_to_user(username, name, group['leader'], name, message)
+            return True
+
+        logger.warning(f"Cgroup did not empty after SIGTERM. Killing: {name}, User={username}...", extra=event_fields('sigkill', leader, kind='cgroup'))
         try:
-            proc.wait(timeout=wait_seconds)
-            logger.info(f"Process terminated gracefully: PID={pid}, User={username}, Name={name}")
-            # Send success notification
-            message = (f"您在服务器 '{hostname}' 上运行的进程 (PID: {pid}, 名称: {name}) "
-                       f"因占用过多内存 (RSS: {rss // 1024 // 1024}MB) 已被 OOM Killer 成功终止。\n"
-                       f"命令: {cmdline}")
-            send_notification_to_user(username, name, pid, cmdline, message)
+            # cgroup.kill 需要 5.14 以上内核 / cgroup.kill requires Linux 5.14+
+            with open(os.path.join(path, 'cgroup.kill'), 'w') as f:
+                f.write('1')
+        except FileNotFoundError:
+            signal_cgroup(path, signal.SIGKILL)
+
+        if await wait_cgroup_empty(path, 5):
+            logger.info(f"Cgroup killed with SIGKILL: {name}, User={username}",
+                        extra=event_fields('killed', leader, kind='cgroup', latency=round(time.monotonic() - signal_time, 3)))
+            record_cgroup_kill(group, 'SIGKILL', 'killed')
+            message = (f"您在服务器 '{hostname}' 上运行的任务组 ({name}) "
+                       f"因占用过多内存 ({memory_mb}MB) 且未响应 SIGTERM，已被 OOM Killer 强制终止 (SIGKILL)。")
+            send_notification_to_user(username, name, group['leader'], name, message)
             return True
-        except psutil.TimeoutExpired:
-            logger.warning(f"Process did not terminate after SIGTERM. Sending SIGKILL: PID={pid}, User={username}, Name={name}...")
-            proc.kill()  # Send SIGKILL
-            try:
-                proc.wait(timeout=5) # Give SIGKILL a moment
-            except Exception:
-                pass # Ignore errors waiting after SIGKILL, just check pid_exists
-
-            if psutil.pid_exists(pid):
-                logger.error(f"Failed to kill process PID={pid}, User={username}, Name={name} even with SIGKILL.")
-                # Send failure notification
-                message = (f"您在服务器 '{hostname}' 上运行的进程 (PID: {pid}, 名称: {name}) "
-                           f"因占用过多内存 (RSS: {rss // 1024 // 1024}MB) 触发了 OOM Killer，但未能自动终止。\n"
-                           f"请您手动检查并处理该进程。\n"
-                           f"命令: {cmdline}")
-                send_notification_to_user(username, name, pid, cmdline, message)
-                return False
-            else:
-                logger.info(f"Process killed with SIGKILL: PID={pid}, User={username}, Name={name}")
-                 # Send success notification (killed with SIGKILL)
-                message = (f"您在服务器 '{hostname}' 上运行的进程 (PID: {pid}, 名称: {name}) "
-                           f"因占用过多内存 (RSS: {rss // 1024 // 1024}MB) 且未响应 SIGTERM，已被 OOM Killer 强制终止 (SIGKILL)。\n"
-                           f"命令: {cmdline}")
-                send_notification_to_user(username, name, pid, cmdline, message)
-                return True
 
-    except psutil.NoSuchProcess:
-        logger.info(f"Process already exited: PID={pid}, User={username}, Name={name}")
-        return True # Already exited, counts as success for our purpose
+        logger.error(f"Failed to kill cgroup {name}, User={username} even with SIGKILL.", extra=event_fields('kill_failed', leader, kind='cgroup'))
+        record_cgroup_kill(group, 'SIGKILL', 'failed')
+        message = (f"您在服务器 '{hostname}' 上运行的任务组 ({name}) "
+                   f"因占用过多内存 ({memory_mb}MB) 触发了 OOM Killer，但未能自动终止。\n"
+                   f"请您手动检查并处理。")
+        send_notification_to_user(username, name, group['leader'], name, message)
+        return False
 
-    except (psutil.AccessDenied, psutil.ZombieProcess) as e:
-        logger.error(f"Error killing process PID={pid}, User={username}, Name={name}: {e}. Check permissions.")
+    except PermissionError as e:
+        logger.error(f"Error killing cgroup {name}, User={username}: {e}. Check permissions.")
         return False
 
+    except asyncio.CancelledError:
+        raise
+
     except Exception as e:
-        logger.error(f"Unexpected error killing process PID={pid}, User={username}, Name={name}: {e}")
+        logger.error(f"Unexpected error killing cgroup {name}, User={username}: {e}")
+        return False
+
+# --- Freeze Then Decide ---
+def freeze_processes(victims):
+    """Stop victims with SIGSTOP so they cannot allocate any more while pressure is reassessed. Returns the victims frozen."""
+    frozen = []
+    for victim in victims:
+        pid, username = victim['pid'], victim['username']
+        try:
+            proc = psutil.Process(pid)
+            if proc.username() != username:
+                logger.error(f"Username mismatch for PID={pid}. Expected '{username}', found '{proc.username()}'. Not freezing.")
+                continue
+            proc.suspend()  # Send SIGSTOP
+            frozen_processes[pid] = proc
+            frozen.append(victim)
+        except psutil.NoSuchProcess:
+            continue
+        except (psutil.AccessDenied, psutil.ZombieProcess) as e:
+            logger.error(f"Error freezing process PID={pid}, User={username}, Name={victim['name']}: {e}. Check permissions.")
+    return frozen
+
+def thaw_processes(pids):
+    """Resume processes frozen by freeze_processes(); psutil refuses to signal a PID that was reused meanwhile."""
+    for pid in pids:
+        proc = frozen_processes.pop(pid, None)
+        if proc is None:
+            continue
+        try:
+            proc.resume()  # Send SIGCONT
+        except psutil.NoSuchProcess:
+            continue
+        except Exception as e:
+            logger.error(f"Error thawing process PID={pid}: {e}")
+
+def set_cgroup_frozen(path, frozen):
+    """Freeze or thaw a cgroup through cgroup.freeze (Linux 5.2+). Returns False if the state could not be written."""
+    if not frozen:
+        frozen_cgroups.discard(path)
+    try:
+        with open(os.path.join(path, 'cgroup.freeze'), 'w') as f:
+            f.write('1' if frozen else '0')
+    except FileNotFoundError:
+        return False # 旧内核或组已被删除 / Older kernel, or the group was removed
+    except OSError as e:
+        logger.error(f"Error {'freezing' if frozen else 'thawing'} cgroup {path}: {e}")
+        return False
+    if frozen:
+        frozen_cgroups.add(path)
+    return True
+
+def thaw_all():
+    """Thaw every process and cgroup still frozen by the daemon, so nothing is left stopped after an incident, error or exit."""
+    if frozen_processes or frozen_cgroups:
+        logger.info(f"Thawing {len(frozen_processes)} process(es) and {len(frozen_cgroups)} cgroup(s) left frozen.")
+    thaw_processes(list(frozen_processes))
+    for path in list(frozen_cgroups):
+        set_cgroup_frozen(path, False)
+
+async def wait_for_relief(timeout):
+    """Re-check memory and swap every FREEZE_POLL_SECONDS until both are fine or `timeout` passed; returns the last check."""
+    deadline = time.monotonic() + timeout
+    # 颠簸速率只看冻结之后的样本 / Only samples taken while frozen count towards the thrashing rates
+    reset_thrash_window(thrashing)
+    while True:
+        result = check_memory_swap_usage()
+        remaining = deadline - time.monotonic()
+        if (result[0] and result[1]) or remaining <= 0:
+            return result
+        await asyncio.sleep(min(FREEZE_POLL_SECONDS, remaining))
+
+async def freeze_then_decide(victims):
+    """Freeze victims, then thaw them all if pressure clears within freeze_seconds, or return the ones that must be killed.
+
+    Victims stay in priority order; only as many as the remaining deficit needs are returned, the rest are thawed right away.
+    Victims that could not be frozen are still returned, killing them is up to kill_processes().
+    """
+    started = time.monotonic()
+    frozen = freeze_processes(victims)
+    logger.info(f"Froze {len(frozen)} process(es) in {(time.monotonic() - started) * 1000:.1f}ms: PIDs={[victim['pid'] for victim in frozen]}. "
+                f"Reassessing memory pressure for up to {validated_config['freeze_seconds']:g} seconds...",
+                extra=event_fields('freeze', pids=[victim['pid'] for victim in frozen]))
+    memory_ok, swap_ok, available_memory_percentage, available_swap_percentage = await wait_for_relief(validated_config['freeze_seconds'])
+    if memory_ok and swap_ok:
+        logger.info(f"Memory pressure cleared after {time.monotonic() - started:.2f}s frozen, thawing PIDs={[victim['pid'] for victim in frozen]} without killing.",
+                    extra=event_fields('thaw', pids=[victim['pid'] for victim in frozen], latency=round(time.monotonic() - started, 3)))
+        thaw_processes([victim['pid'] for victim in frozen])
+        metric_inc('oomkiller_freezes_total', len(frozen), outcome='thawed')
+        return []
+
+    deficit = estimate_memory_deficit(available_memory_percentage, available_swap_percentage)
+    remaining = select_victims(victims, deficit)
+    spared = [victim['pid'] for victim in victims[len(remaining):] if victim['pid'] in frozen_processes]
+    if spared:
+        logger.info(f"Still need to free about {deficit // 1024 // 1024}MB, killing {len(remaining)} victim(s) and thawing PIDs={spared}.")
+        thaw_processes(spared)
+        metric_inc('oomkiller_freezes_total', len(spared), outcome='thawed')
+    metric_inc('oomkiller_freezes_total', len(frozen) - len(spared), outcome='killed')
+    return remaining
+
+async def freeze_then_decide_cgroup(group):
+    """Freeze a cgroup, then thaw it if pressure clears within freeze_seconds. Returns True if the group must still be killed."""
+    if not set_cgroup_frozen(group['path'], True):
+        logger.warning(f"Could not freeze cgroup {group['name']} (cgroup.freeze needs Linux 5.2+), killing it directly.")
+        return True
+    logger.info(f"Froze cgroup {group['name']}, User={group['username']}. Reassessing memory pressure for up to {validated_config['freeze_seconds']:g} seconds...")
+    memory_ok, swap_ok, _, _ = await wait_for_relief(validated_config['freeze_seconds'])
+    if memory_ok and swap_ok:
+        logger.info(f"Memory pressure cleared, thawing cgroup {group['name']} without killing.")
+        set_cgroup_frozen(group['path'], False)
+        metric_inc('oomkiller_freezes_total', outcome='thawed')
         return False
+    metric_inc('oomkiller_freezes_total', outcome='killed')
+    return True
+
+# --- Kill History Journal ---
+def open_history():
+    """Start the journal worker for history_path, replacing a running one.
+
+    The worker thread owns the SQLite connection, so journal writes and the repeat offender refresh never run on the
+    event loop. The daemon keeps working without a journal if it cannot be opened.
+    """
+    global history_queue, history_thread
+    close_history()
+    path = validated_config['history_path']
+    if not path:
+        return
+    history_queue = queue.Queue(maxsize=HISTORY_QUEUE_SIZE)
+    history_thread = threading.Thread(target=history_worker, args=(path,), name='oomkiller-history', daemon=True)
+    history_thread.start()
+
+def close_history(timeout=10):
+    """Ask the journal worker to write what is queued, wait up to `timeout` seconds for it and close the journal."""
+    global history_queue, history_thread, repeat_offenders
+    if history_thread is not None:
+        try:
+            history_queue.put(None, timeout=timeout) # 结束标记 / Sentinel
+        except queue.Full:
+            logger.warning("Kill history queue is full, pending records may be lost.")
+        history_thread.join(timeout)
+        if history_thread.is_alive():
+            logger.warning(f"Kill history worker did not finish within {timeout} seconds, pending records may be lost.")
+    history_queue = history_thread = None
+    repeat_offenders = {}
+
+def history_submit(job, *args):
+    """Queue job(*args) for the journal worker without blocking; dropped when the journal is disabled or unavailable."""
+    if history_thread is None or not history_thread.is_alive():
+        return
+    try:
+        history_queue.put_nowait((job, args))
+    except queue.Full:
+        logger.error(f"Kill history queue is full ({history_queue.maxsize}), dropping a journal record.")
+
+def history_worker(path):
+    """Background loop: open the journal, then run queued writes in order until the sentinel."""
+    global history_db
+    try:
+        import sqlite3 # 仅在启用历史记录时需要 / Only needed when the journal is enabled
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        db = sqlite3.connect(path)
+        # WAL 模式下追加写入无需每次 fsync / In WAL mode appends do not fsync on every commit
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        with db:
+            for statement in HISTORY_SCHEMA:
+                db.execute(statement)
+    except Exception as e:
+        logger.warning(f"Cannot open kill history journal {path}: {e}. Kill history will not be recorded.")
+        return
+    history_db = db
+    try:
+        prune_history()
+        refresh_repeat_offenders()
+        while True:
+            item = history_queue.get()
+            if item is None:
+                break
+            job, args = item
+            job(*args)
+    finally:
+        history_db = None
+        db.close()
+
+def prune_history():
+    """Drop journal records older than history_retention_days."""
+    cutoff = time.time() - validated_config['history_retention_days'] * 86400
+    try:
+        with history_db:
+            history_db.execute("DELETE FROM kills WHERE time < ?", (cutoff,))
+            history_db.execute("DELETE FROM incidents WHERE started < ?", (cutoff,))
+    except Exception as e:
+        logger.error(f"Failed to prune kill history: {e}")
+
+def cmdline_hash(cmdline):
+    """Short stable hash of a command line, so the journal can group identical commands without storing arguments."""
+    import hashlib # 仅杀死记录需要 / Only needed to journal kills
+    return hashlib.blake2b(cmdline.encode('utf-8', 'replace'), digest_size=8).hexdigest()
+
+def journal_kills(victims, kind='process'):
+    """Append handled victims (with 'outcome' set by kill_processes()) to the journal and refresh the repeat offenders."""
+    if current_incident is not None:
+        current_incident['kills'] += sum(1 for victim in victims if victim.get('outcome') in ('terminated', 'killed'))
+    now = time.time()
+    rows = [(now, current_incident['started'] if current_incident else None, kind, victim['pid'], victim['username'], victim['name'],
+             cmdline_hash(victim['cmdline']), victim['rss'], victim.get('signal'), victim['outcome'], victim.get('exit_seconds'),
+             victim.get('freeable', victim['rss']) if victim['outcome'] in ('terminated', 'killed') else 0)
+            for victim in victims if victim.get('outcome')]
+    for row in rows:
+        fleet_send('kill', dict(zip(KILL_FIELDS, row)))
+    if rows:
+        history_submit(write_kill_history, rows)
+
+def write_kill_history(rows):
+    """Insert kill rows and refresh the repeat offenders; runs on the journal worker."""
+    try:
+        with history_db:
+            history_db.executemany("INSERT INTO kills VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    except Exception as e:
+        logger.error(f"Failed to write kill history: {e}")
+        return
+    refresh_repeat_offenders()
+
+def begin_incident():
+    """Start a new incident; kills journaled until end_incident() are grouped under it."""
+    global current_incident
+    current_incident = {'started': time.time(), 'available_before': memory_samples[-1][1] if memory_samples else None, 'kills': 0}
+
+def end_incident():
+    """Journal the finished incident with the available memory before and after it."""
+    global current_incident
+    incident, current_incident = current_incident, None
+    if incident is None:
+        return
+    row = (incident['started'], time.time(), incident['available_before'], memory_samples[-1][1] if memory_samples else None, incident['kills'])
+    fleet_send('incident', dict(zip(INCIDENT_FIELDS, row)))
+    history_submit(write_incident_history, row)
+
+def write_incident_history(row):
+    """Insert an incident row and prune expired records; runs on the journal worker."""
+    try:
+        with history_db:
+            history_db.execute("INSERT OR REPLACE INTO incidents VALUES (?, ?, ?, ?, ?)", row)
+    except Exception as e:
+        logger.error(f"Failed to write incident history: {e}")
+    prune_history()
+
+def refresh_repeat_offenders():
+    """Load the (name, user) pairs killed at least repeat_offender_kills times within repeat_offender_window_hours.
+
+    Runs on the journal worker; the new mapping replaces repeat_offenders in one assignment.
+    """
+    global repeat_offenders
+    offenders = {}
+    if history_db is not None and validated_config.get('prioritize_repeat_offenders'):
+        cutoff = time.time() - validated_config['repeat_offender_window_hours'] * 3600
+        try:
+            rows = history_db.execute("SELECT name, user FROM kills WHERE kind = 'process' AND outcome IN ('terminated', 'killed') "
+                                      "AND time >= ? GROUP BY name, user HAVING COUNT(*) >= ?",
+                                      (cutoff, validated_config['repeat_offender_kills'])).fetchall()
+        except Exception as e:
+            logger.error(f"Failed to read repeat offenders from kill history: {e}")
+            rows = []
+        for name, user in rows:
+            offenders.setdefault(name, set()).add(user)
+    repeat_offenders = offenders
+
+def is_repeat_offender(proc):
+    """Check whether a process table entry matches a known repeat offender by name and user."""
+    users = repeat_offenders.get(process_name(proc)) if repeat_offenders else None
+    if not users:
+        return False
+    if proc['uid'] is None:
+        proc['uid'] = read_proc_uid(proc['pid'])
+    return proc['uid'] is not None and username_for_uid(proc['uid']) in users
+
+def show_history(limit, user, offenders):
+    """Print the most recent kills (or a per name/user summary) from the journal. Returns the process exit code."""
+    path = validated_config['history_path']
+    if not path or not os.path.exists(path):
+        print(f"No kill history journal at '{path}'.", file=sys.stderr)
+        return 1
+    import sqlite3
+    try:
+        db = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        where, params = ("WHERE user = ?", (user,)) if user else ("", ())
+        if offenders:
+            rows = db.execute(f"SELECT name, user, COUNT(*), SUM(outcome = 'failed'), SUM(reclaimed), MAX(time) FROM kills {where} "
+                              f"GROUP BY name, user ORDER BY COUNT(*) DESC, MAX(time) DESC LIMIT ?", params + (limit,)).fetchall()
+        else:
+            rows = db.execute(f"SELECT time, kind, pid, user, name, rss, signal, outcome, exit_seconds, reclaimed, cmdline_hash FROM kills {where} "
+                              f"ORDER BY time DESC LIMIT ?", params + (limit,)).fetchall()
+        db.close()
+    except sqlite3.Error as e:
+        print(f"Cannot read kill history journal '{path}': {e}", file=sys.stderr)
+        return 1
+
+    if offenders:
+        print(f"{'KILLS':>5} {'FAILED':>6} {'RECLAIMED':>10} {'LAST KILL':<19} {'USER':<12} NAME")
+        for name, owner, kills, failed, reclaimed, last in rows:
+            print(f"{kills:>5} {failed:>6} {(reclaimed or 0) // 1024 // 1024:>8}MB {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last)):<19} {owner:<12} {name}")
+    else:
+        print(f"{'TIME':<19} {'KIND':<7} {'PID':>7} {'USER':<12} {'RSS':>8} {'SIGNAL':<7} {'OUTCOME':<10} {'EXIT':>6} {'RECLAIMED':>10} {'CMDHASH':<16} NAME")
+        for timestamp, kind, pid, owner, name, rss, signal_name, outcome, exit_seconds, reclaimed, digest in rows:
+            exit_text = f"{exit_seconds:.2f}s" if exit_seconds is not None else '-'
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp)):<19} {kind:<7} {pid:>7} {owner:<12} {rss // 1024 // 1024:>6}MB {signal_name or '-':<7} {outcome:<10} "
+                  f"{exit_text:>6} {reclaimed // 1024 // 1024:>8}MB {digest:<16} {name}")
+    return 0
+
+# --- Shadow Mode and Traces ---
+def victim_reason(victim):
+    """Explain why a victim ranked where it did, for shadow mode logs and traces."""
+    if victim.get('prioritized'):
+        return 'prioritized'
+    if victim.get('quota_excess'):
+        return 'over quota'
+    if victim.get('repeat_offender'):
+        return 'repeat offender'
+    if 'growth' in victim:
+        return 'fastest growing'
+    if victim.get('swap', 0) > victim['rss']:
+        return 'swapped out'
+    return validated_config.get('score_formula', 'rss')
+
+def shadow_decision(victims, kind='process'):
+    """Shadow mode: log what would be killed and why, and trace the decision instead of killing anything."""
+    for victim in victims:
+        logger.warning(f"Shadow mode: would kill {kind} PID={victim['pid']}, User={victim['username']}, Name={victim['name']}, "
+                       f"RSS={victim['rss'] // 1024 // 1024}MB, Score={victim.get('score', victim['rss']) // 1024 // 1024}MB, Reason={victim_reason(victim)}",
+                       extra=event_fields('shadow', victim, kind=kind, reason=victim_reason(victim)))
+    trace_decision(victims, 'shadow', kind)
+
+def close_trace():
+    """Close the current trace file; the next record starts a new file with a full process snapshot."""
+    global trace_file, trace_day
+    if trace_file is not None:
+        try:
+            trace_file.close()
+        except OSError:
+            pass
+    trace_file = None
+    trace_day = None
+    trace_procs.clear()
+
+def prune_traces(directory):
+    """Delete trace files older than trace_retention_days."""
+    cutoff = time.time() - validated_config['trace_retention_days'] * 86400
+    try:
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.startswith('oomkiller-trace-') and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+    except OSError as e:
+        logger.warning(f"Failed to prune traces in {directory}: {e}")
+
+def trace_write(record):
+    """Append one compact JSON record to today's trace file in trace_dir, starting a new self-contained file each day."""
+    global trace_file, trace_day
+    day = time.strftime('%Y%m%d')
+    if trace_file is None or day != trace_day:
+        close_trace()
+        directory = validated_config['trace_dir']
+        try:
+            os.makedirs(directory, exist_ok=True)
+            trace_file = open(os.path.join(directory, f'oomkiller-trace-{day}.jsonl'), 'a')
+        except OSError as e:
+            logger.error(f"Cannot open trace file in {directory}: {e}")
+            return
+        trace_day = day
+        prune_traces(directory)
+    try:
+        trace_file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        trace_file.flush()
+    except OSError as e:
+        logger.error(f"Failed to write trace record: {e}")
+
+def trace_sample(memory_info, swap_info, available_memory_percentage, available_swap_percentage):
+    """Trace a memory sample, plus a process snapshot when memory or swap is within trace_margin_percentage of its threshold."""
+    global trace_last_snapshot
+    margin = validated_config['trace_margin_percentage']
+    near = (available_memory_percentage < validated_config['min_available_memory_percentage'] + margin
+            or available_swap_percentage < validated_config['min_available_swap_percentage'] + margin)
+    now = time.monotonic()
+    # 事件期间每秒会多次采样，快照间隔至少 min_query_interval_seconds / Incidents sample several times a second, snapshots are spaced by min_query_interval_seconds
+    # 快照写在样本之前，回放时样本触发的选择能看到它 / The snapshot goes before the sample, so selection triggered by the sample sees it on replay
+    if near and now - trace_last_snapshot >= validated_config['min_query_interval_seconds']:
+        trace_last_snapshot = now
+        trace_processes()
+    pressure = memory_samples[-1][4:] if memory_samples else (0.0, 0.0)
+    trace_write({'t': 'sample', 'time': round(time.time(), 3),
+                 'mem': [memory_info.available, memory_info.total, swap_info.free, swap_info.total, pressure[0], pressure[1]]})
+
+def trace_processes():
+    """Refresh the process table and trace what changed since the last snapshot in the current trace file.
+
+    New processes are written in full (uid, user, comm, cmdline, oom_score_adj), known ones only when their RSS changed.
+    The TRACE_SMAPS_CANDIDATES largest processes also get their smaps_rollup, so replay can use every score formula.
+    """
+    refresh_process_table()
+    full = not trace_procs
+    new, changed = [], []
+    for pid, proc in process_table.items():
+        known = trace_procs.get(pid)
+        if known is None or known[0] != proc['start_time']:
+            if proc['uid'] is None:
+                proc['uid'] = read_proc_uid(pid)
+            uid = proc['uid']
+            new.append([pid, proc['start_time'], uid, username_for_uid(uid) if uid is not None else None, proc['rss'], proc['comm'],
+                        process_cmdline(proc), read_oom_score_adj(pid)])
+        elif known[1] != proc['rss']:
+            changed.append([pid, proc['rss']])
+        else:
+            continue
+        trace_procs[pid] = (proc['start_time'], proc['rss'])
+    gone = [pid for pid in trace_procs if pid not in process_table]
+    for pid in gone:
+        del trace_procs[pid]
+    smaps = []
+    for _, pid in heapq.nlargest(TRACE_SMAPS_CANDIDATES, ((proc['rss'], pid) for pid, proc in process_table.items())):
+        rollup = read_smaps_rollup(pid)
+        if rollup and 'Pss' in rollup:
+            smaps.append([pid] + [rollup.get(key, 0) for key in TRACE_SMAPS_FIELDS])
+    trace_write({'t': 'procs', 'time': round(time.time(), 3), 'self': os.getpid(), 'full': full, 'new': new, 'rss': changed, 'gone': gone, 'smaps': smaps})
+
+def trace_decision(victims, mode, kind='process'):
+    """Trace the victims chosen by the pipeline; mode is 'kill' or 'shadow'."""
+    if not validated_config.get('trace_dir'):
+        return
+    trace_write({'t': 'decision', 'time': round(time.time(), 3), 'mode': mode, 'kind': kind,
+                 'victims': [[victim['pid'], victim['name'], victim['username'], victim['rss'], victim.get('score', victim['rss']), victim_reason(victim)]
+                             for victim in victims]})
+
+def write_replay_file(directory, name, data):
+    """Write one file of the synthetic procfs used by replay."""
+    with open(os.path.join(directory, name), 'w') as f:
+        f.write(data)
+
+def write_replay_rss(directory, entry):
+    """Write the stat and statm files of a replayed process from its trace entry."""
+    pid, start_time, _, _, rss, comm = entry[:6]
+    pages = rss // PAGE_SIZE
+    write_replay_file(directory, 'stat', f"{pid} ({comm}) S 1 {pid} {pid} 0 -1 4194560 0 0 0 0 0 0 0 0 20 0 1 0 {start_time} {pages * PAGE_SIZE} {pages}\n")
+    write_replay_file(directory, 'statm', f"{pages} {pages} 0 1 0 {pages} 0\n")
+
+def materialize_trace_procs(state, record):
+    """Apply a 'procs' trace record to the synthetic procfs in state['root'], so the real scanner and selection code can read it."""
+    root, procs = state['root'], state['procs']
+    if record['full']:
+        for pid in procs:
+            shutil.rmtree(os.path.join(root, str(pid)), ignore_errors=True)
+        procs.clear()
+        state['smaps'] = set()
+    for pid in record['gone']:
+        if procs.pop(pid, None) is not None:
+            shutil.rmtree(os.path.join(root, str(pid)), ignore_errors=True)
+    for entry in record['new']:
+        pid, _, uid, user, _, comm, cmdline, adj = entry
+        directory = os.path.join(root, str(pid))
+        if pid in procs:
+            shutil.rmtree(directory, ignore_errors=True) # PID 被复用 / PID reused
+        os.makedirs(directory)
+        procs[pid] = entry
+        if uid is not None and user is not None:
+            uid_name_cache[uid] = user # 回放主机上可能没有该用户 / The user may not exist on the replay host
+        write_replay_file(directory, 'status', f"Name:\t{comm}\n" + (f"Uid:\t{uid}\t{uid}\t{uid}\t{uid}\n" if uid is not None else ''))
+        write_replay_file(directory, 'cmdline', ''.join(arg + '\0' for arg in cmdline))
+        write_replay_file(directory, 'oom_score_adj', f"{adj}\n")
+        write_replay_rss(directory, entry)
+    for pid, rss in record['rss']:
+        if pid in procs:
+            procs[pid][4] = rss
+            write_replay_rss(os.path.join(root, str(pid)), procs[pid])
+    # 只有最大的进程有 smaps_rollup，其余回退到 RSS 评分 / Only the largest processes have smaps_rollup, the rest fall back to RSS scoring
+    smaps = {row[0]: row[1:] for row in record['smaps'] if row[0] in procs}
+    for pid in state['smaps'] - smaps.keys():
+        try:
+            os.remove(os.path.join(root, str(pid), 'smaps_rollup'))
+        except OSError:
+            pass # 进程已退出或 PID 被复用 / The process exited or its PID was reused
+    for pid, values in smaps.items():
+        write_replay_file(os.path.join(root, str(pid)), 'smaps_rollup', "00400000-7ffc00000000 ---p 00000000 00:00 0 [rollup]\n"
+                          + f"Rss: {procs[pid][4] // 1024} kB\n" + ''.join(f"{key}: {value // 1024} kB\n" for key, value in zip(TRACE_SMAPS_FIELDS, values)))
+    state['smaps'] = set(smaps)
+    # 被追踪的守护进程从不选择自己 / The traced daemon never selects itself
+    state['self'] = record.get('self')
+
+def replay_sample(variant, state, timestamp, available_memory_percentage, available_swap_percentage, swap_total):
+    """Check one traced sample against a variant's thresholds and run victim selection when a replayed incident starts."""
+    global validated_config
+    config = validated_config = variant['config']
+    if available_memory_percentage >= config['min_available_memory_percentage'] and available_swap_percentage >= config['min_available_swap_percentage']:
+        variant['incident'] = None
+        return
+    if variant['incident'] is not None:
+        variant['incident']['samples'] += 1
+        return
+    # 各变体的配额设置可能不同，重新汇总 / Variants may configure quotas differently, so re-aggregate per user
+    reset_user_memory()
+    hogs = get_memory_hogs({state['self']}, set(config['avoid_processes']), config['prioritize_kill_processes'],
+                           limit=max(DEFAULT_HOG_CANDIDATES, config['max_batch_kills']))
+    deficit = estimate_memory_deficit(available_memory_percentage, available_swap_percentage, swap_total)
+    variant['incident'] = {'time': timestamp, 'memory': available_memory_percentage, 'swap': available_swap_percentage, 'samples': 1,
+                           'victims': [dict(victim, reason=victim_reason(victim)) for victim in select_victims(hogs, deficit)]}
+    variant['incidents'].append(variant['incident'])
+
+def replay_traces(paths, config_paths, score_formulas):
+    """Run trace files through each config and score formula and print what would have been killed. Returns the exit code."""
+    global TOTAL_MEMORY, PROC_ROOT, replay_swap_used
+    records = []
+    for path in sorted(paths):
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue # 守护进程崩溃时最后一行可能不完整 / The last line may be truncated if the daemon died
+        except OSError as e:
+            print(f"Cannot read trace {path}: {e}", file=sys.stderr)
+            return 1
+    samples = [record for record in records if record.get('t') == 'sample']
+    if not samples:
+        print("No samples found in the traces.", file=sys.stderr)
+        return 1
+
+    # 百分比配额按被追踪主机的内存计算 / Percentage quotas are relative to the traced host's memory
+    TOTAL_MEMORY = samples[0]['mem'][1]
+    variants = []
+    for config_path in config_paths:
+        load_config(config_path)
+        for formula in score_formulas or [validated_config['score_formula']]:
+            config = dict(validated_config, score_formula=formula, history_path='', trace_dir='')
+            variants.append({'label': f"{config_path} (score_formula={formula})", 'config': config, 'incident': None, 'incidents': []})
+
+    import tempfile # 仅回放需要 / Only needed by replay
+    state = {'root': tempfile.mkdtemp(prefix='oomkiller-replay-', dir='/dev/shm' if os.path.isdir('/dev/shm') else None), 'procs': {}, 'smaps': set(), 'self': None}
+    PROC_ROOT = state['root']
+    process_table.clear()
+    recorded = []
+    started = time.perf_counter()
+    try:
+        for record in records:
+            if record.get('t') == 'procs':
+                materialize_trace_procs(state, record)
+            elif record.get('t') == 'decision':
+                recorded.append(record)
+            elif record.get('t') == 'sample':
+                available, total, swap_free, swap_total = record['mem'][:4]
+                available_memory_percentage = available / total * 100 if total > 0 else 100.0
+                available_swap_percentage = swap_free / swap_total * 100 if swap_total > 0 else 100.0
+                replay_swap_used = max(swap_total - swap_free, 0)
+                for variant in variants:
+                    replay_sample(variant, state, record['time'], available_memory_percentage, available_swap_percentage, swap_total)
+    finally:
+        PROC_ROOT = '/proc'
+        replay_swap_used = None
+        process_table.clear()
+        shutil.rmtree(state['root'], ignore_errors=True)
+    elapsed = time.perf_counter() - started
+
+    span = samples[-1]['time'] - samples[0]['time']
+    print(f"Replayed {len(samples)} samples and {sum(1 for record in records if record.get('t') == 'procs')} process snapshots "
+          f"spanning {span:.0f}s in {elapsed:.2f}s ({span / elapsed if elapsed > 0 else 0:.0f}x real time).")
+    print(f"\nRecorded decisions: {len(recorded)}")
+    for record in recorded:
+        for pid, name, user, rss, score, reason in record['victims']:
+            print(f"  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record['time']))} {record['mode']:<6} {record['kind']:<7} {pid:>7} {user or '-':<12} "
+                  f"{rss // 1024 // 1024:>6}MB {score // 1024 // 1024:>6}MB {reason:<16} {name}")
+    for variant in variants:
+        config = variant['config']
+        print(f"\n{variant['label']}: min memory {config['min_available_memory_percentage']}%, min swap {config['min_available_swap_percentage']}%, "
+              f"{len(variant['incidents'])} incident(s), {sum(len(incident['victims']) for incident in variant['incidents'])} victim(s)")
+        print(f"  {'TIME':<19} {'MEM%':>5} {'SWAP%':>5} {'SAMPLES':>7} {'PID':>7} {'USER':<12} {'RSS':>8} {'SCORE':>8} {'REASON':<16} NAME")
+        for incident in variant['incidents']:
+            prefix = (f"  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(incident['time'])):<19} {incident['memory']:>5.1f} "
+                      f"{incident['swap']:>5.1f} {incident['samples']:>7}")
+            if not incident['victims']:
+                print(f"{prefix} {'-':>7} no killable process found")
+            for victim in incident['victims']:
+                print(f"{prefix} {victim['pid']:>7} {victim['username']:<12} {victim['rss'] // 1024 // 1024:>6}MB "
+                      f"{victim['score'] // 1024 // 1024:>6}MB {victim['reason']:<16} {victim['name']}")
+    return 0
+
+# --- Fleet Mode ---
+def open_fleet_socket(address, listen=False):
+    """Connect to, or listen on, a fleet address: 'host:port' for TCP or 'unix:/path' for a Unix socket."""
+    if address.startswith('unix:'):
+        path = address[5:]
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if listen:
+            if os.path.exists(path):
+                os.unlink(path) # 上次运行遗留的套接字 / Stale socket from a previous run
+            sock.bind(path)
+            sock.listen(128)
+        else:
+            sock.settimeout(FLEET_SOCKET_TIMEOUT)
+            sock.connect(path)
+        return sock
+    host, _, port = address.rpartition(':')
+    host = host.strip('[]')
+    if not listen:
+        return socket.create_connection((host, int(port)), timeout=FLEET_SOCKET_TIMEOUT)
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, int(port)))
+    sock.listen(128)
+    return sock
+
+def encode_fleet_events(events):
+    """Encode events as compact newline-delimited JSON."""
+    return ''.join(json.dumps(event, separators=(',', ':')) + '\n' for event in events).encode()
+
+def fleet_send(event_type, fields):
+    """Queue an event for the collector without ever blocking; events are dropped (and counted) while the queue is full."""
+    if fleet_queue is None:
+        return
+    fields['type'] = event_type
+    try:
+        fleet_queue.put_nowait(fields)
+    except queue.Full:
+        metric_inc('oomkiller_fleet_events_total', result='dropped')
+
+def fleet_sample(available_memory_percentage, available_swap_percentage):
+    """Queue a memory sample event at most once every fleet_sample_seconds."""
+    global fleet_last_sample
+    if fleet_queue is None:
+        return
+    now = time.monotonic()
+    if now - fleet_last_sample < validated_config['fleet']['fleet_sample_seconds']:
+        return
+    fleet_last_sample = now
+    fleet_send('sample', {'time': time.time(), 'available_memory': available_memory_percentage, 'available_swap': available_swap_percentage,
+                          'psi_some_avg10': memory_samples[-1][4] if memory_samples else None})
+
+def start_fleet_agent():
+    """Start streaming events to the configured collector, if any."""
+    global fleet_queue, fleet_thread, fleet_last_sample
+    fleet_config = validated_config['fleet']
+    if not fleet_config['fleet_collector'] or (fleet_thread is not None and fleet_thread.is_alive()):
+        return
+    fleet_queue = queue.Queue(maxsize=fleet_config['fleet_queue_size'])
+    fleet_last_sample = 0
+    fleet_thread = threading.Thread(target=fleet_worker, args=(fleet_config,), name='oomkiller-fleet', daemon=True)
+    fleet_thread.start()
+    logger.info(f"Streaming events to fleet collector {fleet_config['fleet_collector']} as node '{fleet_config['fleet_node_name']}'")
+
+def stop_fleet_agent(timeout=5):
+    """Ask the fleet sender to flush what it can and wait up to `timeout` seconds for it."""
+    global fleet_queue, fleet_thread
+    if fleet_thread is None:
+        return
+    try:
+        fleet_queue.put(None, timeout=timeout) # 结束标记 / Sentinel
+    except queue.Full:
+        pass
+    fleet_thread.join(timeout)
+    fleet_queue = fleet_thread = None
+
+def fleet_worker(fleet_config):
+    """Background loop: keep one connection to the collector and send queued events in batches every fleet_batch_seconds.
+
+    While the collector is unreachable or slow, up to fleet_queue_size of the newest events are kept and the oldest dropped.
+    """
+    events = fleet_queue
+    pending = collections.deque()
+    sock = None
+    retry_at = 0
+    backoff = 1
+    stopping = False
+    while True:
+        deadline = time.monotonic() + fleet_config['fleet_batch_seconds']
+        while not stopping:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                event = events.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if event is None:
+                stopping = True
+                break
+            if len(pending) >= fleet_config['fleet_queue_size']:
+                pending.popleft()
+                metric_inc('oomkiller_fleet_events_total', result='dropped')
+            pending.append(event)
+
+        if pending and time.monotonic() >= retry_at:
+            try:
+                if sock is None:
+                    sock = open_fleet_socket(fleet_config['fleet_collector'])
+                    hello = {'type': 'hello', 'node': fleet_config['fleet_node_name'], 'version': 1}
+                    if fleet_config['fleet_token']:
+                        hello['token'] = fleet_config['fleet_token']
+                    sock.sendall(encode_fleet_events([hello]))
+                    logger.info(f"Connected to fleet collector {fleet_config['fleet_collector']}.")
+                # 一批事件一次写入；收集端处理不过来时 TCP 流控会让这里阻塞，而不是主循环 / One write per batch; if the collector falls behind,
+                # TCP flow control blocks here rather than in the main loop
+                sock.sendall(encode_fleet_events(pending))
+                metric_inc('oomkiller_fleet_events_total', len(pending), result='sent')
+                pending.clear()
+                backoff = 1
+            except OSError as e:
+                logger.warning(f"Failed to send {len(pending)} event(s) to fleet collector {fleet_config['fleet_collector']}: {e}. Retrying in {backoff}s.")
+                if sock is not None:
+                    sock.close()
+                    sock = None
+                retry_at = time.monotonic() + backoff
+                backoff = min(backoff * 2, 60)
+        if stopping:
+            break
+    if sock is not None:
+        sock.close()
+
+def fleet_token_file(path):
+    """argparse type for --token-file: read the shared fleet token from a file, surrounding whitespace removed."""
+    try:
+        with open(path) as f:
+            token = f.read().strip()
+    except OSError as e:
+        raise argparse.ArgumentTypeError(f"cannot read token file: {e}")
+    if not token:
+        raise argparse.ArgumentTypeError(f"token file {path} is empty")
+    return token
+
+def fleet_token_matches(token, event):
+    """Whether a hello or query event carries the collector's shared token; always true when the collector has none."""
+    return not token or hmac.compare_digest(str(event.get('token', '')).encode(), token.encode())
+
+def run_collector(address, db_path, retention_days, token=''):
+    """Run the fleet collector: one persistent connection per agent in a single select loop, events stored in SQLite and queries answered inline.
+
+    A query reply is written when the socket is writable, and the connection's later events wait until it is sent, so
+    a client that reads slowly only holds up itself, never ingest from the other agents. With a token, hello and query
+    events without it are rejected.
+    """
+    import selectors # 仅收集端需要 / Only needed by the collector
+    import sqlite3
+    import ipaddress
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    db = sqlite3.connect(db_path)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    with db:
+        for statement in FLEET_SCHEMA:
+            db.execute(statement)
+    server = open_fleet_socket(address, listen=True)
+    server.setblocking(False)
+    selector = selectors.DefaultSelector()
+    selector.register(server, selectors.EVENT_READ)
+    connections = {}
+    next_prune = 0
+    logger.info(f"Fleet collector listening on {address}, storing events in {db_path}")
+    if not token and server.family != socket.AF_UNIX and not ipaddress.ip_address(server.getsockname()[0].split('%')[0]).is_loopback:
+        logger.warning(f"Fleet collector on {address} has no --token-file: any host that can reach it can send events and read fleet data. "
+                       f"Use a token, or listen on localhost or a Unix socket.")
+    try:
+        while True:
+            for key, mask in selector.select(timeout=60):
+                if key.fileobj is server:
+                    try:
+                        conn, peer = server.accept()
+                    except (BlockingIOError, InterruptedError):
+                        continue
+                    conn.setblocking(False)
+                    selector.register(conn, selectors.EVENT_READ)
+                    connections[conn] = {'node': None, 'peer': peer[0] if isinstance(peer, tuple) else address, 'buffer': b'', 'outbox': b'', 'closing': False}
+                    continue
+                conn, state = key.fileobj, connections[key.fileobj]
+                if mask & selectors.EVENT_READ:
+                    try:
+                        data = conn.recv(65536)
+                    except (BlockingIOError, InterruptedError):
+                        data = None
+                    except OSError:
+                        data = b''
+                    if data is not None:
+                        state['buffer'] += data
+                    if data == b'':
+                        # 连接关闭时保存剩余的完整事件，丢弃不完整的最后一行 / Store the remaining complete events when the connection closes, an incomplete trailing line is discarded
+                        while b'\n' in state['buffer'] and not state['closing']:
+                            handle_collector_lines(db, state, token)
+                        close_collector_connection(selector, connections, conn)
+                        continue
+                if not send_collector_replies(conn, state):
+                    close_collector_connection(selector, connections, conn)
+                    continue
+                if not state['outbox']:
+                    handle_collector_lines(db, state, token)
+                    if not send_collector_replies(conn, state) or len(state['buffer']) > FLEET_MAX_LINE:
+                        close_collector_connection(selector, connections, conn)
+                        continue
+                if state['closing'] and not state['outbox']:
+                    close_collector_connection(selector, connections, conn)
+                    continue
+                # 回复未发完前不再读取，慢速客户端只会阻塞自己；已缓冲的后续事件在下一轮 (套接字可写时) 处理
+                # Stop reading while a reply is pending, so a slow client only holds up itself; events already buffered are handled on the next (writable) turn
+                events = selectors.EVENT_WRITE if state['outbox'] or b'\n' in state['buffer'] else selectors.EVENT_READ
+                if events != key.events:
+                    selector.modify(conn, events)
+            if time.time() >= next_prune:
+                with db:
+                    cutoff = time.time() - retention_days * 86400
+                    db.execute("DELETE FROM kills WHERE time < ?", (cutoff,))
+                    db.execute("DELETE FROM incidents WHERE started < ?", (cutoff,))
+                next_prune = time.time() + 3600
+    finally:
+        for conn in connections:
+            conn.close()
+        server.close()
+        if address.startswith('unix:') and os.path.exists(address[5:]):
+            os.unlink(address[5:])
+        db.close()
+
+def close_collector_connection(selector, connections, conn):
+    """Unregister and close one collector connection, dropping any unsent replies."""
+    state = connections.pop(conn)
+    if state['node']:
+        logger.info(f"Fleet node '{state['node']}' disconnected.")
+    selector.unregister(conn)
+    conn.close()
+
+def send_collector_replies(conn, state):
+    """Write as much of a connection's pending reply as the socket accepts; False if the connection failed."""
+    if state['outbox']:
+        try:
+            sent = conn.send(state['outbox'])
+            state['outbox'] = state['outbox'][sent:]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError as e:
+            logger.warning(f"Failed to answer fleet query from {state['peer']}: {e}")
+            return False
+    return True
+
+def handle_collector_lines(db, state, token=''):
+    """Store the complete events buffered on one connection in a single transaction, up to and including the first query."""
+    lines = state['buffer'].split(b'\n')
+    state['buffer'] = lines.pop()
+    kills, incidents, samples = [], [], []
+    for i, line in enumerate(lines):
+        try:
+            event = json.loads(line.decode())
+            event_type = event['type']
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"Ignoring malformed fleet event from '{state['node']}': {line[:200]!r}")
+            continue
+        if event_type in ('hello', 'query') and not fleet_token_matches(token, event):
+            logger.warning(f"Rejecting fleet {event_type} from {state['peer']}: missing or wrong token.")
+            state['outbox'] += encode_fleet_events([{'error': 'missing or wrong fleet token'}])
+            state['closing'] = True
+            break
+        elif event_type == 'hello':
+            state['node'] = str(event.get('node'))
+            logger.info(f"Fleet node '{state['node']}' connected.")
+        elif event_type == 'query':
+            state['outbox'] += answer_fleet_query(db, event)
+            # 回复发出后再处理后续事件 / Later events wait until the reply is sent
+            state['buffer'] = b'\n'.join(lines[i + 1:] + [state['buffer']])
+            break
+        elif state['node'] is None:
+            continue # 未发送 hello 的连接 / Connection that never said hello
+        elif event_type == 'kill':
+            kills.append((state['node'],) + tuple(event.get(field) for field in KILL_FIELDS))
+        elif event_type == 'incident':
+            incidents.append((state['node'],) + tuple(event.get(field) for field in INCIDENT_FIELDS))
+        elif event_type == 'sample':
+            samples.append((state['node'], event.get('time'), event.get('available_memory'), event.get('available_swap'), event.get('psi_some_avg10')))
+    if kills or incidents or samples:
+        with db:
+            db.executemany("INSERT INTO kills VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", kills)
+            db.executemany("INSERT OR REPLACE INTO incidents VALUES (?, ?, ?, ?, ?, ?)", incidents)
+            db.executemany("INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?, ?)", samples)
+
+def answer_fleet_query(db, event):
+    """Run one of FLEET_QUERIES and return {'columns': [...], 'rows': [...]} (or {'error': ...}) encoded as one JSON line."""
+    sql = FLEET_QUERIES.get(event.get('query'))
+    if sql is None:
+        reply = {'error': f"unknown query '{event.get('query')}', expected one of {', '.join(sorted(FLEET_QUERIES))}"}
+    else:
+        try:
+            cursor = db.execute(sql, (time.time() - float(event.get('hours', 24)) * 3600, int(event.get('limit', 20))))
+            reply = {'columns': [column[0] for column in cursor.description], 'rows': cursor.fetchall()}
+        except Exception as e:
+            reply = {'error': str(e)}
+    return encode_fleet_events([reply])
+
+def fleet_query(address, query_name, hours, limit, token=''):
+    """Ask a collector for a fleet-wide query and print the result as a table. Returns the process exit code."""
+    query = {'type': 'query', 'query': query_name, 'hours': hours, 'limit': limit}
+    if token:
+        query['token'] = token
+    try:
+        sock = open_fleet_socket(address)
+        sock.sendall(encode_fleet_events([query]))
+        response = b''
+        while not response.endswith(b'\n'):
+            data = sock.recv(65536)
+            if not data:
+                break
+            response += data
+        sock.close()
+        reply = json.loads(response.decode())
+    except (OSError, ValueError) as e:
+        print(f"Fleet query to {address} failed: {e}", file=sys.stderr)
+        return 1
+    if 'error' in reply:
+        print(f"Fleet query failed: {reply['error']}", file=sys.stderr)
+        return 1
+    print_table([reply['columns']] + [['-' if value is None else str(value) for value in row] for row in reply['rows']])
+    return 0
+
+def print_table(rows):
+    """Print rows of strings as left-aligned columns; the first row is the header."""
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print('  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip())
+
+# --- Emergency Mode ---
+def enable_emergency_mode():
+    """Make the daemon itself survive memory pressure: warm up, protect from the kernel OOM killer, raise priority and mlockall."""
+    # 预先执行一次扫描并导入通知依赖，避免在压力下缺页或导入模块 / Warm up the scan path and notification imports so nothing faults in under pressure
+    refresh_process_table()
+    if validated_config.get('enable_notifications'):
+        try:
+            get_http_session()
+        except ImportError as e:
+            logger.warning(f"Cannot preload notification dependencies: {e}")
+    # 将启动时创建的对象移出 GC 扫描范围 / Move startup objects out of the collector's way (Python 3.7+)
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+    try:
+        with open('/proc/self/oom_score_adj', 'w') as f:
+            f.write('-1000')
+        logger.info("Set own oom_score_adj to -1000.")
+    except OSError as e:
+        logger.warning(f"Failed to set own oom_score_adj: {e}")
+
+    try:
+        os.setpriority(os.PRIO_PROCESS, 0, validated_config['emergency_nice'])
+        logger.info(f"Set own nice value to {validated_config['emergency_nice']}.")
+    except OSError as e:
+        logger.warning(f"Failed to set own nice value: {e}")
+
+    import ctypes # 仅紧急模式需要 / Only needed in emergency mode
+    libc = ctypes.CDLL(None, use_errno=True)
+    # MCL_ONFAULT (Linux 4.4+) 只锁定实际使用的页，避免线程栈被整体锁定 / MCL_ONFAULT only locks pages once touched, so thread stacks are not locked in full
+    for flags, description in ((MCL_CURRENT | MCL_FUTURE | MCL_ONFAULT, 'MCL_CURRENT|MCL_FUTURE|MCL_ONFAULT'),
+                               (MCL_CURRENT | MCL_FUTURE, 'MCL_CURRENT|MCL_FUTURE')):
+        if libc.mlockall(flags) == 0:
+            logger.info(f"Locked daemon memory with mlockall({description}).")
+            break
+        err = ctypes.get_errno()
+        if err != errno.EINVAL:
+            logger.warning(f"mlockall({description}) failed: {os.strerror(err)}")
+            break
+    logger.info(f"Emergency mode enabled, daemon RSS {read_proc_rss('self') // 1024 // 1024}MB.")
+
+# --- Metrics ---
+def metric_inc(name, value=1, **labels):
+    """Increment a counter; labels are passed as keyword arguments."""
+    key = (name, tuple(sorted(labels.items()))) if labels else (name, ())
+    with metrics_lock:
+        metric_values[key] = metric_values.get(key, 0) + value
+
+def metric_set(name, value):
+    """Set an unlabelled gauge."""
+    with metrics_lock:
+        metric_values[(name, ())] = value
+
+def metric_observe(name, value):
+    """Add an observation to a histogram. Only the matching bucket is touched, cumulative counts are computed on export."""
+    buckets = METRICS[name][2]
+    with metrics_lock:
+        histogram = metric_histograms.get(name)
+        if histogram is None:
+            histogram = metric_histograms[name] = [[0] * (len(buckets) + 1), 0.0]
+        histogram[0][bisect.bisect_left(buckets, value)] += 1
+        histogram[1] += value
+
+def record_kill_metrics(victim):
+    """Count a handled victim by signal and outcome, with its exit time and estimated reclaimed memory."""
+    outcome = victim.get('outcome')
+    if outcome is None:
+        return
+    metric_inc('oomkiller_kills_total', signal=victim.get('signal', 'none'), outcome=outcome)
+    if outcome in ('terminated', 'killed'):
+        metric_observe('oomkiller_kill_reclaimed_bytes', victim.get('freeable', victim['rss']))
+        if 'exit_seconds' in victim:
+            metric_observe('oomkiller_kill_exit_seconds', victim['exit_seconds'])
+
+def render_metrics():
+    """Render all metrics in the Prometheus text exposition format (version 0.0.4)."""
+    if notification_queue is not None:
+        metric_set('oomkiller_notification_queue_depth', notification_queue.qsize())
+    # 其他线程可能同时写入，先复制 / Other threads may be writing concurrently, so take a snapshot first
+    with metrics_lock:
+        values = sorted(metric_values.items())
+        histograms = {name: (list(counts), total) for name, (counts, total) in metric_histograms.items()}
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == 'histogram':
+            counts, total = histograms.get(name, ([0] * (len(buckets) + 1), 0.0))
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f"{name}_sum {total}")
+            lines.append(f"{name}_count {cumulative}")
+            continue
+        for (metric, labels), value in values:
+            if metric == name:
+                label_text = ','.join(f'{key}="{label}"' for key, label in labels)
+                lines.append(f"{name}{{{label_text}}} {value}" if labels else f"{name} {value}")
+    return '\n'.join(lines) + '\n'
+
+class MetricsHandler:
+    """Serve render_metrics() on /metrics; mixed into http.server.BaseHTTPRequestHandler once the metrics server starts."""
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_metrics().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"Metrics request from {self.address_string()}: {format % args}")
+
+def write_metrics_textfile(path):
+    """Write the metrics atomically for the node_exporter textfile collector."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            f.write(render_metrics())
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Failed to write metrics textfile {path}: {e}")
+
+def metrics_textfile_worker(path, interval):
+    """Background loop: rewrite the metrics textfile every `interval` seconds until stopped."""
+    while not metrics_stop.wait(interval):
+        write_metrics_textfile(path)
+
+def start_metrics_exporter():
+    """Start the metrics HTTP server and/or textfile writer configured in [Metrics]. Collection itself is always on."""
+    global metrics_server, metrics_textfile_thread, metrics_textfile_path
+    metrics_config = validated_config['metrics']
+    if not metrics_config['enable_metrics']:
+        return
+    metrics_stop.clear()
+    if metrics_config['metrics_listen_address']:
+        host, port = metrics_config['metrics_listen_address']
+        import http.server # 仅指标 HTTP 服务需要 / Only needed by the metrics HTTP server
+        handler = type('MetricsHandler', (MetricsHandler, http.server.BaseHTTPRequestHandler), {})
+        try:
+            metrics_server = http.server.HTTPServer((host, port), handler)
+        except OSError as e:
+            logger.error(f"Failed to start metrics server on {host}:{port}: {e}")
+        else:
+            threading.Thread(target=metrics_server.serve_forever, name='oomkiller-metrics', daemon=True).start()
+            logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    if metrics_config['metrics_textfile']:
+        path = metrics_textfile_path = metrics_config['metrics_textfile']
+        write_metrics_textfile(path)
+        metrics_textfile_thread = threading.Thread(target=metrics_textfile_worker, name='oomkiller-metrics-textfile', daemon=True,
+                                                   args=(path, metrics_config['metrics_textfile_interval_seconds']))
+        metrics_textfile_thread.start()
+        logger.info(f"Writing metrics to {path} every {metrics_config['metrics_textfile_interval_seconds']:g} seconds")
+
+def stop_metrics_exporter():
+    """Stop the metrics exporter, writing the textfile one last time."""
+    global metrics_server, metrics_textfile_thread, metrics_textfile_path
+    if metrics_server is not None:
+        metrics_server.shutdown()
+        metrics_server.server_close()
+        metrics_server = None
+    if metrics_textfile_thread is not None:
+        metrics_stop.set()
+        metrics_textfile_thread.join()
+        metrics_textfile_thread = None
+        write_metrics_textfile(metrics_textfile_path)
+        metrics_textfile_path = None
 
 def signal_handler(signum, frame):
     """Handle termination signals"""
     logger.info(f"Received signal {signum}, exiting gracefully...")
     sys.exit(0)
 
+def reload_config(config_path):
+    """Reload the configuration file, keeping the running configuration and all daemon state if it is invalid."""
+    global reload_requested
+    reload_requested = False
+    logger.info(f"Reloading configuration from {config_path}...")
+    old_config = validated_config
+    if not load_config(config_path, reload=True):
+        logger.error(f"Configuration reload from {config_path} failed, keeping the current configuration.")
+        return False
+    changed = sorted(key for key in validated_config if validated_config[key] != old_config.get(key))
+    if any(validated_config[key] != old_config.get(key) for key in ('log_path', 'log_format', 'log_queue_size', 'log_rate_limit_seconds', 'log_rate_limit_burst')):
+        reset_logging(validated_config['log_path'])
+    if any(validated_config[key] != old_config[key] for key in ('trigger_mode', 'psi_some_stall_ms', 'psi_full_stall_ms', 'psi_window_ms')):
+        close_psi_triggers()
+        if validated_config['trigger_mode'] == 'psi' and not setup_psi_triggers():
+            logger.warning("PSI triggers unavailable, falling back to interval polling.")
+    if validated_config['metrics'] != old_config['metrics']:
+        stop_metrics_exporter()
+        start_metrics_exporter()
+    if validated_config['user_quotas'] != old_config['user_quotas'] or validated_config['fair_share'] != old_config['fair_share']:
+        reset_user_memory()
+    if validated_config['memory_accounting'] != old_config['memory_accounting']:
+        reset_thrash_window(False)
+    if validated_config['control_socket'] != old_config['control_socket']:
+        close_control_socket()
+        open_control_socket()
+    if validated_config['fleet'] != old_config['fleet']:
+        stop_fleet_agent()
+        start_fleet_agent()
+    if validated_config['trace_dir'] != old_config['trace_dir']:
+        close_trace()
+    if validated_config['history_path'] != old_config['history_path']:
+        open_history()
+    else:
+        history_submit(refresh_repeat_offenders)
+    # 以下设置只在启动时生效 / These settings are only applied at startup
+    for key in ('emergency_mode', 'emergency_nice'):
+        if key in changed:
+            logger.warning(f"{key} changed, restart the daemon to apply it.")
+    if validated_config['notify'].get('notification_queue_size') != old_config['notify'].get('notification_queue_size') and notification_queue is not None:
+        logger.warning("notification_queue_size changed, restart the daemon to apply it.")
+    logger.info(f"Configuration reloaded, changed: {', '.join(changed) if changed else 'nothing'}.")
+    return True
+
 # --- Notification Logic ---
 def send_notification_to_user(username, process_name, pid, cmdline, message):
-    """Sends a notification to the user about a killed or problematic process."""
+    """Queues a notification to the user about a killed or problematic process; delivery happens on the background worker."""
     if not validated_config.get('enable_notifications', False):
         return # Exit if notifications are disabled globally
 
@@ -296,40 +3141,542 @@ def send_notification_to_user(username, process_name, pid, cmdline, message):
         logger.debug("Notification channel not configured, skipping notification.")
         return # Exit if channel is not set
 
-    logger.info(f"Preparing notification for user '{username}' via channel '{channel}'...")
+    logger.info(f"Queueing notification for user '{username}' via channel '{channel}'...")
     logger.debug(f"Notification details: PID={pid}, Name={process_name}, Cmd={cmdline}, Msg={message}")
 
-    # --- Placeholder for actual notification sending logic ---
+    start_notification_worker()
+    try:
+        # 不阻塞杀进程的关键路径 / Never block the kill path
+        notification_queue.put_nowait((username, message))
+    except queue.Full:
+        logger.error(f"Notification queue is full ({notification_queue.maxsize}), dropping notification for user '{username}'.")
+        metric_inc('oomkiller_notifications_total', result='dropped')
+
+def start_notification_worker():
+    """Start the background notification worker if it is not running yet."""
+    global notification_queue, notification_thread
+    if notification_thread is not None and notification_thread.is_alive():
+        return
+    if notification_queue is None:
+        notification_queue = queue.Queue(maxsize=validated_config.get('notify', {}).get('notification_queue_size', 100))
+    notification_thread = threading.Thread(target=notification_worker, name='oomkiller-notify', daemon=True)
+    notification_thread.start()
+
+def stop_notification_worker(timeout=10):
+    """Ask the worker to flush pending notifications and wait up to `timeout` seconds for it to finish."""
+    if notification_thread is None or not notification_thread.is_alive():
+        return
+    try:
+        notification_queue.put(None, timeout=timeout) # 结束标记 / Sentinel
+    except queue.Full:
+        logger.warning("Notification queue is full, pending notifications may be lost on exit.")
+        return
+    notification_thread.join(timeout)
+    if notification_thread.is_alive():
+        logger.warning(f"Notification worker did not finish within {timeout} seconds, pending notifications may be lost.")
+
+def notification_worker():
+    """Background loop: collect notifications for notification_batch_seconds, merge them per user and deliver with retries."""
+    notify_config = validated_config.get('notify', {})
+    batch_seconds = notify_config.get('notification_batch_seconds', 2)
+    stopping = False
+    while not stopping:
+        item = notification_queue.get()
+        if item is None:
+            break
+        # 收集同一时间窗口内的通知，按用户合并 / Collect everything that arrives within the batch window and merge per user
+        pending = {}
+        pending.setdefault(item[0], []).append(item[1])
+        deadline = time.monotonic() + batch_seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = notification_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                stopping = True
+                break
+            pending.setdefault(item[0], []).append(item[1])
+
+        for username, messages in pending.items():
+            message = messages[0] if len(messages) == 1 else f"共 {len(messages)} 条通知:\n\n" + "\n\n".join(messages)
+            deliver_with_retry(username, message)
+
+def deliver_with_retry(username, message):
+    """Deliver one (possibly merged) notification, retrying with exponential backoff. Returns True on success."""
+    retries = validated_config.get('notify', {}).get('notification_max_retries', 3)
+    delay = 1
+    for attempt in range(retries + 1):
+        try:
+            deliver_notification(username, message)
+            logger.debug(f"Notification for user '{username}' delivered.")
+            metric_inc('oomkiller_notifications_total', result='delivered')
+            return True
+        except Exception as e:
+            if attempt == retries:
+                logger.error(f"Failed to deliver notification to user '{username}' after {retries + 1} attempts: {e}")
+                metric_inc('oomkiller_notifications_total', result='failed')
+                return False
+            logger.warning(f"Failed to deliver notification to user '{username}' (attempt {attempt + 1}/{retries + 1}): {e}. Retrying in {delay}s...")
+            time.sleep(delay)
+            delay *= 2
+
+def deliver_notification(username, message):
+    """Send a notification through the configured channel right away. Raises on failure."""
+    notify_config = validated_config.get('notify', {})
+    channel = notify_config.get('notification_channel', '').lower()
+
     if channel == 'feishu':
         # Check Feishu specific config validity again (already checked in load_config but good practice)
-        app_id = notify_config.get('feishu_appid')
-        app_secret = notify_config.get('feishu_appsecret')
-        # bot_name = notify_config.get('feishu_botname') # May need botname or webhook URL
-        if not all([app_id, app_secret]):
-             logger.error("Feishu notification channel selected, but config (APPID, APPSECRET) is incomplete. Cannot send.")
-             return
-
-        logger.info("Attempting to send notification via Feishu (logic not implemented)...")
-        # TODO: Implement Feishu notification logic here
-        # You might need libraries like requests
-        # Example: find user ID based on username, construct message, call Feishu API
-        pass # Replace with actual implementation
+        if not all([notify_config.get('feishu_appid'), notify_config.get('feishu_appsecret')]):
+            raise ValueError("Feishu notification channel selected, but config (APPID, APPSECRET) is incomplete.")
+        send_feishu_message(feishu_receive_id(username), message)
 
     # elif channel == 'email':
-    #     logger.info("Attempting to send notification via Email (logic not implemented)...")
     #     # TODO: Implement Email notification logic here
     #     pass
 
     else:
-        logger.warning(f"Unsupported notification channel configured: '{channel}'. Cannot send notification.")
+        raise ValueError(f"Unsupported notification channel configured: '{channel}'.")
+
+def get_http_session():
+    """Return the shared HTTP session so connections to the notification API are reused."""
+    global http_session
+    if http_session is None:
+        import requests # 仅在启用通知时需要 / Only needed when notifications are enabled
+        http_session = requests.Session()
+    return http_session
+
+def feishu_receive_id(username):
+    """Map a local username to a Feishu receive_id (usernames get feishu_email_domain appended for the email id type)."""
+    notify_config = validated_config.get('notify', {})
+    if notify_config.get('feishu_receive_id_type') == 'email' and '@' not in username and notify_config.get('feishu_email_domain'):
+        return f"{username}@{notify_config['feishu_email_domain']}"
+    return username
+
+def get_feishu_token(force_refresh=False):
+    """Return a cached tenant_access_token, requesting a new one shortly before it expires."""
+    notify_config = validated_config['notify']
+    if not force_refresh and feishu_token['value'] and time.monotonic() < feishu_token['expires_at']:
+        return feishu_token['value']
+    response = get_http_session().post(
+        f"{notify_config['feishu_api_base']}/open-apis/auth/v3/tenant_access_token/internal",
+        json={'app_id': notify_config['feishu_appid'], 'app_secret': notify_config['feishu_appsecret']},
+        timeout=NOTIFICATION_HTTP_TIMEOUT)
+    response.raise_for_status()
+    data = response.json()
+    if data.get('code') != 0:
+        raise RuntimeError(f"Feishu token request failed: code={data.get('code')}, msg={data.get('msg')}")
+    feishu_token['value'] = data['tenant_access_token']
+    # 提前一分钟刷新 / Refresh one minute before it actually expires
+    feishu_token['expires_at'] = time.monotonic() + data.get('expire', 7200) - 60
+    return feishu_token['value']
+
+def send_feishu_message(receive_id, text):
+    """Send a text message to a Feishu user through the bot, refreshing the token once if it was rejected."""
+    notify_config = validated_config['notify']
+    for force_refresh in (False, True):
+        response = get_http_session().post(
+            f"{notify_config['feishu_api_base']}/open-apis/im/v1/messages",
+            params={'receive_id_type': notify_config['feishu_receive_id_type']},
+            headers={'Authorization': f"Bearer {get_feishu_token(force_refresh)}"},
+            json={'receive_id': receive_id, 'msg_type': 'text', 'content': json.dumps({'text': text}, ensure_ascii=False)},
+            timeout=NOTIFICATION_HTTP_TIMEOUT)
+        data = response.json() if response.content else {}
+        # 令牌失效时刷新后重试一次 / Retry once with a fresh token if the cached one was rejected
+        if data.get('code') in FEISHU_INVALID_TOKEN_CODES and not force_refresh:
+            continue
+        response.raise_for_status()
+        if data.get('code') != 0:
+            raise RuntimeError(f"Feishu message request failed: code={data.get('code')}, msg={data.get('msg')}")
+        return
+
+# --- Event Loop ---
+def setup_event_loop():
+    """Create the daemon's asyncio event loop and route SIGINT/SIGTERM/SIGHUP through it (the loop owns the signal wakeup fd)."""
+    global event_loop, wakeup_event, incident_event
+    event_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(event_loop)
+    wakeup_event = asyncio.Event()
+    incident_event = asyncio.Event()
+    event_loop.add_signal_handler(signal.SIGINT, request_shutdown, signal.SIGINT)
+    event_loop.add_signal_handler(signal.SIGTERM, request_shutdown, signal.SIGTERM)
+    event_loop.add_signal_handler(signal.SIGHUP, request_reload)
+
+def request_shutdown(signum):
+    """Handle SIGINT/SIGTERM: cancel the monitor task, which unwinds (closing pidfds, journaling kills) at its next await."""
+    logger.info(f"Received signal {signum}, exiting gracefully...")
+    if monitor_task is not None:
+        monitor_task.cancel()
+
+def request_reload():
+    """Handle SIGHUP: the monitor reloads the configuration at its next safe point (never in the middle of a kill)."""
+    global reload_requested
+    reload_requested = True
+    wakeup_event.set()
+
+async def sample_during_incidents():
+    """Keep sampling memory every min_query_interval_seconds while an incident is handled, so the trend buffer,
+    metrics and fleet samples stay current while kills are in flight."""
+    while True:
+        await incident_event.wait()
+        check_memory_swap_usage()
+        await asyncio.sleep(validated_config['min_query_interval_seconds'])
+
+async def monitor(config_path):
+    """The daemon's main task: check memory, handle incidents and wait for the next check, PSI event or reload request."""
+    global psi_stalling
+    while True:
+        try:
+            if reload_requested:
+                reload_config(config_path)
+
+            memory_ok, swap_ok, available_memory_percentage, available_swap_percentage = check_memory_swap_usage()
+
+            if not memory_ok or not swap_ok:
+                reason = []
+                if not memory_ok: reason.append(f"Memory: {available_memory_percentage:.1f}% available")
+                if not swap_ok: reason.append(f"Swap: {available_swap_percentage:.1f}% available" + (", thrashing" if thrashing else ""))
+                logger.warning(f"Memory or swap usage critical: {', '.join(reason)}",
+                               extra=event_fields('incident', available_memory=round(available_memory_percentage, 1),
+                                                  available_swap=round(available_swap_percentage, 1), thrashing=thrashing))
+                metric_inc('oomkiller_incidents_total')
+                begin_incident()
+                incident_event.set()
+
+                avoid_pids = set()
+                avoid_cgroups = set()
+                avoid_names = set(validated_config['avoid_processes'])
+                prioritize_names = validated_config['prioritize_kill_processes']
+                daemon_rss_start = daemon_rss_peak = read_proc_rss('self') or 0
+
+                while True:
+                    memory_ok, swap_ok, available_memory_percentage, available_swap_percentage = check_memory_swap_usage()
+                    daemon_rss_peak = max(daemon_rss_peak, read_proc_rss('self') or 0)
+                    if memory_ok and swap_ok:
+                        logger.info("Memory and swap usage sufficient now.", extra=event_fields('recovered'))
+                        break
+
+                    if validated_config['victim_mode'] == 'cgroup':
+                        groups = get_cgroup_hogs(avoid_cgroups, avoid_names, prioritize_names)
+                        remember_ranking('cgroups', groups)
+                        if groups:
+                            target_group = groups[0]
+                            if target_group['prioritized']:
+                                logger.info(f"Prioritizing kill for cgroup {target_group['name']}, User={target_group['username']} based on config.")
+                            decision = {'pid': target_group['leader'], 'name': target_group['name'], 'username': target_group['username'],
+                                        'rss': target_group['memory'], 'score': target_group['reclaimable'], 'prioritized': target_group['prioritized']}
+                            if validated_config['shadow_mode']:
+                                shadow_decision([decision], 'cgroup')
+                                break
+                            trace_decision([decision], 'kill', 'cgroup')
+                            if validated_config['freeze_victims'] and not await freeze_then_decide_cgroup(target_group):
+                                continue
+                            if not await kill_cgroup(target_group):
+                                avoid_cgroups.add(target_group['path'])
+                                logger.error(f"Failed to kill cgroup {target_group['name']}, adding to temporary avoid list.")
+                            else:
+                                reset_thrash_window(False)
+                            await asyncio.sleep(1) # Delay to prevent busy-looping
+                            continue
+                        logger.warning("No killable cgroups found, falling back to per-process victim selection.")
+
+                    hog_limit = max(DEFAULT_HOG_CANDIDATES, validated_config['max_batch_kills'])
+                    hogs = get_memory_hogs(avoid_pids, avoid_names, prioritize_names, limit=hog_limit)
+                    remember_ranking('processes', hogs, hog_limit)
+
+                    if not hogs:
+                        logger.error("Low resource condition persists, but no killable memory hogs found.")
+                        break
+
+                    deficit = estimate_memory_deficit(available_memory_percentage, available_swap_percentage)
+                    victims = select_victims(hogs, deficit)
+                    logger.info(f"Need to free about {deficit // 1024 // 1024}MB, selected {len(victims)} victim(s).",
+                                extra=event_fields('plan', deficit=deficit, victims=len(victims)))
+                    for victim in victims:
+                        if victim['prioritized']:
+                            logger.info(f"Prioritizing kill for process PID={victim['pid']}, User={victim['username']}, Name={victim['name']} based on config.")
+                        elif victim['quota_excess']:
+                            logger.info(f"Prioritizing kill for process PID={victim['pid']}, User={victim['username']}, Name={victim['name']}: "
+                                        f"user is {victim['quota_excess'] // 1024 // 1024}MB over its memory quota.")
+                        elif victim['repeat_offender']:
+                            logger.info(f"Prioritizing kill for process PID={victim['pid']}, User={victim['username']}, Name={victim['name']} as a repeat offender.")
+                        logger.info(f"Selected PID={victim['pid']} with {validated_config['score_formula']} score {victim['score'] // 1024 // 1024}MB",
+                                    extra=event_fields('select', victim, reason=victim_reason(victim)))
+
+                    if validated_config['shadow_mode']:
+                        shadow_decision(victims)
+                        break
+                    trace_decision(victims, 'kill')
+
+                    if validated_config['freeze_victims']:
+                        victims = await freeze_then_decide(victims)
+                        if not victims:
+                            continue
+
+                    failed = await kill_processes(victims)
+                    for victim in failed:
+                        avoid_pids.add(victim['pid'])
+                        # 进程名可能形如 'user:root'，只按原样匹配 / A name such as 'user:root' must only match itself
+                        avoid_names.add(exact_name_rule(victim['name']))
+                        logger.error(f"Failed to kill PID={victim['pid']}, adding to temporary avoid list.", extra=event_fields('avoid', victim))
+
+                    if len(failed) < len(victims):
+                        # 杀死之前的换入速率不能说明现在仍在颠簸 / Swap-in rates from before the kill say nothing about thrashing now
+                        reset_thrash_window(False)
+                    if len(failed) == len(victims):
+                        if len(hogs) <= len(failed):
+                            logger.error("No more processes to try killing in this cycle.")
+                            break
+                        await asyncio.sleep(1) # Delay to prevent busy-looping
+                    # 进程退出时内存已释放，成功后立即重新检查 / Memory is released on exit, so re-check right away after a successful kill
 
-    # --- End of Placeholder ---
+                thaw_all()
+                incident_event.clear()
+                logger.info(f"Daemon RSS during incident: {daemon_rss_start // 1024}KB at start, peak {daemon_rss_peak // 1024}KB.")
+                end_incident()
+                if validated_config['shadow_mode'] and not (memory_ok and swap_ok):
+                    # 影子模式不会释放内存，避免立即重新进入事件 / Shadow mode frees nothing, so do not re-enter the incident right away
+                    await wait_for_pressure(validated_config['min_query_interval_seconds'])
 
-    logger.debug(f"Notification function for user '{username}' completed.")
+            else:
+                time_to_exhaustion, memory_slope = estimate_time_to_exhaustion()
+                interval = next_query_interval(time_to_exhaustion)
+                if time_to_exhaustion is not None:
+                    logger.debug(f"Available memory changing {memory_slope / 1024 / 1024:+.1f}MB/s, threshold predicted in {time_to_exhaustion:.1f}s.")
+                    if validated_config['proactive_kill']:
+                        await proactive_kill(time_to_exhaustion, memory_slope)
+                if psi_poller is not None:
+                    logger.debug(f"Memory and swap usage normal. Waiting up to {interval:g} seconds for memory pressure...")
+                else:
+                    logger.debug(f"Memory and swap usage normal. Sleeping for {interval:g} seconds...")
+                if await wait_for_pressure(interval):
+                    pressure = read_memory_pressure() or {}
+                    (logger.debug if psi_stalling else logger.info)(
+                        f"Memory pressure stall event received (some avg10={pressure.get('some', {}).get('avg10', 0.0)}%, "
+                        f"full avg10={pressure.get('full', {}).get('avg10', 0.0)}%), re-checking memory and swap usage.")
+                    psi_stalling = True
+                elif psi_stalling and not reload_requested:
+                    logger.info(f"No memory pressure stall events for {interval:g} seconds.")
+                    psi_stalling = False
+
+        except asyncio.CancelledError:
+            raise # Python < 3.8 以 Exception 派生 CancelledError / CancelledError derives from Exception before Python 3.8
+        except Exception as e:
+            logger.exception(f"Unexpected error in main loop: {e}")
+            thaw_all()
+            incident_event.clear()
+            await asyncio.sleep(validated_config['query_interval_seconds'])
+
+def run_event_loop(config_path):
+    """Run the monitor and the incident sampler as concurrent tasks until the monitor is cancelled by a signal."""
+    global monitor_task
+    sampler = event_loop.create_task(sample_during_incidents())
+    monitor_task = event_loop.create_task(monitor(config_path))
+    try:
+        event_loop.run_until_complete(monitor_task)
+    except asyncio.CancelledError:
+        pass
+    finally:
+        sampler.cancel()
+        event_loop.run_until_complete(asyncio.gather(sampler, return_exceptions=True))
+
+# --- Control Socket ---
+def open_control_socket():
+    """Listen on control_socket and answer requests on the event loop; does nothing when control_socket is empty."""
+    global control_socket
+    path = validated_config['control_socket']
+    if not path:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        sock = open_fleet_socket(f'unix:{path}', listen=True)
+        os.chmod(path, 0o600) # 状态中包含其他用户的命令行 / Status replies include other users' command lines
+    except OSError as e:
+        logger.error(f"Failed to open control socket {path}: {e}")
+        return
+    sock.setblocking(False)
+    event_loop.add_reader(sock.fileno(), accept_control_client, sock)
+    control_socket = sock
+    logger.info(f"Answering status requests on {path}")
+
+def close_control_socket():
+    """Stop listening on the control socket and remove the socket file."""
+    global control_socket
+    if control_socket is None:
+        return
+    path = control_socket.getsockname()
+    event_loop.remove_reader(control_socket.fileno())
+    control_socket.close()
+    control_socket = None
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+def accept_control_client(sock):
+    """Event loop reader callback: accept a control connection and answer it in its own task."""
+    try:
+        conn, _ = sock.accept()
+    except OSError:
+        return
+    conn.setblocking(False)
+    event_loop.create_task(handle_control_client(conn))
+
+async def handle_control_client(conn):
+    """Read one JSON request line, answer it with one JSON line and close the connection."""
+    try:
+        data = b''
+        while not data.endswith(b'\n') and len(data) < CONTROL_MAX_REQUEST:
+            chunk = await asyncio.wait_for(event_loop.sock_recv(conn, CONTROL_MAX_REQUEST), CONTROL_TIMEOUT)
+            if not chunk:
+                break
+            data += chunk
+        request = json.loads(data.decode())
+        if request.get('type') == 'status':
+            reply = daemon_status(min(max(int(request.get('limit', DEFAULT_HOG_CANDIDATES)), 1), 100))
+        else:
+            reply = {'error': f"unknown request type {request.get('type')!r}"}
+        await asyncio.wait_for(event_loop.sock_sendall(conn, encode_fleet_events([reply])), CONTROL_TIMEOUT)
+    except asyncio.CancelledError:
+        raise # Python < 3.8 以 Exception 派生 CancelledError / CancelledError derives from Exception before Python 3.8
+    except Exception as e:
+        logger.debug(f"Control request failed: {e}")
+    finally:
+        conn.close()
+
+def remember_ranking(kind, ranked, limit=None):
+    """Keep the latest ranked 'processes' (top `limit`) or 'cgroups' (all, limit None) for status requests."""
+    last_ranking[kind] = {'time': time.monotonic(), 'limit': limit, 'ranked': ranked}
+
+def cached_ranking(kind, limit):
+    """Return the latest ranking of `kind` and its age in seconds, ranking again only while idle and the cache is stale.
+
+    During an incident the monitor's own ranking is served as it is, so status requests never add a scan to the kill path.
+    """
+    cached = last_ranking.get(kind)
+    now = time.monotonic()
+    stale = (cached is None or now - cached['time'] >= validated_config['min_query_interval_seconds']
+             or (cached['limit'] is not None and cached['limit'] < limit))
+    if stale and not incident_event.is_set():
+        avoid_names = validated_config['avoid_processes']
+        prioritize_names = validated_config['prioritize_kill_processes']
+        if kind == 'cgroups':
+            remember_ranking(kind, get_cgroup_hogs(set(), avoid_names, prioritize_names))
+        else:
+            remember_ranking(kind, get_memory_hogs([], avoid_names, prioritize_names, limit=limit), limit)
+        cached = last_ranking[kind]
+    if cached is None:
+        return [], None
+    return cached['ranked'][:limit], round(time.monotonic() - cached['time'], 1)
+
+def daemon_status(limit):
+    """Build a status reply: the last pressure check, current PSI and the top `limit` candidates as last ranked.
+
+    Candidates are the monitor's latest ranking; only an idle daemon ranks again, at most every min_query_interval_seconds.
+    No process is frozen or signalled.
+    """
+    time_to_exhaustion, memory_slope = estimate_time_to_exhaustion()
+    status = {
+        'pid': os.getpid(),
+        'uptime_seconds': round(time.monotonic() - daemon_started, 1),
+        'shadow_mode': validated_config['shadow_mode'],
+        'victim_mode': validated_config['victim_mode'],
+        'score_formula': validated_config['score_formula'],
+        'memory_accounting': validated_config['memory_accounting'],
+        'min_available_memory_percentage': validated_config['min_available_memory_percentage'],
+        'min_available_swap_percentage': validated_config['min_available_swap_percentage'],
+        'last_check': dict(last_check, age_seconds=round(time.time() - last_check['time'], 1)) if last_check else None,
+        'thrashing': thrashing if validated_config['memory_accounting'] == 'detailed' else None,
+        'incident': incident_event.is_set(),
+        'frozen': len(frozen_processes) + len(frozen_cgroups),
+        'pressure': read_memory_pressure(),
+        'time_to_exhaustion_seconds': None if time_to_exhaustion is None else round(time_to_exhaustion, 1),
+        'memory_slope_bytes_per_second': round(memory_slope),
+    }
+    if validated_config['victim_mode'] == 'cgroup':
+        groups, _ = cached_ranking('cgroups', limit)
+        status['cgroups'] = [{'name': group['name'], 'username': group['username'], 'memory': group['memory'], 'reclaimable': group['reclaimable'],
+                              'prioritized': group['prioritized']} for group in groups]
+    hogs, status['candidates_age_seconds'] = cached_ranking('processes', limit)
+    status['candidates'] = [{'pid': hog['pid'], 'username': hog['username'], 'name': hog['name'], 'rss': hog['rss'], 'swap': hog['swap'],
+                             'score': hog['score'], 'reason': victim_reason(hog), 'cmdline': hog['cmdline']} for hog in hogs]
+    return status
+
+def control_socket_path(config_path):
+    """Return control_socket from the config file without validating the rest of it, so `status` starts fast."""
+    config = configparser.ConfigParser()
+    try:
+        config.read(config_path)
+    except configparser.Error:
+        return DEFAULT_CONTROL_SOCKET
+    path = config.get('General', 'control_socket', fallback=DEFAULT_CONTROL_SOCKET).strip()
+    return os.path.abspath(path) if path else ''
+
+def show_status(socket_path, limit, as_json):
+    """Ask the running daemon for its status over the control socket and print it. Returns the process exit code."""
+    if not socket_path:
+        print("control_socket is disabled in the configuration, pass --socket to override.", file=sys.stderr)
+        return 1
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(CONTROL_TIMEOUT)
+        sock.connect(socket_path)
+        sock.sendall(encode_fleet_events([{'type': 'status', 'limit': limit}]))
+        response = b''
+        while not response.endswith(b'\n'):
+            data = sock.recv(65536)
+            if not data:
+                break
+            response += data
+        sock.close()
+        reply = json.loads(response.decode())
+    except (OSError, ValueError) as e:
+        print(f"Cannot get status from the daemon at {socket_path}: {e}", file=sys.stderr)
+        return 1
+    if 'error' in reply:
+        print(f"Status request failed: {reply['error']}", file=sys.stderr)
+        return 1
+    if as_json:
+        print(json.dumps(reply, indent=2))
+        return 0
+
+    print(f"oomkiller PID {reply['pid']}, up {reply['uptime_seconds']:g}s, victim mode {reply['victim_mode']}, score formula {reply['score_formula']}, "
+          f"accounting {reply['memory_accounting']}" + (", SHADOW MODE" if reply['shadow_mode'] else ""))
+    check = reply['last_check']
+    if check:
+        print(f"Memory: {check['available_memory_percentage']:.1f}% available (min {reply['min_available_memory_percentage']:g}%), "
+              f"swap: {check['available_swap_percentage']:.1f}% available (min {reply['min_available_swap_percentage']:g}%), checked {check['age_seconds']:g}s ago")
+    pressure = reply['pressure']
+    if pressure:
+        print(f"PSI: some avg10={pressure.get('some', {}).get('avg10', 0.0)}%, full avg10={pressure.get('full', {}).get('avg10', 0.0)}%")
+    if reply['time_to_exhaustion_seconds'] is not None:
+        print(f"Trend: available memory changing {reply['memory_slope_bytes_per_second'] / 1024 / 1024:+.1f}MB/s, "
+              f"threshold predicted in {reply['time_to_exhaustion_seconds']:g}s")
+    state = [text for flag, text in ((reply['incident'], 'incident in progress'), (reply['thrashing'], 'thrashing'),
+                                     (reply['frozen'], f"{reply['frozen']} frozen")) if flag]
+    if state:
+        print(f"State: {', '.join(state)}")
+    if 'cgroups' in reply:
+        print()
+        print_table([['CGROUP', 'USER', 'MEMORY', 'RECLAIMABLE', 'PRIORITIZED']] +
+                    [[group['name'], group['username'], f"{group['memory'] // 1024 // 1024}MB", f"{group['reclaimable'] // 1024 // 1024}MB",
+                      'yes' if group['prioritized'] else ''] for group in reply['cgroups']])
+    print()
+    if reply.get('candidates_age_seconds') is not None:
+        print(f"Candidates ranked {reply['candidates_age_seconds']:g}s ago:")
+    print_table([['PID', 'USER', 'NAME', 'RSS', 'SWAP', 'SCORE', 'REASON']] +
+                [[str(hog['pid']), hog['username'], hog['name'], f"{hog['rss'] // 1024 // 1024}MB", f"{hog['swap'] // 1024 // 1024}MB",
+                  f"{hog['score'] // 1024 // 1024}MB", hog['reason']] for hog in reply['candidates']])
+    return 0
 
 # --- Main Execution ---
 def main():
     """Main entry point with command-line argument parsing."""
+    global daemon_started
     # --- Argument Parsing ---
     parser = argparse.ArgumentParser(description="OOM Killer with process avoidance, prioritization, and notification.")
     parser.add_argument('--config', default=DEFAULT_CONFIG_PATH,
@@ -344,25 +3691,79 @@ def main():
     parser_test.add_argument('--message', default='This is a test notification from OOM Killer.',
                              help='Optional custom message for the test.')
 
+    # history command
+    parser_history = subparsers.add_parser('history', help='Show kills recorded in the kill history journal.')
+    parser_history.add_argument('--limit', type=int, default=20, help='Number of rows to show (default: 20).')
+    parser_history.add_argument('--user', help='Only show kills of processes owned by this user.')
+    parser_history.add_argument('--offenders', action='store_true', help='Summarize kills per process name and user, most frequent first.')
+
+    # fleet collector / query commands, these do not need the daemon configuration
+    parser_collector = subparsers.add_parser('collector', help='Run the fleet collector that aggregates events from many daemons.')
+    parser_collector.add_argument('--listen', default=DEFAULT_FLEET_ADDRESS, help=f'host:port or unix:/path to listen on (default: {DEFAULT_FLEET_ADDRESS}).')
+    parser_collector.add_argument('--db', default='/var/lib/oomkiller/fleet.db', help='SQLite database for fleet events (default: /var/lib/oomkiller/fleet.db).')
+    parser_collector.add_argument('--retention-days', type=int, default=30, help='Days to keep fleet kills and incidents (default: 30).')
+    parser_collector.add_argument('--token-file', type=fleet_token_file, dest='token', metavar='PATH', help='File with the shared token agents and queries must send (fleet_token); recommended unless listening on localhost or a Unix socket.')
+    parser_fleet_query = subparsers.add_parser('fleet-query', help='Run a fleet-wide query against a collector.')
+    parser_fleet_query.add_argument('query', choices=sorted(FLEET_QUERIES), help='Query to run.')
+    parser_fleet_query.add_argument('--collector', default=DEFAULT_FLEET_ADDRESS, help=f'Collector address (default: {DEFAULT_FLEET_ADDRESS}).')
+    parser_fleet_query.add_argument('--hours', type=float, default=24, help='Look back this many hours (default: 24).')
+    parser_fleet_query.add_argument('--limit', type=int, default=20, help='Number of rows to show (default: 20).')
+    parser_fleet_query.add_argument('--token-file', type=fleet_token_file, dest='token', metavar='PATH', help="File with the collector's shared token.")
+
+    # replay command
+    parser_replay = subparsers.add_parser('replay', help='Replay pressure traces through configs and score formulas without killing anything.')
+    parser_replay.add_argument('traces', nargs='+', help='Trace files written by the daemon (trace_dir).')
+    parser_replay.add_argument('--policy', action='append', metavar='CONFIG', help='Config file to evaluate, may be repeated (default: --config).')
+    parser_replay.add_argument('--score-formula', action='append', choices=sorted(SCORE_FORMULAS), help="Score formula to evaluate with every config, may be repeated (default: each config's own).")
+
+    # status command, asks the running daemon instead of scanning /proc
+    parser_status = subparsers.add_parser('status', help='Show current memory pressure and the top kill candidates from the running daemon.')
+    parser_status.add_argument('--socket', help='Control socket of the daemon (default: control_socket from the config file).')
+    parser_status.add_argument('--limit', type=int, default=DEFAULT_HOG_CANDIDATES, help=f'Number of candidates to show (default: {DEFAULT_HOG_CANDIDATES}).')
+    parser_status.add_argument('--json', action='store_true', help='Print the raw JSON reply.')
+
     args = parser.parse_args()
     config_path = args.config
 
-    # --- Logging Setup (Initial) ---
-    # Setup logging early, potentially before reading final log path from config
-    # Use a temporary basic setup or the default path initially
-    setup_logging(DEFAULT_LOG_PATH)
+    # --- Handle status and fleet-query Commands ---
+    # 只与守护进程或收集端通信，不需要日志、配置校验和 psutil / Only talk to the daemon or a collector, no logging, config validation or psutil needed
+    if args.command == 'status':
+        sys.exit(show_status(args.socket or control_socket_path(config_path), args.limit, args.json))
+    if args.command == 'fleet-query':
+        sys.exit(fleet_query(args.collector, args.query, args.hours, args.limit, args.token))
+
+    # --- Handle collector and replay Commands ---
+    # 这两个命令不使用守护进程配置中的 log_path / These commands do not use log_path from the daemon configuration
+    if args.command == 'collector':
+        setup_logging(DEFAULT_LOG_PATH)
+        signal.signal(signal.SIGTERM, signal_handler)
+        try:
+            run_collector(args.listen, args.db, args.retention_days, args.token)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            logger.info("--- Fleet collector terminated ---")
+        sys.exit(0)
+    if args.command == 'replay':
+        # 结果输出到 stdout，日志只写 stderr / Results go to stdout, logs only to stderr
+        setup_cli_logging()
+        import_daemon_modules()
+        sys.exit(replay_traces(args.traces, args.policy or [config_path], args.score_formula))
 
     # --- Load Configuration ---
+    # 加载期间的日志先缓存，随后只按配置的 log_path 设置一次日志 / Records are buffered while loading, then logging is set up once with the configured log_path
+    buffer_startup_logging()
     load_config(config_path) # Load config using path from args or default
 
-    # --- Re-setup Logging (Final) ---
-    # Use the potentially updated log_path from validated_config
-    for handler in logger.handlers[:]:
-        handler.close()
-        logger.removeHandler(handler)
-    # Check if validated_config['log_path'] exists before using it
-    final_log_path = validated_config.get('log_path', DEFAULT_LOG_PATH)
-    setup_logging(final_log_path)
+    # --- Handle history Command ---
+    # 只读取历史记录，不写守护进程的日志文件 / Only reads the journal, never writes to the daemon's log file
+    if args.command == 'history':
+        setup_cli_logging()
+        sys.exit(show_history(args.limit, args.user, args.offenders))
+
+    setup_logging(validated_config['log_path'])
+    # sys.exit() 时写出日志队列中剩余的记录 / Write out what is left in the log queue on sys.exit()
+    atexit.register(stop_logging)
 
     # --- Handle notify-test Command ---
     if args.command == 'notify-test':
@@ -374,105 +3775,77 @@ def main():
              logger.error("Notification channel is not configured ([Notify] notification_channel). Cannot send test.")
              sys.exit(1)
 
-        # Use the user_id directly as the 'username' for the test function call
-        # The actual implementation inside send_notification_to_user would need to map this ID
-        send_notification_to_user(
-            username=args.user_id, # Pass the command-line user_id here
-            process_name="TestProcess",
-            pid=12345,
-            cmdline="test command",
-            message=args.message
-        )
-        logger.info("notify-test command finished.")
-        sys.exit(0) # Exit after test command
+        # Use the user_id directly as the receive_id and deliver synchronously so the result is reported here
+        delivered = deliver_with_retry(args.user_id, args.message)
+        logger.info(f"notify-test command finished: {'delivered' if delivered else 'failed'}.")
+        sys.exit(0 if delivered else 1) # Exit after test command
 
     # --- Normal Operation ---
     logger.info("--- OOM Killer initialized (Normal Operation) ---")
     logger.info(f"Using configuration file: {config_path}")
-    logger.info(f"Query interval: {validated_config['query_interval_seconds']} seconds")
+    logger.info(f"Query interval: {validated_config['query_interval_seconds']} seconds (adaptive down to {validated_config['min_query_interval_seconds']} seconds)")
     logger.info(f"Kill wait: {validated_config['kill_wait_seconds']} seconds")
+    logger.info(f"Max batch kills: {validated_config['max_batch_kills']}")
+    logger.info(f"Shadow mode: {validated_config['shadow_mode']} (traces: {validated_config['trace_dir'] or 'disabled'})")
+    logger.info(f"Memory accounting: {validated_config['memory_accounting']}" + (
+        f" (thrashing at {validated_config['thrash_swapin_pages_per_second']:g} swap-ins/s or {validated_config['thrash_majfault_per_second']:g} major faults/s"
+        f" with file cache below {validated_config['thrash_file_cache_percentage']:g}%, over {validated_config['thrash_window_seconds']:g}s)"
+        if validated_config['memory_accounting'] == 'detailed' else ''))
+    logger.info(f"Freeze victims: {validated_config['freeze_victims']} (reassess for {validated_config['freeze_seconds']:g} seconds)")
     logger.info(f"Min available memory: {validated_config['min_available_memory_percentage']}%")
     logger.info(f"Min available swap: {validated_config['min_available_swap_percentage']}%")
+    logger.info(f"Trigger mode: {validated_config['trigger_mode']}")
+    logger.info(f"Victim mode: {validated_config['victim_mode']}")
+    logger.info(f"Emergency mode: {validated_config['emergency_mode']}")
+    logger.info(f"Proactive kill: {validated_config['proactive_kill']} (within {validated_config['proactive_kill_seconds']} seconds of predicted exhaustion)")
+    logger.info(f"Score formula: {validated_config['score_formula']} (oom_score_adj: {validated_config['score_oom_score_adj']}, candidates: {validated_config['score_candidates']})")
+    logger.info(f"Kill history: {validated_config['history_path'] or 'disabled'} (prioritize repeat offenders: {validated_config['prioritize_repeat_offenders']})")
+    logger.info(f"User quotas: {validated_config['user_quotas']['text'] or 'none'} (fair share: {validated_config['fair_share']})")
     logger.info(f"Avoid processes: {validated_config['avoid_processes']}")
     logger.info(f"Prioritize kill processes: {validated_config['prioritize_kill_processes']}")
+    logger.info(f"Metrics: {validated_config['metrics']['enable_metrics']}")
+    logger.info(f"Fleet collector: {validated_config['fleet']['fleet_collector'] or 'disabled'}")
     logger.info(f"Enable notifications: {validated_config['enable_notifications']}") # Log notification status
     if validated_config['enable_notifications']:
          logger.info(f"Notification channel: {validated_config.get('notify', {}).get('notification_channel', 'N/A')}")
 
+    logger.info(f"Control socket: {validated_config['control_socket'] or 'disabled'}")
+    log_rate_limit = f"{validated_config['log_rate_limit_burst']} per {validated_config['log_rate_limit_seconds']:g}s" if validated_config['log_rate_limit_seconds'] else 'disabled'
+    logger.info(f"Log format: {validated_config['log_format']} (queue: {validated_config['log_queue_size'] or 'disabled'}, rate limit: {log_rate_limit})")
+
     if os.geteuid() != 0:
         logger.warning("OOM Killer not running as root, may lack permissions to query/kill all processes or send notifications depending on implementation.")
 
-    # Register signal handlers only for normal operation
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-
-    # --- Main Loop ---
-    while True:
-        try:
-            memory_ok, swap_ok, available_memory_percentage, available_swap_percentage = check_memory_swap_usage()
-
-            if not memory_ok or not swap_ok:
-                reason = []
-                if not memory_ok: reason.append(f"Memory: {available_memory_percentage:.1f}% available")
-                if not swap_ok: reason.append(f"Swap: {available_swap_percentage:.1f}% available")
-                logger.warning(f"Memory or swap usage critical: {', '.join(reason)}")
-
-                avoid_pids = set()
-                avoid_names = set(validated_config['avoid_processes'])
-                prioritize_names = validated_config['prioritize_kill_processes']
-
-                while True:
-                    memory_ok, swap_ok, _, _ = check_memory_swap_usage()
-                    if memory_ok and swap_ok:
-                        logger.info("Memory and swap usage sufficient now.")
-                        break
-
-                    hogs = get_memory_hogs(avoid_pids, avoid_names, prioritize_names)
-                    #print(hogs) # Removed the debug print added by user
-
-                    if not hogs:
-                        logger.error("Low resource condition persists, but no killable memory hogs found.")
-                        break
-
-                    target_hog = hogs[0]
-
-                    if target_hog['prioritized']:
-                        logger.info(f"Prioritizing kill for process PID={target_hog['pid']}, User={target_hog['username']}, Name={target_hog['name']} based on config.")
-
-                    # Pass username to kill_process
-                    killed = kill_process(
-                        target_hog['pid'],
-                        target_hog['name'],
-                        target_hog['cmdline'],
-                        target_hog['rss'],
-                        target_hog['username'] # Pass username here
-                    )
-
-                    if not killed:
-                        avoid_pids.add(target_hog['pid'])
-                        avoid_names.add(target_hog['name'])
-                        logger.error(f"Failed to kill PID={target_hog['pid']}, adding to temporary avoid list.")
-                        if len(hogs) <= 1:
-                            logger.error("No more processes to try killing in this cycle.")
-                            break
-                    else:
-                        time.sleep(1) # Shorter delay after successful kill
-
-                    time.sleep(1) # Delay to prevent busy-looping
+    daemon_started = time.monotonic()
+    import_daemon_modules()
+    setup_event_loop()
 
-            else:
-                logger.info(f"Memory and swap usage normal. Sleeping for {validated_config['query_interval_seconds']} seconds...")
-                time.sleep(validated_config['query_interval_seconds'])
+    if validated_config['trigger_mode'] == 'psi' and not setup_psi_triggers():
+        logger.warning("PSI triggers unavailable (kernel without CONFIG_PSI or insufficient privileges), falling back to interval polling.")
 
-        except KeyboardInterrupt:
-            logger.info("Received KeyboardInterrupt, exiting gracefully...")
-            break
+    start_metrics_exporter()
+    open_history()
+    start_fleet_agent()
+    open_control_socket()
 
-        except Exception as e:
-            logger.exception(f"Unexpected error in main loop: {e}")
-            time.sleep(validated_config['query_interval_seconds'])
+    if validated_config['emergency_mode']:
+        enable_emergency_mode()
 
-    logger.info("--- OOM Killer terminated ---")
+    # --- Main Loop ---
+    try:
+        run_event_loop(config_path)
+    finally:
+        thaw_all()
+        end_incident()
+        close_trace()
+        stop_notification_worker()
+        stop_metrics_exporter()
+        stop_fleet_agent()
+        close_history()
+        close_psi_triggers()
+        close_control_socket()
+        event_loop.close()
+        logger.info("--- OOM Killer terminated ---")
 
 if __name__ == "__main__":
     main()